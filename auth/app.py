@@ -1,6 +1,10 @@
-from flask import Flask, json, request, jsonify
+from flask import Flask, json, request, jsonify, current_app, g
 from flask_cors import CORS
 import sys, os
+import math
+import threading
+import time
+from collections import Counter
 from functools import wraps
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from shared.models.base import Base
@@ -9,7 +13,9 @@ from shared.models.review import Review
 from shared.models.inventory import InventoryItem
 from shared.models.wishlist import Wishlist
 from shared.database import engine, SessionLocal
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, unset_jwt_cookies
+from shared.schema import upgrade_schema
+from shared.ledger import get_balance
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, unset_jwt_cookies, verify_jwt_in_request
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 
@@ -17,6 +23,7 @@ app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 # Configure JWT
 app.config['JWT_SECRET_KEY'] = 'secret-key'
@@ -24,6 +31,234 @@ jwt = JWTManager(app)
 
 ph = PasswordHasher()
 
+class TokenBucket:
+    """
+    In-memory token bucket used by the default rate limit backend.
+
+    Attributes:
+        capacity (int): The maximum number of tokens the bucket can hold.
+        refill_rate (float): The number of tokens added back per second.
+        tokens (float): The number of tokens currently available.
+        updated_at (float): The monotonic timestamp of the last refill.
+    """
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.refill_rate = capacity / float(period)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def consume(self):
+        """
+        Take one token from the bucket.
+
+        Returns:
+            tuple: A boolean indicating whether the request is allowed, and the number of
+            seconds to wait before a token becomes available (0 if allowed).
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0
+        return False, (1 - self.tokens) / self.refill_rate
+
+class MemoryRateLimitBackend:
+    """
+    Rate limit backend keeping one token bucket per key in process memory.
+
+    Suitable for a single-process deployment. Idle buckets are dropped once the
+    number of tracked keys exceeds `max_keys` so memory stays bounded.
+    """
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key, limit, period):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self._evict_idle()
+                bucket = self.buckets[key] = TokenBucket(limit, period)
+            return bucket.consume()
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        idle = [key for key, bucket in self.buckets.items()
+                if bucket.tokens + (now - bucket.updated_at) * bucket.refill_rate >= bucket.capacity]
+        for key in idle:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.clear()
+
+class RedisRateLimitBackend:
+    """
+    Rate limit backend shared by several processes through Redis.
+
+    Uses fixed windows of `period` seconds counted with INCR/EXPIRE, so every worker
+    of every service sees the same counters. Requires the optional `redis` package.
+    """
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def consume(self, key, limit, period):
+        window = int(time.time() // period)
+        redis_key = f"ratelimit:{key}:{window}"
+        pipeline = self.client.pipeline()
+        pipeline.incr(redis_key)
+        pipeline.expire(redis_key, period)
+        count, _ = pipeline.execute()
+        if count <= limit:
+            return True, 0
+        return False, (window + 1) * period - time.time()
+
+    def reset(self):
+        for key in self.client.scan_iter("ratelimit:*"):
+            self.client.delete(key)
+
+def create_rate_limit_backend():
+    """
+    Build the rate limit backend from the environment.
+
+    Uses Redis when `RATE_LIMIT_REDIS_URL` is set, otherwise falls back to the in-memory backend.
+    """
+    redis_url = os.getenv("RATE_LIMIT_REDIS_URL")
+    if redis_url:
+        return RedisRateLimitBackend(redis_url)
+    return MemoryRateLimitBackend()
+
+rate_limit_backend = create_rate_limit_backend()
+rate_limit_rejections = Counter()
+rate_limit_lock = threading.Lock()
+
+def get_rate_limit_stats():
+    """
+    Return the number of requests rejected by `rate_limit`, per endpoint.
+    """
+    with rate_limit_lock:
+        return dict(rate_limit_rejections)
+
+def _client_address():
+    """
+    Return the client IP address of the current request.
+
+    When the service runs behind the gateway, set `TRUSTED_PROXY_HOPS` to the number of
+    proxies in front of it so the address is read from `X-Forwarded-For` instead of the
+    proxy's own address. Only set it when the service cannot be reached except through
+    those proxies, since clients can send any `X-Forwarded-For` they like.
+    """
+    hops = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+    forwarded_for = [address.strip() for address in request.headers.get("X-Forwarded-For", "").split(",") if address.strip()]
+    if hops and len(forwarded_for) >= hops:
+        return forwarded_for[-hops]
+    return request.remote_addr
+
+def _rate_limit_identity(scope):
+    """
+    Resolve the value a request is keyed on for the given scope.
+
+    The "user" scope uses the username from the verified JWT and falls back to the
+    client IP when the request carries no identity.
+    """
+    if scope == "user":
+        try:
+            identity = json.loads(get_jwt_identity())
+            if identity.get("username"):
+                return f"user:{identity['username']}"
+        except Exception:
+            pass
+    return f"ip:{_client_address()}"
+
+def gateway_identity():
+    """
+    Return the identity the gateway verified for the current request, or None.
+
+    The gateway checks the JWT once and forwards the username and role in the
+    `X-Authenticated-User` and `X-Authenticated-Role` headers. They are only trusted when
+    `TRUST_GATEWAY_IDENTITY` is set, which is only safe when clients cannot reach the
+    service except through the gateway.
+    """
+    if os.getenv("TRUST_GATEWAY_IDENTITY", "0") != "1":
+        return None
+    username = request.headers.get("X-Authenticated-User")
+    role = request.headers.get("X-Authenticated-Role")
+    if not username or not role:
+        return None
+    return {"username": username, "role": role}
+
+def identity_required():
+    """
+    Require an authenticated user, like `@jwt_required()`.
+
+    Requests that carry the gateway's verified identity headers (see `gateway_identity`) are
+    accepted without decoding the JWT again. Any other request must carry a valid JWT. Either
+    way, `get_jwt_identity()` returns the user's identity afterwards.
+
+    Returns:
+        - 401 Unauthorized: If the request carries neither a verified identity nor a valid JWT.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            identity = gateway_identity()
+            if identity:
+                # Stored where flask_jwt_extended keeps a decoded token, so `get_jwt_identity()` reads it
+                g._jwt_extended_jwt = {current_app.config["JWT_IDENTITY_CLAIM"]: json.dumps(identity)}
+                g._jwt_extended_jwt_header = {}
+                g._jwt_extended_jwt_user = {"loaded_user": None}
+                g._jwt_extended_jwt_location = "headers"
+            else:
+                verify_jwt_in_request()
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def rate_limit(limit, period=60, scope="user"):
+    """
+    Limit how often a route can be called.
+
+    Each (endpoint, user or IP) pair gets its own budget of `limit` requests per
+    `period` seconds. Place it below `@identity_required()` so the user identity is available.
+    The limiter can be turned off with the `RATE_LIMIT_ENABLED` app config key.
+
+    Parameters:
+        limit (int): The number of requests allowed per period.
+        period (int): The length of the period in seconds.
+        scope (str): Either "user" (key by JWT username) or "ip" (key by client address).
+
+    Returns:
+        - 429 Too Many Requests: If the budget is exhausted. Includes a Retry-After header.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get("RATE_LIMIT_ENABLED", True):
+                return func(*args, **kwargs)
+
+            key = f"{request.endpoint}:{_rate_limit_identity(scope)}"
+            try:
+                allowed, retry_after = rate_limit_backend.consume(key, limit, period)
+            except Exception as e:
+                current_app.logger.error(f"Rate limit backend failed: {str(e)}")
+                return func(*args, **kwargs)
+
+            if not allowed:
+                with rate_limit_lock:
+                    rate_limit_rejections[request.endpoint] += 1
+                response = jsonify({"error": "Too many requests"})
+                response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+                return response, 429
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 def create_default_admin():
     """
     Create a default admin user if none exists.
@@ -62,6 +297,7 @@ def create_default_admin():
         db_session.close()
 
 @app.route("/login", methods=['POST'])
+@rate_limit(10, 60, scope="ip")
 def login():
     """
     Authenticate a user and return the access token.
@@ -78,6 +314,7 @@ def login():
         - 200 OK: If authentication is successful. Includes the access token.
         - 400 Bad Request: If the username or password is missing.
         - 401 Unauthorized: If the username or password is invalid.
+        - 429 Too Many Requests: If the client IP made too many login attempts.
         - 500 Internal Server Error: If an error occurs during authentication.
     """
     data = request.json
@@ -97,7 +334,7 @@ def login():
         except VerifyMismatchError:
             return jsonify({"error": "Invalid username or password"}), 401
 
-        access_token = create_access_token(identity=json.dumps({"username": username, "role": user.role, "wallet": user.wallet}))
+        access_token = create_access_token(identity=json.dumps({"username": username, "role": user.role, "wallet": get_balance(db_session, username)}))
 
         return jsonify({"access_token": access_token}), 200
     except Exception as e:
@@ -106,7 +343,7 @@ def login():
         db_session.close()
 
 @app.route("/logout", methods=["POST"])
-@jwt_required()
+@identity_required()
 def logout():
     """
     Logout the user by clearing the JWT cookies.
@@ -130,14 +367,17 @@ def health_check():
         GET /health
 
     Returns:
-        - 200 OK: If the service is running.
+        - 200 OK: If the service is running. Includes the rate limiter rejection counters.
     """
-    return jsonify({"status": "healthy"}), 200
+    return jsonify({"status": "healthy", "rate_limited": get_rate_limit_stats()}), 200
 
 def role_required(allowed_roles):
     """
     Restrict access to specific roles.
 
+    Place it below `@identity_required()`. The role comes from the gateway's verified
+    identity headers when the request came through the gateway, and from the JWT otherwise.
+
     Parameters:
         allowed_roles (list): A list of roles that are allowed to access the decorated route.
 
@@ -0,0 +1,133 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from auth.app import app as flask_app, rate_limit_backend, get_rate_limit_stats, TokenBucket
+import pytest
+from flask import json
+from shared.database import engine, SessionLocal
+from shared.models.base import Base
+from shared.models.customer import Customer
+from argon2 import PasswordHasher
+
+# Initialize Password Hasher
+ph = PasswordHasher()
+
+@pytest.fixture(scope='session')
+def app():
+    """
+    Creates a Flask application configured for testing.
+    """
+    # Create the database and the database tables
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield flask_app
+    # Teardown: Drop all tables
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture(scope='session')
+def client(app):
+    """
+    Provides a test client for the Flask application.
+    """
+    return app.test_client()
+
+@pytest.fixture
+def db_session():
+    """
+    Creates a new database session for a test.
+    """
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """
+    Clears the rate limiter buckets between tests.
+    """
+    rate_limit_backend.reset()
+    yield
+
+@pytest.fixture
+def add_regular_user(db_session):
+    """
+    Adds a regular customer user to the database.
+    """
+    user = db_session.query(Customer).filter_by(username='user1').first()
+    if user:
+        return user
+    user = Customer(
+        fullname="Regular User",
+        username="user1",
+        age=25,
+        address="456 User Ave",
+        gender="female",
+        marital_status="married",
+        password=ph.hash("userpass"),
+        role="customer",
+        wallet=500.0
+    )
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+# Test: Login
+def test_login(client, add_regular_user):
+    response = client.post('/login', json={'username': 'user1', 'password': 'userpass'})
+    assert response.status_code == 200
+    assert 'access_token' in response.get_json()
+
+# Test: Login with a wrong password
+def test_login_invalid_password(client, add_regular_user):
+    response = client.post('/login', json={'username': 'user1', 'password': 'wrongpass'})
+    assert response.status_code == 401
+    assert response.get_json()['error'] == 'Invalid username or password'
+
+# Test: Login is rate limited per IP
+def test_login_rate_limited(client, add_regular_user):
+    for _ in range(10):
+        response = client.post('/login', json={'username': 'user1', 'password': 'wrongpass'})
+        assert response.status_code == 401
+
+    response = client.post('/login', json={'username': 'user1', 'password': 'userpass'})
+    assert response.status_code == 429
+    assert response.get_json()['error'] == 'Too many requests'
+    assert int(response.headers['Retry-After']) >= 1
+    assert get_rate_limit_stats()['login'] >= 1
+
+    # Requests from another IP have their own budget
+    response = client.post(
+        '/login',
+        json={'username': 'user1', 'password': 'userpass'},
+        environ_base={'REMOTE_ADDR': '10.0.0.2'}
+    )
+    assert response.status_code == 200
+
+# Test: Rate limiter can be disabled
+def test_login_rate_limit_disabled(client, add_regular_user):
+    flask_app.config['RATE_LIMIT_ENABLED'] = False
+    try:
+        for _ in range(12):
+            response = client.post('/login', json={'username': 'user1', 'password': 'wrongpass'})
+            assert response.status_code == 401
+    finally:
+        flask_app.config['RATE_LIMIT_ENABLED'] = True
+
+# Test: Token bucket refills over time
+def test_token_bucket_refill():
+    bucket = TokenBucket(2, 1)
+    assert bucket.consume()[0]
+    assert bucket.consume()[0]
+    allowed, retry_after = bucket.consume()
+    assert not allowed
+    assert 0 < retry_after <= 0.5
+
+    bucket.updated_at -= 0.5
+    assert bucket.consume()[0]
+
+# Test: Health check reports rejected requests
+def test_health_check(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['status'] == 'healthy'
+    assert 'rate_limited' in data
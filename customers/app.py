@@ -2,50 +2,255 @@ from flask import Flask, json, request, jsonify
 from flask_cors import CORS
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from auth.app import role_required
+from auth.app import identity_required, role_required, rate_limit, get_rate_limit_stats
 from shared.models.base import Base
 from shared.models.customer import Customer
 from shared.models.review import Review
 from shared.models.inventory import InventoryItem
 from shared.models.order import Order
 from shared.models.wishlist import Wishlist
+from shared.models.wallet import WalletEntry, WalletSnapshot, WalletHold
+from shared.models.customer_stats import CustomerStats
 from shared.database import engine, SessionLocal
-from sqlalchemy.sql import text
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from shared.schema import upgrade_schema
+from shared.bloom_filter import CountingBloomFilter
+from shared.cache import TTLCache
+from shared.bulk import parse_records, chunked, hash_passwords
+from shared.search import NGramIndex
+from shared.tasks import start_periodic_job
+from shared.pagination import get_page_args, paginate, paginated_response, encode_cursor, decode_cursor
+from shared.ledger import from_cents, is_valid_amount, post_entry, credit_wallets, get_balance, get_balances, compact_wallets, max_entry_id, place_hold, settle_hold, expire_holds
+from sqlalchemy import insert
+from sqlalchemy.sql import text, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity
 import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import time
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor"])
 app.config['JWT_SECRET_KEY'] = 'secret-key'
 jwt = JWTManager(app)
 ph = PasswordHasher()
 
-# Create tables if not created
+# Create tables if not created, then add the columns and indexes that older tables are missing
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+
+# In-memory filter of existing usernames, lower-cased since the username column compares without
+# case. It is populated on a background thread by start_username_filter_build() at startup, or
+# on the first lookup.
+username_filter = CountingBloomFilter()
+username_filter_builder = None
+username_filter_lock = threading.Lock()
+
+# Read-through cache of the profiles served by GET /customers/<username>, keyed by username.
+# Writers invalidate the entry after committing; the TTL bounds staleness across processes.
+profile_cache = TTLCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "30"))
+)
+
+# Trigram index over username, full name and address, built on a background thread by
+# start_customer_index_build() and kept up to date by every write to a customer's searchable fields
+customer_index = NGramIndex()
+customer_index_builder = None
+customer_index_lock = threading.Lock()
+
+def index_customer(customer):
+    customer_index.add(customer.id, customer.username, customer.fullname, customer.address)
+
+def build_customer_index(batch_size=10000):
+    """
+    Build the customer search index from the database unless it is already built.
+
+    Parameters:
+        batch_size (int): The number of customers fetched per round trip.
+    """
+    db_session = SessionLocal()
+    try:
+        rows = (
+            db_session.query(Customer.id, Customer.username, Customer.fullname, Customer.address)
+            .execution_options(yield_per=batch_size)
+        )
+        customer_index.build((row.id, (row.username, row.fullname, row.address)) for row in rows)
+    except Exception:
+        app.logger.exception("Error building the customer search index")
+    finally:
+        db_session.close()
+
+def start_customer_index_build():
+    """
+    Build the customer search index on a background thread, unless it is built or being built.
+    """
+    global customer_index_builder
+    with customer_index_lock:
+        if customer_index.ready or (customer_index_builder is not None and customer_index_builder.is_alive()):
+            return
+        customer_index_builder = threading.Thread(target=build_customer_index, name="building the customer search index", daemon=True)
+        customer_index_builder.start()
+
+def rebuild_username_filter(batch_size=10000):
+    """
+    Rebuild the username Bloom filter from the customers table.
+
+    The filter is sized for twice the current number of customers so it can absorb
+    new signups before its false positive rate degrades. Signups during the scan were
+    added to the old filter, so the new one is swapped in first and only answers lookups
+    once it has caught up with every customer created since the scan began.
+
+    Parameters:
+        batch_size (int): The number of usernames fetched per round trip.
+    """
+    global username_filter
+    db_session = SessionLocal()
+    try:
+        total, last_id = db_session.query(func.count(Customer.id), func.max(Customer.id)).one()
+        new_filter = CountingBloomFilter(capacity=max(100000, total * 2))
+        for (username,) in db_session.query(Customer.username).yield_per(batch_size):
+            new_filter.add(username.lower())
+        username_filter = new_filter
+        # End the scan's transaction, so the catch-up sees rows committed since
+        db_session.rollback()
+        for (username,) in db_session.query(Customer.username).filter(Customer.id > (last_id or 0)):
+            new_filter.add(username.lower())
+        new_filter.ready = True
+    except Exception:
+        app.logger.exception("Error building the username filter")
+    finally:
+        db_session.close()
+
+def start_username_filter_build():
+    """
+    Build the username filter on a background thread, unless it is built or being built.
+    """
+    global username_filter_builder
+    with username_filter_lock:
+        if username_filter.ready or (username_filter_builder is not None and username_filter_builder.is_alive()):
+            return
+        username_filter_builder = threading.Thread(target=rebuild_username_filter, name="building the username filter", daemon=True)
+        username_filter_builder.start()
+
+def username_taken(db_session, username):
+    """
+    Check whether a username is already registered.
+
+    Usernames missing from the Bloom filter are answered from memory. Only probable
+    hits (or lookups before the filter is built) fall through to the indexed query.
+    The first lookup starts building the filter if the service has not yet.
+
+    Parameters:
+        db_session (Session): The database session used for the fallback lookup.
+        username (str): The username to check.
+
+    Returns:
+        bool: True if a customer with this username exists.
+    """
+    if not username_filter.ready:
+        start_username_filter_build()
+    elif username.lower() not in username_filter:
+        return False
+    return db_session.query(Customer.id).filter(Customer.username == username).first() is not None
+
+WALLET_BUSY = 'The wallet is busy, please try again'
+
+def change_wallet(db_session, username, amount, reference=None, attempts=3):
+    """
+    Append a credit or debit to a customer's wallet ledger.
+
+    Each change is a single INSERT into `wallet_entries`. Credits take no lock on the
+    customer row. Debits are only written if the balance covers them, so they lock the
+    customer's row first and run one at a time per customer (see `shared.ledger`).
+    Lock conflicts are retried, and reported as `WALLET_BUSY` once the attempts run out.
+
+    Parameters:
+        db_session (Session): The database session to run the insert in.
+        username (str): The username of the customer.
+        amount (float): The amount to add. Negative amounts are debits.
+        reference (str): Optional reference stored with the ledger entry.
+        attempts (int): The number of times to try before giving up on lock conflicts.
+
+    Returns:
+        tuple: The new balance (or None on failure) and an error message (or None on success).
+    """
+    for attempt in range(attempts):
+        try:
+            new_balance, error = post_entry(db_session, username, amount, reference)
+            if error:
+                db_session.rollback()
+                return None, error
+            db_session.commit()
+            profile_cache.invalidate(username)
+            return new_balance, None
+        except OperationalError:
+            db_session.rollback()
+            if attempt == attempts - 1:
+                return None, WALLET_BUSY
+            time.sleep(0.05 * (attempt + 1))
+
+def wallet_compaction_job(batch_size=500):
+    """
+    Return a periodic job that rolls wallet ledger entries into balance snapshots.
+
+    Each pass only compacts entries up to the highest entry ID seen on the previous pass,
+    so entries written by transactions that were still open are never skipped.
+
+    Parameters:
+        batch_size (int): The number of customers compacted per transaction.
+    """
+    watermark = 0
+    def compact(db_session):
+        nonlocal watermark
+        if watermark:
+            compact_wallets(db_session, watermark, batch_size)
+        watermark = max_entry_id(db_session)
+    return compact
+
+def release_expired_holds(db_session, batch_size=500):
+    """
+    Release wallet holds whose TTL has passed.
+
+    Parameters:
+        batch_size (int): The number of holds released per transaction.
+    """
+    expire_holds(db_session, batch_size)
 
 @app.route('/customers', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(["admin"])
 def get_customers():
     """
-    Retrieve all customers from the database.
+    Retrieve customers from the database, one page at a time.
 
     Endpoint:
         GET /customers
 
+    Query Parameters:
+        - limit (int): Optional page size, the configured default if not given. Capped at the
+          configured maximum page size.
+        - cursor (str): Optional cursor returned with the previous page.
+
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(["admin"]) - Restricts access to users with the "admin" role.
 
     Returns:
-        - 200 OK: A JSON list of customer objects
+        - 200 OK: A JSON list of customer objects ordered by ID, sent as `customers` in a JSON object
+        with the `next_cursor` (also in the `X-Next-Cursor` header), unless `UNPAGINATED_LISTS` is
+        on and no page was requested.
+        - 400 Bad Request: If the limit or cursor is invalid.
         - 500 Internal Server Error: A JSON object with an "error" field if an exception occurs during database access.
     """
     db_session = SessionLocal()
     try:
-        customers = db_session.query(Customer).all()
+        limit, cursor = get_page_args()
+        customers, next_cursor = paginate(db_session.query(Customer), [Customer.id], limit, cursor)
+        balances = get_balances(db_session, [customer.id for customer in customers])
         customers_list = [
             {
                 'id': customer.id,
@@ -55,24 +260,29 @@ def get_customers():
                 'address': customer.address,
                 'gender': customer.gender,
                 'marital_status': customer.marital_status,
-                'wallet': customer.wallet,
+                'wallet': balances.get(customer.id, customer.wallet),
                 "role" : customer.role
             }
             for customer in customers
         ]
-        return jsonify(customers_list), 200
+        return paginated_response(customers_list, next_cursor, 'customers')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
 
 @app.route('/customers/<string:username>', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def get_customer_by_username(username):
     """
     Retrieve customer information by username.
 
+    Profiles are served from an in-process cache that writes in this service invalidate,
+    and that otherwise expires entries after `PROFILE_CACHE_TTL` seconds.
+
     **Endpoint**:
         GET /customers/<string:username>
 
@@ -97,6 +307,10 @@ def get_customer_by_username(username):
 
         if 'admin' not in user['role'] and user['username'] != username:
             return jsonify({'error': 'Invalid user'}), 400
+
+        customer_data = profile_cache.get(username)
+        if customer_data is not None:
+            return jsonify(customer_data), 200
         
         customer = db_session.query(Customer).filter_by(username=username).first()
         if not customer:
@@ -110,8 +324,9 @@ def get_customer_by_username(username):
             'address': customer.address,
             'gender': customer.gender,
             'marital_status': customer.marital_status,
-            'wallet': customer.wallet
+            'wallet': get_balance(db_session, username)
         }
+        profile_cache.set(username, customer_data)
         return jsonify(customer_data), 200
     except Exception as e:
         print(e)
@@ -120,6 +335,170 @@ def get_customer_by_username(username):
     finally:
         db_session.close()
 
+CUSTOMER_FIELDS = ['id', 'fullname', 'username', 'age', 'address', 'gender', 'marital_status', 'wallet', 'role']
+BATCH_LOOKUP_MAX = 500
+
+@app.route('/customers/batch', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'product_manager', 'service'])
+def get_customers_batch():
+    """
+    Retrieve many customers in a single indexed query.
+
+    Endpoint:
+        POST /customers/batch
+
+    Request Body:
+        A JSON object containing exactly one of the following fields, plus an optional projection:
+            - usernames (list[str]): The usernames to look up.
+            - ids (list[int]): The customer IDs to look up.
+            - fields (list[str]): Optional subset of customer fields to return.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'product_manager', 'service']) - Restricts access to internal callers 
+        with "admin" or "product_manager" roles, and to other services calling with a "service" token.
+
+    Returns:
+        - 200 OK: A JSON object with `customers`, a map from each requested username (or ID) to the 
+        customer's fields, and `missing`, the requested keys that do not exist.
+        - 400 Bad Request: If the keys or fields are invalid, or more than 500 keys are requested.
+        - 500 Internal Server Error: If an error occurs during database access.
+    """
+    data = request.json or {}
+    key = 'usernames' if 'usernames' in data else 'ids'
+    values = data.get(key)
+    fields = data.get('fields', CUSTOMER_FIELDS)
+
+    if ('usernames' in data) == ('ids' in data) or not isinstance(values, list):
+        return jsonify({'error': "Provide either a 'usernames' or an 'ids' list"}), 400
+    value_type = str if key == 'usernames' else int
+    if not all(isinstance(value, value_type) and not isinstance(value, bool) for value in values):
+        return jsonify({'error': f"Invalid value in '{key}'"}), 400
+    if len(values) > BATCH_LOOKUP_MAX:
+        return jsonify({'error': f'At most {BATCH_LOOKUP_MAX} customers can be requested at once'}), 400
+    if not isinstance(fields, list) or not set(fields) <= set(CUSTOMER_FIELDS):
+        return jsonify({'error': f"Invalid 'fields'. Valid options are: {', '.join(CUSTOMER_FIELDS)}."}), 400
+
+    db_session = SessionLocal()
+    try:
+        column = Customer.username if key == 'usernames' else Customer.id
+        customers = db_session.query(Customer).filter(column.in_(set(values))).all() if values else []
+        balances = get_balances(db_session, [customer.id for customer in customers]) if 'wallet' in fields else {}
+
+        found = {}
+        for customer in customers:
+            projection = {field: getattr(customer, field) for field in fields if field != 'wallet'}
+            if 'wallet' in fields:
+                projection['wallet'] = balances.get(customer.id, customer.wallet)
+            found[str(getattr(customer, column.key))] = projection
+
+        missing = [value for value in dict.fromkeys(values) if str(value) not in found]
+        return jsonify({'customers': found, 'missing': missing}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.route('/customers/search', methods=['GET'])
+@identity_required()
+@role_required(['admin'])
+def search_customers():
+    """
+    Search customers by partial username, full name or address.
+
+    Results are ranked by how many of the query's trigrams each customer matches, then by
+    how short the matched fields are, and are re-read from the database so they are never stale.
+    The index is built in the background when the service starts.
+
+    Endpoint:
+        GET /customers/search
+
+    Query Parameters:
+        - q (str): The text to search for. Must contain at least 3 characters.
+        - limit (int): Optional page size, the configured default if not given. Capped at the configured maximum.
+        - cursor (str): Optional cursor returned with the previous page.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin']) - Restricts access to users with the "admin" role.
+
+    Returns:
+        - 200 OK: A JSON object with the matching `customers`, best match first, and the `next_cursor`
+        (also in the `X-Next-Cursor` header).
+        - 400 Bad Request: If the query is too short, or the limit or cursor is invalid.
+        - 503 Service Unavailable: If the search index is still being built. Includes a Retry-After header.
+        - 500 Internal Server Error: If an exception occurs during the search.
+    """
+    query = request.args.get('q', '').strip()
+    if len(query) < 3:
+        return jsonify({'error': "Invalid value for 'q'. It must be at least 3 characters."}), 400
+    if not customer_index.ready:
+        start_customer_index_build()
+        response = jsonify({'error': 'The search index is still being built. Try again shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    db_session = SessionLocal()
+    try:
+        limit, cursor = get_page_args(always=True)
+        after = tuple(decode_cursor(cursor, 3)) if cursor else None
+        ranked = customer_index.search(query, app.config.get('SEARCH_MIN_SCORE', 0.7), limit + 1, after)
+
+        page = ranked[:limit]
+        next_cursor = encode_cursor(list(page[-1])) if len(ranked) > limit else None
+        customers = {
+            customer.id: customer
+            for customer in db_session.query(Customer).filter(Customer.id.in_([result[2] for result in page]))
+        } if page else {}
+        customers_list = [
+            {
+                'id': customers[customer_id].id,
+                'fullname': customers[customer_id].fullname,
+                'username': customers[customer_id].username,
+                'address': customers[customer_id].address,
+                'role': customers[customer_id].role
+            }
+            for _, _, customer_id in page if customer_id in customers
+        ]
+        return paginated_response({'customers': customers_list}, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.route('/customers/available', methods=['GET'])
+@rate_limit(120, 60, scope="ip")
+def check_username_available():
+    """
+    Check whether a username is free to register.
+
+    Endpoint:
+        GET /customers/available?username=<username>
+
+    Query Parameters:
+        - username (str): The username to check. Must be at least 4 characters.
+
+    Returns:
+        - 200 OK: A JSON object with the `username` and a boolean `available` field.
+        - 400 Bad Request: If the username is missing or too short.
+        - 429 Too Many Requests: If the client IP made too many checks.
+        - 500 Internal Server Error: If an error occurs during database access.
+    """
+    username = request.args.get('username', '')
+    if len(username.strip()) < 4:
+        return jsonify({'error': "Invalid value for 'username'. It must be at least 4 characters."}), 400
+
+    db_session = SessionLocal()
+    try:
+        return jsonify({'username': username, 'available': not username_taken(db_session, username)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
 @app.route('/customers', methods=['POST'])
 def add_customer():
     """
@@ -148,14 +527,13 @@ def add_customer():
     data = request.json
     db_session = SessionLocal()
     try:
-        existing_customer = db_session.query(Customer).filter_by(username=data.get('username')).first()
-        if existing_customer:
-            return jsonify({'error': 'Username is already taken'}), 400
-
         is_valid, message = Customer.validate_data(data,"add")
         if not is_valid:
             return jsonify({'error': message}), 400
 
+        if username_taken(db_session, data.get('username')):
+            return jsonify({'error': 'Username is already taken'}), 400
+
         hashed_password = ph.hash(data.get('password'))
 
         new_customer = Customer(
@@ -171,16 +549,160 @@ def add_customer():
         )
         db_session.add(new_customer)
         db_session.commit()
+        username_filter.add(new_customer.username.lower())
+        index_customer(new_customer)
 
         return jsonify({'message': 'Customer added successfully', 'customer_id': new_customer.id}), 201
+    except IntegrityError:
+        db_session.rollback()
+        return jsonify({'error': 'Username is already taken'}), 400
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
 
+IMPORT_MAX_ROWS = 10000
+IMPORT_BATCH_SIZE = 500
+
+@app.route('/customers/import', methods=['POST'])
+@identity_required()
+@role_required(['admin'])
+def import_customers():
+    """
+    Register many customers from an uploaded file in batched inserts.
+
+    Every record is validated like `POST /customers`. Usernames are checked for collisions
+    with one set query per batch, passwords are hashed across a process pool, and valid
+    records are inserted in batches. Invalid records are skipped and reported.
+
+    Endpoint:
+        POST /customers/import
+
+    Request Body:
+        Newline-delimited JSON (`application/x-ndjson`), CSV with a header row (`text/csv`)
+        or a JSON array (`application/json`) of customer records with the fields of `POST /customers`,
+        and an optional non-negative `wallet` opening balance, credited to the customer's ledger.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin']) - Restricts access to users with the "admin" role.
+
+    Returns:
+        - 200 OK: A JSON object with the number of customers `imported` and the per-row `errors`.
+        - 400 Bad Request: If the body cannot be parsed or has more than 10000 records.
+        - 500 Internal Server Error: If an exception occurs during the import.
+    """
+    try:
+        records = parse_records(request.get_data(as_text=True), request.mimetype, types={'age': int, 'wallet': float})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(records) > app.config.get('IMPORT_MAX_ROWS', IMPORT_MAX_ROWS):
+        return jsonify({'error': f"At most {app.config.get('IMPORT_MAX_ROWS', IMPORT_MAX_ROWS)} records can be imported at once"}), 400
+
+    errors = []
+    valid = []
+    seen = set()
+    for row, record, error in records:
+        if not error:
+            try:
+                is_valid, message = Customer.validate_data(record, "add")
+            except (AttributeError, TypeError):
+                is_valid, message = False, 'Invalid record'
+            if not is_valid:
+                error = message
+            elif record['username'] in seen:
+                error = 'Duplicate username in upload'
+        if error:
+            errors.append({'row': row, 'username': (record or {}).get('username'), 'error': error})
+            continue
+        seen.add(record['username'])
+        valid.append((row, record))
+
+    imported = 0
+    workers = app.config.get('IMPORT_HASH_WORKERS') or os.cpu_count() or 1
+    db_session = SessionLocal()
+    # One pool for every batch of the import; its worker processes only start once a batch is hashed in parallel
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for batch in chunked(valid, app.config.get('IMPORT_BATCH_SIZE', IMPORT_BATCH_SIZE)):
+            taken = {
+                username for (username,) in
+                db_session.query(Customer.username).filter(Customer.username.in_([record['username'] for _, record in batch]))
+            }
+            errors.extend({'row': row, 'username': record['username'], 'error': 'Username is already taken'}
+                          for row, record in batch if record['username'] in taken)
+            batch = [(row, record) for row, record in batch if record['username'] not in taken]
+            if not batch:
+                continue
+
+            hashes = hash_passwords([record['password'] for _, record in batch], workers, executor=executor)
+            rows = [
+                {
+                    'fullname': record['fullname'],
+                    'username': record['username'],
+                    'password': hashed_password,
+                    'age': record['age'],
+                    'address': record['address'],
+                    'gender': record['gender'],
+                    'marital_status': record['marital_status'],
+                    'wallet': 0.0,
+                    'role': 'customer'
+                }
+                for (_, record), hashed_password in zip(batch, hashes)
+            ]
+            try:
+                db_session.execute(insert(Customer), rows)
+                post_opening_balances(db_session, [record for _, record in batch])
+                db_session.commit()
+            except IntegrityError:
+                # A username was registered concurrently; fall back to row-by-row inserts for this batch
+                db_session.rollback()
+                inserted = []
+                for (row, record), values in zip(batch, rows):
+                    try:
+                        db_session.execute(insert(Customer), [values])
+                        post_opening_balances(db_session, [record])
+                        db_session.commit()
+                        inserted.append(values)
+                    except IntegrityError:
+                        db_session.rollback()
+                        errors.append({'row': row, 'username': record['username'], 'error': 'Username is already taken'})
+                rows = inserted
+
+            for values in rows:
+                username_filter.add(values['username'].lower())
+            if rows:
+                for customer in db_session.query(Customer).filter(Customer.username.in_([values['username'] for values in rows])):
+                    index_customer(customer)
+            imported += len(rows)
+
+        errors.sort(key=lambda error: error['row'])
+        return jsonify({'imported': imported, 'errors': errors}), 200
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e), 'imported': imported}), 500
+    finally:
+        executor.shutdown()
+        db_session.close()
+
+def post_opening_balances(db_session, records):
+    """
+    Credit the `wallet` of newly imported customers to their ledger, so every balance has an entry behind it.
+    The caller commits, together with the customers.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        records (list): The imported records. Those without a positive `wallet` are skipped.
+    """
+    for record in records:
+        if record.get('wallet'):
+            _, error = post_entry(db_session, record['username'], record['wallet'], 'import/opening-balance')
+            if error:
+                raise RuntimeError(f"Could not credit the opening balance of {record['username']}: {error}")
+
 @app.route('/customers/<string:username>', methods=['PUT'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def update_customer(username):
     """
@@ -201,7 +723,7 @@ def update_customer(username):
             - marital_status (str): The customer's marital status.
          
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'customer']) - Restricts access to users with 
         "admin" or "customer" roles.
 
@@ -234,6 +756,8 @@ def update_customer(username):
                 setattr(customer, key, value)
 
         db_session.commit()
+        profile_cache.invalidate(username, customer.username)
+        index_customer(customer)
         return jsonify({'message': f'Customer {username} updated successfully'}), 200
     except Exception as e:
         db_session.rollback()
@@ -242,7 +766,7 @@ def update_customer(username):
         db_session.close()
 
 @app.route('/customers/<string:username>/change-password', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def change_password(username):
     """
@@ -289,6 +813,7 @@ def change_password(username):
 
         customer.password = ph.hash(new_password)
         db_session.commit()
+        profile_cache.invalidate(username)
 
         return jsonify({'message': 'Password changed successfully'}), 200
     except Exception as e:
@@ -298,7 +823,7 @@ def change_password(username):
         db_session.close()
 
 @app.route('/customers/<string:username>', methods=['DELETE'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def delete_customer(username):
     """
@@ -311,7 +836,7 @@ def delete_customer(username):
         username (str): The username of the customer to be deleted.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'customer']) - Restricts access to users with 
         "admin" or "customer" roles.
 
@@ -335,9 +860,17 @@ def delete_customer(username):
         db_session.query(Order).filter_by(customer_id=customer.id).delete()
         db_session.query(Review).filter_by(customer_id=customer.id).delete()
         db_session.query(Wishlist).filter_by(customer_id=customer.id).delete()
+        db_session.query(WalletEntry).filter_by(customer_id=customer.id).delete()
+        db_session.query(WalletSnapshot).filter_by(customer_id=customer.id).delete()
+        db_session.query(WalletHold).filter_by(customer_id=customer.id).delete()
+        db_session.query(CustomerStats).filter_by(customer_id=customer.id).delete()
 
+        customer_id = customer.id
         db_session.delete(customer)
         db_session.commit()
+        username_filter.remove(username.lower())
+        profile_cache.invalidate(username)
+        customer_index.remove(customer_id)
         return jsonify({'message': f'Customer {username} deleted successfully'}), 200
     except Exception as e:
         db_session.rollback()
@@ -346,7 +879,7 @@ def delete_customer(username):
         db_session.close()
 
 @app.route('/customers/<string:username>/wallet/add', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def add_customer_wallet(username):
     """
@@ -360,10 +893,10 @@ def add_customer_wallet(username):
 
     Request Body:
         A JSON object containing the following field:
-            - amount (float): The amount to add to the customer's wallet. Must be greater than 0.
+            - amount (float): The amount to add to the customer's wallet. Must be at least 0.01.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'customer','product_manager']) - Restricts access to users with 
         "admin" or "customer" or "product_manager" roles.
 
@@ -371,12 +904,13 @@ def add_customer_wallet(username):
         - 200 OK: If the amount is successfully added to the customer's wallet. 
         - 400 Bad Request: If the amount is invalid or if a non-admin user attempts to add funds to another user's wallet.
         - 404 Not Found: If the customer with the specified username does not exist.
+        - 409 Conflict: If the wallet stayed locked by concurrent changes. The request can be retried.
         - 500 Internal Server Error: If an exception occurs during the process.
     """
     data = request.json
     amount = data.get('amount')
 
-    if not amount or amount <= 0:
+    if not is_valid_amount(amount):
         return jsonify({'error': 'Invalid amount'}), 400
 
     db_session = SessionLocal()
@@ -385,14 +919,12 @@ def add_customer_wallet(username):
 
         if 'admin' not in user['role'] and user['username'] != username:
             return jsonify({'error': 'Invalid user'}), 400
-        
-        customer = db_session.query(Customer).filter_by(username=username).first()
-        if not customer:
-            return jsonify({'error': 'Customer not found'}), 404
 
-        customer.wallet += amount
-        db_session.commit()
-        return jsonify({'message': f'Added ${amount} to {username}\'s wallet', 'new_balance': customer.wallet}), 200
+        new_balance, error = change_wallet(db_session, username, amount, 'wallet/add')
+        if error:
+            return jsonify({'error': error}), 409 if error == WALLET_BUSY else 404
+
+        return jsonify({'message': f'Added ${amount} to {username}\'s wallet', 'new_balance': new_balance}), 200
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -400,7 +932,7 @@ def add_customer_wallet(username):
         db_session.close()
 
 @app.route('/customers/<string:username>/wallet/deduct', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def deduct_customer_wallet(username):
     """
@@ -414,10 +946,10 @@ def deduct_customer_wallet(username):
 
     Request Body:
         A JSON object containing the following field:
-            - amount (float): The amount to deduct from the customer's wallet. Must be greater than 0.
+            - amount (float): The amount to deduct from the customer's wallet. Must be at least 0.01.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'customer']) - Restricts access to users with 
         "admin" or "customer" roles.
 
@@ -425,12 +957,13 @@ def deduct_customer_wallet(username):
         - 200 OK: If the amount is successfully deducted to the customer's wallet. 
         - 400 Bad Request: If the amount is invalid or if a non-admin user attempts to deduct funds from another user's wallet.
         - 404 Not Found: If the customer with the specified username does not exist.
+        - 409 Conflict: If the wallet stayed locked by concurrent changes. The request can be retried.
         - 500 Internal Server Error: If an exception occurs during the process.
     """
     data = request.json
     amount = data.get('amount')
 
-    if not amount or amount <= 0:
+    if not is_valid_amount(amount):
         return jsonify({'error': 'Invalid amount'}), 400
 
     db_session = SessionLocal()
@@ -440,28 +973,252 @@ def deduct_customer_wallet(username):
         if 'admin' not in user['role'] and user['username'] != username:
             return jsonify({'error': 'Invalid user'}), 400
 
-        customer = db_session.query(Customer).filter_by(username=username).first()
-        if not customer:
-            return jsonify({'error': 'Customer not found'}), 404
+        new_balance, error = change_wallet(db_session, username, -amount, 'wallet/deduct')
+        if error:
+            status = {'Customer not found': 404, WALLET_BUSY: 409}.get(error, 400)
+            return jsonify({'error': error}), status
 
-        if customer.wallet < amount:
-            return jsonify({'error': 'Insufficient balance'}), 400
+        return jsonify({'message': f'Deducted ${amount} from {username}\'s wallet', 'new_balance': new_balance}), 200
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+BULK_CREDIT_MAX = 10000
+BULK_CREDIT_CHUNK_SIZE = 500
+
+@app.route('/customers/wallet/credits', methods=['POST'])
+@identity_required()
+@role_required(['admin'])
+def bulk_credit_wallets():
+    """
+    Credit many customers' wallets in one request, for promotions and refunds.
+
+    Credits are applied in chunked transactions with one ledger INSERT per chunk. The batch is 
+    idempotent: sending the same `batch_id` and credits again only applies the chunks that did
+    not complete before.
+
+    Endpoint:
+        POST /customers/wallet/credits
+
+    Request Body:
+        A JSON object containing the following fields:
+            - batch_id (str): A unique identifier for the batch, at most 64 characters.
+            - credits (list): Objects with a `username` (str) and an `amount` (number) of at least 0.01. 
+            Each username may appear once.
+            - reference (str): Optional reference stored with the ledger entries.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin']) - Restricts access to users with the "admin" role.
+
+    Returns:
+        - 200 OK: A JSON object with the number of wallets `applied` by this request, the number
+        `already_applied` by earlier requests with the same batch ID, and the `missing` usernames.
+        - 400 Bad Request: If the input data fails validation or has more than 10000 credits.
+        - 409 Conflict: If the batch ID was already used with different credits.
+        - 500 Internal Server Error: If an exception occurs. Chunks applied before it are kept, 
+        so the request can be retried with the same batch ID.
+    """
+    data = request.json or {}
+    batch_id = data.get('batch_id')
+    credits = data.get('credits')
+    reference = data.get('reference')
+
+    if not isinstance(batch_id, str) or not (1 <= len(batch_id) <= 64):
+        return jsonify({'error': "Invalid 'batch_id'. It must be a string of 1 to 64 characters."}), 400
+    if not isinstance(credits, list) or not credits:
+        return jsonify({'error': "Invalid 'credits'. It must be a non-empty list."}), 400
+    if len(credits) > app.config.get('BULK_CREDIT_MAX', BULK_CREDIT_MAX):
+        return jsonify({'error': f"At most {app.config.get('BULK_CREDIT_MAX', BULK_CREDIT_MAX)} credits can be applied at once"}), 400
+    if reference is not None and (not isinstance(reference, str) or len(reference) > 100):
+        return jsonify({'error': "Invalid 'reference'. It must be a string of at most 100 characters."}), 400
+    for position, credit in enumerate(credits):
+        if (not isinstance(credit, dict) or not isinstance(credit.get('username'), str)
+                or not is_valid_amount(credit.get('amount'))):
+            return jsonify({'error': f'Invalid credit at position {position}'}), 400
+    if len({credit['username'] for credit in credits}) != len(credits):
+        return jsonify({'error': 'Each username may only be credited once per batch'}), 400
 
-        customer.wallet -= amount
+    db_session = SessionLocal()
+    try:
+        summary, error = credit_wallets(
+            db_session,
+            batch_id,
+            [(credit['username'], credit['amount']) for credit in credits],
+            reference,
+            app.config.get('BULK_CREDIT_CHUNK_SIZE', BULK_CREDIT_CHUNK_SIZE)
+        )
+        if error:
+            return jsonify({'error': error}), 409
+        profile_cache.invalidate(*summary.pop('credited'))
+        return jsonify({'batch_id': batch_id, **summary}), 200
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.route('/customers/<string:username>/wallet/holds', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def hold_customer_wallet(username):
+    """
+    Reserve funds on a customer's wallet until they are captured or voided.
+
+    Endpoint:
+        POST /customers/<string:username>/wallet/holds
+
+    Path Parameter:
+        username (str): The username of the customer whose funds are reserved.
+
+    Request Body:
+        A JSON object containing the following fields:
+            - amount (float): The amount to reserve. Must be at least 0.01.
+            - ttl (int): Optional number of seconds before the hold expires. Between 1 and 3600, defaults to 300.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'customer', 'product_manager']) - Restricts access to users with 
+        "admin" or "customer" or "product_manager" roles.
+
+    Returns:
+        - 201 Created: If the funds are reserved. Includes the hold ID and expiry time.
+        - 400 Bad Request: If the amount or TTL is invalid, the available balance is insufficient, 
+        or a non-admin user attempts to reserve funds on another user's wallet.
+        - 404 Not Found: If the customer with the specified username does not exist.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    data = request.json
+    amount = data.get('amount')
+    ttl = data.get('ttl', 300)
+
+    if not is_valid_amount(amount):
+        return jsonify({'error': 'Invalid amount'}), 400
+    if not isinstance(ttl, int) or not (1 <= ttl <= 3600):
+        return jsonify({'error': 'Invalid ttl. Must be an integer between 1 and 3600.'}), 400
+
+    db_session = SessionLocal()
+    try:
+        user = json.loads(get_jwt_identity())
+
+        if 'admin' not in user['role'] and user['username'] != username:
+            return jsonify({'error': 'Invalid user'}), 400
+
+        hold, error = place_hold(db_session, username, amount, ttl)
+        if error:
+            db_session.rollback()
+            return jsonify({'error': error}), 404 if error == 'Customer not found' else 400
         db_session.commit()
-        return jsonify({'message': f'Deducted ${amount} from {username}\'s wallet', 'new_balance': customer.wallet}), 200
+
+        return jsonify({
+            'message': f'Reserved ${amount} on {username}\'s wallet',
+            'hold_id': hold.id,
+            'expires_at': hold.expires_at.isoformat()
+        }), 201
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
 
+def settle_customer_hold(username, hold_id, status):
+    """
+    Capture or void a customer's wallet hold on behalf of the hold endpoints.
+
+    Parameters:
+        username (str): The username of the customer who owns the hold.
+        hold_id (int): The ID of the hold.
+        status (str): Either "captured" or "voided".
+
+    Returns:
+        tuple: A JSON response and status code.
+    """
+    db_session = SessionLocal()
+    try:
+        user = json.loads(get_jwt_identity())
+
+        if 'admin' not in user['role'] and user['username'] != username:
+            return jsonify({'error': 'Invalid user'}), 400
+
+        hold = (
+            db_session.query(WalletHold)
+            .join(Customer, Customer.id == WalletHold.customer_id)
+            .filter(WalletHold.id == hold_id, Customer.username == username)
+            .first()
+        )
+        if not hold:
+            return jsonify({'error': 'Hold not found'}), 404
+
+        if not settle_hold(db_session, hold, status):
+            db_session.rollback()
+            return jsonify({'error': 'Hold is no longer active'}), 409
+        db_session.commit()
+        profile_cache.invalidate(username)
+
+        return jsonify({
+            'message': f'Hold {hold_id} {status}',
+            'new_balance': get_balance(db_session, username)
+        }), 200
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.route('/customers/<string:username>/wallet/holds/<int:hold_id>/capture', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def capture_customer_hold(username, hold_id):
+    """
+    Capture a wallet hold, turning the reserved funds into a debit.
+
+    Endpoint:
+        POST /customers/<string:username>/wallet/holds/<int:hold_id>/capture
+
+    Path Parameters:
+        username (str): The username of the customer who owns the hold.
+        hold_id (int): The ID of the hold to capture.
+
+    Returns:
+        - 200 OK: If the hold is captured. Includes the new wallet balance.
+        - 400 Bad Request: If a non-admin user attempts to capture another user's hold.
+        - 404 Not Found: If the hold does not exist for this customer.
+        - 409 Conflict: If the hold was already captured, voided or has expired.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    return settle_customer_hold(username, hold_id, "captured")
+
+@app.route('/customers/<string:username>/wallet/holds/<int:hold_id>/void', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def void_customer_hold(username, hold_id):
+    """
+    Void a wallet hold, releasing the reserved funds.
+
+    Endpoint:
+        POST /customers/<string:username>/wallet/holds/<int:hold_id>/void
+
+    Path Parameters:
+        username (str): The username of the customer who owns the hold.
+        hold_id (int): The ID of the hold to void.
+
+    Returns:
+        - 200 OK: If the hold is voided.
+        - 400 Bad Request: If a non-admin user attempts to void another user's hold.
+        - 404 Not Found: If the hold does not exist for this customer.
+        - 409 Conflict: If the hold was already captured, voided or has expired.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    return settle_customer_hold(username, hold_id, "voided")
+
 @app.route('/customers/<string:username>/orders', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def get_customer_orders(username):
     """
-    Retrieve all previous orders of a customer.
+    Retrieve the order history of a customer, one page at a time, newest first.
 
     Endpoint:
         GET /customers/<string:username>/orders
@@ -469,14 +1226,24 @@ def get_customer_orders(username):
     Path Parameter:
         username (str): The username of the customer whose orders are to be retrieved.
 
+    Query Parameters:
+        - from (str): Optional ISO 8601 date or datetime. Only orders placed at or after it are returned.
+        - to (str): Optional ISO 8601 date or datetime. Only orders placed before it are returned.
+        - item_id (int): Optional ID of an inventory item to restrict the orders to.
+        - limit (int): Optional page size, the configured default if not given. Capped at the
+          configured maximum page size.
+        - cursor (str): Optional cursor returned with the previous page.
+
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'customer']) - Restricts access to users with 
         "admin" or "customer" roles.
 
     Returns:
-        - 200 OK: A JSON object containing a list of the customer's orders. 
-        - 400 Bad Request: If a non-admin user attempts to view the orders of another customer.
+        - 200 OK: A JSON object containing the page of orders (with item name, unit price, total and 
+        creation date), the `totals` of every order matching the filters, and the `next_cursor`. 
+        - 400 Bad Request: If a non-admin user attempts to view the orders of another customer,
+        or a filter, the limit or the cursor is invalid.
         - 404 Not Found: If the customer with the specified username does not exist.
         - 500 Internal Server Error: If an exception occurs during the process. 
     """
@@ -491,28 +1258,143 @@ def get_customer_orders(username):
         if not customer:
             return jsonify({'error': 'Customer not found'}), 404
 
-        orders = customer.previous_orders 
+        bounds = {}
+        for param in ('from', 'to'):
+            if request.args.get(param):
+                try:
+                    bounds[param] = datetime.fromisoformat(request.args[param])
+                except ValueError:
+                    return jsonify({'error': f"Invalid '{param}'. Must be an ISO 8601 date or datetime."}), 400
+
+        filters = [Order.customer_id == customer.id]
+        if 'from' in bounds:
+            filters.append(Order.created_at >= bounds['from'])
+        if 'to' in bounds:
+            filters.append(Order.created_at < bounds['to'])
+        if request.args.get('item_id'):
+            if not request.args['item_id'].isdigit():
+                return jsonify({'error': "Invalid 'item_id'. Must be a positive integer."}), 400
+            filters.append(Order.item_id == int(request.args['item_id']))
+
+        limit, cursor = get_page_args()
+        unit_price = func.coalesce(Order.unit_price, InventoryItem.price_per_item)
+        query = (
+            db_session.query(
+                Order.id, Order.item_id, InventoryItem.name, Order.quantity,
+                unit_price.label('unit_price'), Order.created_at
+            )
+            .join(InventoryItem, InventoryItem.id == Order.item_id)
+            .filter(*filters)
+        )
+        orders, next_cursor = paginate(query, [Order.created_at, Order.id], limit, cursor, descending=True)
+
+        order_count, total_quantity, total_spent = (
+            db_session.query(func.count(Order.id), func.sum(Order.quantity), func.sum(Order.quantity * unit_price))
+            .join(InventoryItem, InventoryItem.id == Order.item_id)
+            .filter(*filters)
+            .one()
+        )
         orders_list = [
             {
                 'order_id': order.id,
                 'item_id': order.item_id,
-                'item_name' : order.inventory_item.name,
-                'quantity': order.quantity
+                'item_name' : order.name,
+                'quantity': order.quantity,
+                'unit_price': order.unit_price,
+                'total': round(order.quantity * order.unit_price, 2),
+                'created_at': order.created_at.isoformat() if order.created_at else None
             }
             for order in orders
         ]
-        return jsonify({'orders': orders_list}), 200
+        totals = {
+            'orders': order_count,
+            'quantity': total_quantity or 0,
+            'spent': round(total_spent or 0, 2)
+        }
+        return paginated_response({'orders': orders_list, 'totals': totals}, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
         
+@app.route('/customers/<string:username>/stats', methods=['GET'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def get_customer_stats(username):
+    """
+    Retrieve the lifetime statistics of a customer.
+
+    Endpoint:
+        GET /customers/<string:username>/stats
+
+    Path Parameter:
+        username (str): The username of the customer whose statistics are to be retrieved.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'customer', 'product_manager']) - Restricts access to users with 
+        "admin", "customer" or "product_manager" roles.
+
+    Returns:
+        - 200 OK: A JSON object with the customer's order count, units purchased, lifetime spend, 
+        last purchase date and review count.
+        - 400 Bad Request: If a non-admin user attempts to view the statistics of another customer.
+        - 404 Not Found: If the customer with the specified username does not exist.
+        - 500 Internal Server Error: If an exception occurs during database access.
+    """
+    db_session = SessionLocal()
+    try:
+        user = json.loads(get_jwt_identity())
+
+        if 'admin' not in user['role'] and user['username'] != username:
+            return jsonify({'error': 'Invalid user'}), 400
+
+        row = (
+            db_session.query(Customer.id, CustomerStats)
+            .outerjoin(CustomerStats, CustomerStats.customer_id == Customer.id)
+            .filter(Customer.username == username)
+            .first()
+        )
+        if not row:
+            return jsonify({'error': 'Customer not found'}), 404
+
+        stats = row.CustomerStats
+        return jsonify({
+            'username': username,
+            'order_count': stats.order_count if stats else 0,
+            'units_purchased': stats.units_purchased if stats else 0,
+            'lifetime_spend': from_cents(stats.lifetime_spend_cents) if stats else 0.0,
+            'last_purchase_at': stats.last_purchase_at.isoformat() if stats and stats.last_purchase_at else None,
+            'review_count': stats.review_count if stats else 0
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """
+    Recompute every customer's lifetime statistics from the order and review history.
+
+    Usage:
+        flask --app customers.app rebuild-stats
+    """
+    db_session = SessionLocal()
+    try:
+        rebuilt = CustomerStats.rebuild(db_session)
+        print(f"Rebuilt statistics for {rebuilt} customers")
+    finally:
+        db_session.close()
+
 @app.route('/customers/<string:username>/wishlist', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def get_customer_wishlist(username):
     """
-    Retrieve all wishlist items of a customer.
+    Retrieve the wishlist items of a customer, one page at a time.
 
     Endpoint:
         GET /customers/<string:username>/wishlist
@@ -520,14 +1402,20 @@ def get_customer_wishlist(username):
     Path Parameter:
         username (str): The username of the customer whose wishlist is to be retrieved.
 
+    Query Parameters:
+        - limit (int): Optional page size, the configured default if not given. Capped at the
+          configured maximum page size.
+        - cursor (str): Optional cursor returned with the previous page.
+
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'customer']) - Restricts access to users with 
         "admin" or "customer" roles.
 
     Returns:
-        - 200 OK: A JSON object containing a list of the customer's wishlist items. 
-        - 400 Bad Request: If a non-admin user attempts to view the wishlist of another customer.
+        - 200 OK: A JSON object containing a list of the customer's wishlist items and the `next_cursor`. 
+        - 400 Bad Request: If a non-admin user attempts to view the wishlist of another customer,
+        or the limit or cursor is invalid.
         - 404 Not Found: If the customer with the specified username does not exist.
         - 500 Internal Server Error: If an exception occurs during the process.
     """
@@ -542,25 +1430,33 @@ def get_customer_wishlist(username):
         if not customer:
             return jsonify({'error': 'Customer not found'}), 404
         
-        wishlist = customer.wishlist_items  
+        limit, cursor = get_page_args()
+        query = (
+            db_session.query(Wishlist.wishlist_id, Wishlist.item_id, InventoryItem.name, InventoryItem.price_per_item)
+            .join(InventoryItem, InventoryItem.id == Wishlist.item_id)
+            .filter(Wishlist.customer_id == customer.id)
+        )
+        wishlist, next_cursor = paginate(query, [Wishlist.wishlist_id], limit, cursor)
         wishlist_items = [
             {
                 'wishlist_id': item.wishlist_id,
                 'item_id': item.item_id,
-                'item_name': item.inventory_item.name,  
-                'item_price': item.inventory_item.price_per_item  
+                'item_name': item.name,  
+                'item_price': item.price_per_item  
             }
             for item in wishlist
         ]
 
-        return jsonify({'wishlist': wishlist_items}), 200
+        return paginated_response({'wishlist': wishlist_items}, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
 
 @app.route('/customers/add-role', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin'])
 def add_admin():
     """
@@ -581,7 +1477,7 @@ def add_admin():
             - role (str): The role of the admin
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin']) - Restricts access to users with the "admin" role.
 
     Returns:
@@ -594,14 +1490,13 @@ def add_admin():
     data = request.json
     db_session = SessionLocal()
     try:
-        existing_customer = db_session.query(Customer).filter_by(username=data.get('username')).first()
-        if existing_customer:
-            return jsonify({'error': 'Username is already taken'}), 400
-
         is_valid, message = Customer.validate_data(data,'add')
         if not is_valid:
             return jsonify({'error': message}), 400
 
+        if username_taken(db_session, data.get('username')):
+            return jsonify({'error': 'Username is already taken'}), 400
+
         hashed_password = ph.hash(data.get('password'))
 
         new_customer = Customer(
@@ -617,8 +1512,13 @@ def add_admin():
         )
         db_session.add(new_customer)
         db_session.commit()
+        username_filter.add(new_customer.username.lower())
+        index_customer(new_customer)
 
         return jsonify({f'message': f'New user added successfully', 'customer_id': new_customer.id}), 201
+    except IntegrityError:
+        db_session.rollback()
+        return jsonify({'error': 'Username is already taken'}), 400
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -631,7 +1531,8 @@ def health_check():
     Health check endpoint to monitor service and database status.
 
     Returns:
-        - 200 OK: If the service and database are operational.
+        - 200 OK: If the service and database are operational. Includes the profile cache
+        statistics and the rate limiter rejection counters.
         - 500 Internal Server Error: If the database or any service is unavailable.
     """
     db_status = "unknown"
@@ -650,7 +1551,13 @@ def health_check():
     return jsonify({
         "status": overall_status,
         "database": db_status,
+        "profile_cache": profile_cache.stats(),
+        "rate_limited": get_rate_limit_stats()
     }), 200 if overall_status == "healthy" else 500
 
 if __name__ == '__main__':
+    start_username_filter_build()
+    start_customer_index_build()
+    start_periodic_job(wallet_compaction_job(), 60, app.logger, "compacting wallets")
+    start_periodic_job(release_expired_holds, 30, app.logger, "releasing expired holds")
     app.run(host="0.0.0.0", port=3000)
@@ -2,6 +2,7 @@ import os, sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from customers.app import app as flask_app
 import pytest
+from datetime import datetime
 from flask import json
 from shared.database import engine, SessionLocal
 from shared.models.base import Base
@@ -10,6 +11,8 @@ from shared.models.review import Review
 from shared.models.inventory import InventoryItem
 from shared.models.order import Order
 from shared.models.wishlist import Wishlist
+from shared.models.wallet import WalletEntry, WalletSnapshot, WalletHold, WalletCreditChunk
+from shared.ledger import get_balance, compact_wallets, max_entry_id, expire_holds
 from flask_jwt_extended import create_access_token
 from argon2 import PasswordHasher
 
@@ -106,9 +109,9 @@ def test_get_customers(client, db_session, get_auth_token, add_default_admin, ad
     )
     assert response.status_code == 200
     data = response.get_json()
-    assert isinstance(data, list)
-    assert len(data) == 2  # Only admin exists initially
-    assert data[0]['username'] == 'admin'
+    assert len(data['customers']) == 2  # Only admin exists initially
+    assert data['customers'][0]['username'] == 'admin'
+    assert data['next_cursor'] is None
 
 # Test: Get customer by username
 def test_get_customer_by_username(client, db_session, get_auth_token):
@@ -140,6 +143,29 @@ def test_get_customer_by_username_no_user(client, db_session, get_auth_token):
     data = response.get_json()
     assert data['error'] == 'Customer not found'
 
+# Test: The gateway's verified identity headers are trusted without decoding the JWT again
+def test_gateway_identity_headers(client, db_session, monkeypatch):
+    import auth.app as auth_app
+    def decode_again(*args, **kwargs):
+        raise AssertionError('The JWT was decoded again')
+    monkeypatch.setattr(auth_app, 'verify_jwt_in_request', decode_again)
+    monkeypatch.setenv('TRUST_GATEWAY_IDENTITY', '1')
+    identity = {'X-Authenticated-User': 'user1', 'X-Authenticated-Role': 'customer'}
+
+    response = client.get('/customers/user1', headers=identity)
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'user1'
+
+    # The role comes from the headers too
+    response = client.get('/customers', headers=identity)
+    assert response.status_code == 403
+
+    # Without the setting, the headers are ignored and a token is required
+    monkeypatch.undo()
+    monkeypatch.delenv('TRUST_GATEWAY_IDENTITY', raising=False)
+    response = client.get('/customers/user1', headers={'X-Authenticated-User': 'admin', 'X-Authenticated-Role': 'admin'})
+    assert response.status_code == 401
+
 # Test: Add customer
 def test_add_customer(client, db_session):
     response = client.post('/customers', json={
@@ -353,6 +379,23 @@ def test_deduct_wallet_insufficient(client, db_session, get_auth_token):
     data = response.get_json()
     assert data['error'] == 'Insufficient balance'
 
+# Test: Deduct from a wallet that stays locked
+def test_deduct_wallet_busy(client, db_session, get_auth_token, monkeypatch):
+    import customers.app as customers_app
+    from sqlalchemy.exc import OperationalError
+    def locked(*args):
+        raise OperationalError("INSERT", {}, Exception("Deadlock found when trying to get lock"))
+    monkeypatch.setattr(customers_app, 'post_entry', locked)
+    monkeypatch.setattr(customers_app.time, 'sleep', lambda seconds: None)
+
+    response = client.post(
+        '/customers/user1/wallet/deduct',
+        headers={'Authorization': f'Bearer {get_auth_token["user"]}'},
+        json={'amount': 10.0}
+    )
+    assert response.status_code == 409
+    assert response.get_json()['error'] == customers_app.WALLET_BUSY
+
 # Test: Add wallet
 def test_add_wallet(client, db_session, get_auth_token):
     response = client.post(
@@ -376,6 +419,33 @@ def test_add_wallet_bad_amount(client, db_session, get_auth_token):
     data = response.get_json()
     assert data['error'] == 'Invalid amount'
 
+    # Booleans are not amounts, although Python counts True as 1
+    response = client.post(
+        '/customers/user1/wallet/add',
+        headers={'Authorization': f'Bearer {get_auth_token["user"]}'},
+        json={'amount': True}
+    )
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid amount'
+
+# Test: Amounts that round to 0 cents are rejected before any ledger entry is written
+def test_wallet_sub_cent_amounts(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["user"]}'}
+    entries = db_session.query(WalletEntry).count()
+
+    for action in ('add', 'deduct', 'holds'):
+        response = client.post(f'/customers/user1/wallet/{action}', headers=headers, json={'amount': 0.001})
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Invalid amount'
+
+    response = client.post(
+        '/customers/wallet/credits',
+        headers={'Authorization': f'Bearer {get_auth_token["admin"]}'},
+        json={'batch_id': 'sub-cent', 'credits': [{'username': 'user1', 'amount': 0.004}]}
+    )
+    assert response.status_code == 400
+    assert db_session.query(WalletEntry).count() == entries
+
 # Test: Add product manager role
 def test_add_product_manager_role(client, db_session, get_auth_token):
     response = client.post(
@@ -422,11 +492,46 @@ def test_get_previous_orders(client, db_session, get_auth_token):
     )
     assert response.status_code == 200
     data = response.get_json()
-    print(data)
     assert 'orders' in data
     assert len(data['orders']) == 1
     assert data['orders'][0]['quantity'] == 2
 
+# Test: Order history with totals, filters and pagination
+def test_get_order_history(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    apple = InventoryItem(name="apple", category="food", price_per_item=2, stock_count=10)
+    pear = InventoryItem(name="pear", category="food", price_per_item=3, stock_count=10)
+    db_session.add_all([apple, pear])
+    db_session.commit()
+    customer_id = db_session.query(Customer).filter_by(username='user1').first().id
+    db_session.add_all([
+        Order(customer_id=customer_id, item_id=apple.id, quantity=1, unit_price=1.5, created_at=datetime(2024, 1, 1, 12)),
+        Order(customer_id=customer_id, item_id=pear.id, quantity=2, created_at=datetime(2024, 2, 1, 12)),
+        Order(customer_id=customer_id, item_id=apple.id, quantity=3, unit_price=2.0, created_at=datetime(2024, 3, 1, 12)),
+    ])
+    db_session.commit()
+
+    response = client.get('/customers/user1/orders?limit=2', headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [order['quantity'] for order in data['orders']] == [3, 2]
+    assert data['orders'][1]['unit_price'] == 3
+    assert data['orders'][1]['total'] == 6
+    assert data['totals'] == {'orders': 3, 'quantity': 6, 'spent': 13.5}
+
+    response = client.get(f'/customers/user1/orders?limit=2&cursor={data["next_cursor"]}', headers=headers)
+    data = response.get_json()
+    assert [order['quantity'] for order in data['orders']] == [1]
+    assert data['next_cursor'] is None
+
+    response = client.get(f'/customers/user1/orders?from=2024-01-15&to=2024-03-01&item_id={pear.id}', headers=headers)
+    data = response.get_json()
+    assert [order['quantity'] for order in data['orders']] == [2]
+    assert data['totals'] == {'orders': 1, 'quantity': 2, 'spent': 6}
+
+    response = client.get('/customers/user1/orders?from=yesterday', headers=headers)
+    assert response.status_code == 400
+
 # Test: Get wishlist
 def test_get_wishlist(client, db_session, get_auth_token):
     # Add a wishlist item for admin
@@ -445,4 +550,570 @@ def test_get_wishlist(client, db_session, get_auth_token):
     data = response.get_json()
     assert 'wishlist' in data
     assert len(data['wishlist']) == 1
-    assert data['wishlist'][0]['item_id'] == 1
\ No newline at end of file
+    assert data['wishlist'][0]['item_id'] == 1
+# Test: Username availability
+def test_username_available(client, db_session):
+    response = client.get('/customers/available?username=admin')
+    assert response.status_code == 200
+    assert response.get_json() == {'username': 'admin', 'available': False}
+
+    response = client.get('/customers/available?username=brandnewuser')
+    assert response.status_code == 200
+    assert response.get_json()['available'] is True
+
+    response = client.get('/customers/available?username=ab')
+    assert response.status_code == 400
+
+# Test: Username availability is rate limited per IP, and rejections are reported by /health
+def test_username_available_rate_limited(client, db_session):
+    address = {'REMOTE_ADDR': '10.0.0.3'}
+    for _ in range(120):
+        assert client.get('/customers/available?username=admin', environ_base=address).status_code == 200
+    response = client.get('/customers/available?username=admin', environ_base=address)
+    assert response.status_code == 429
+    assert client.get('/health').get_json()['rate_limited']['check_username_available'] >= 1
+
+# Test: Username availability served from the Bloom filter
+def test_username_available_after_rebuild(client, db_session, get_auth_token, monkeypatch):
+    from customers import app as customers_app
+    from shared.bloom_filter import CountingBloomFilter
+    # The first lookup builds the filter in the background
+    monkeypatch.setattr(customers_app, 'username_filter', CountingBloomFilter())
+    assert client.get('/customers/available?username=Admin').status_code == 200
+    customers_app.username_filter_builder.join()
+    assert customers_app.username_filter.ready
+    assert 'admin' in customers_app.username_filter
+
+    response = client.post('/customers', json={
+        'fullname': 'Filter User',
+        'username': 'filteruser',
+        'password': 'filterpass',
+        'age': 30,
+        'address': '1 Filter St',
+        'gender': 'male',
+        'marital_status': 'single'
+    })
+    assert response.status_code == 201
+    assert client.get('/customers/available?username=filteruser').get_json()['available'] is False
+
+    response = client.delete(
+        '/customers/filteruser',
+        headers={'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    )
+    assert response.status_code == 200
+    assert client.get('/customers/available?username=filteruser').get_json()['available'] is True
+
+# Test: Concurrent wallet debits and credits do not lose updates
+def test_wallet_concurrent_updates(client, db_session, get_auth_token):
+    import threading
+
+    customer = db_session.query(Customer).filter_by(username='admin').first()
+    customer.wallet = 100.0
+    db_session.commit()
+
+    writers = 20
+    results = []
+
+    def worker(index):
+        local_client = flask_app.test_client()
+        action = 'deduct' if index % 2 == 0 else 'add'
+        response = local_client.post(
+            f'/customers/admin/wallet/{action}',
+            headers={'Authorization': f'Bearer {get_auth_token["admin"]}'},
+            json={'amount': 10.0}
+        )
+        results.append((action, response.status_code))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(status == 200 for _, status in results)
+    assert get_balance(db_session, 'admin') == 100.0
+
+# Test: Concurrent debits never overdraw the wallet
+def test_wallet_concurrent_overdraw(client, db_session, get_auth_token):
+    import threading
+
+    customer = db_session.query(Customer).filter_by(username='admin').first()
+    customer.wallet = 50.0
+    db_session.commit()
+
+    results = []
+
+    def worker():
+        local_client = flask_app.test_client()
+        response = local_client.post(
+            '/customers/admin/wallet/deduct',
+            headers={'Authorization': f'Bearer {get_auth_token["admin"]}'},
+            json={'amount': 10.0}
+        )
+        results.append(response.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(200) == 5
+    assert results.count(400) == 5
+    assert get_balance(db_session, 'admin') == 0.0
+
+# Test: Wallet changes are appended to the ledger
+def test_wallet_ledger_entries(client, db_session, get_auth_token):
+    customer = db_session.query(Customer).filter_by(username='user1').first()
+    before = db_session.query(WalletEntry).filter_by(customer_id=customer.id).count()
+
+    response = client.post(
+        '/customers/user1/wallet/add',
+        headers={'Authorization': f'Bearer {get_auth_token["user"]}'},
+        json={'amount': 12.34}
+    )
+    assert response.status_code == 200
+
+    entries = db_session.query(WalletEntry).filter_by(customer_id=customer.id).order_by(WalletEntry.id).all()
+    assert len(entries) == before + 1
+    assert entries[-1].amount_cents == 1234
+    assert entries[-1].reference == 'wallet/add'
+
+# Test: Compaction rolls entries into a snapshot without changing the balance
+def test_wallet_compaction(client, db_session, get_auth_token):
+    balance = get_balance(db_session, 'user1')
+
+    written = compact_wallets(db_session, max_entry_id(db_session))
+    assert written >= 1
+
+    customer = db_session.query(Customer).filter_by(username='user1').first()
+    snapshot = db_session.query(WalletSnapshot).filter_by(customer_id=customer.id).order_by(WalletSnapshot.id.desc()).first()
+    assert snapshot.balance_cents == round(balance * 100)
+    assert customer.wallet == balance
+    assert get_balance(db_session, 'user1') == balance
+
+    # Nothing left to compact
+    assert compact_wallets(db_session, max_entry_id(db_session)) == 0
+
+    # Entries written after the snapshot are still counted
+    response = client.post(
+        '/customers/user1/wallet/deduct',
+        headers={'Authorization': f'Bearer {get_auth_token["user"]}'},
+        json={'amount': 2.34}
+    )
+    assert response.status_code == 200
+    assert response.get_json()['new_balance'] == round(balance - 2.34, 2)
+
+    response = client.get(
+        '/customers/user1',
+        headers={'Authorization': f'Bearer {get_auth_token["user"]}'}
+    )
+    assert response.get_json()['wallet'] == round(balance - 2.34, 2)
+
+# Test: Wallet hold, capture and void
+def test_wallet_hold_capture_and_void(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["user"]}'}
+    balance = get_balance(db_session, 'user1')
+
+    response = client.post('/customers/user1/wallet/holds', headers=headers, json={'amount': balance - 5})
+    assert response.status_code == 201
+    hold_id = response.get_json()['hold_id']
+
+    # Reserved funds cannot be spent or reserved again
+    response = client.post('/customers/user1/wallet/deduct', headers=headers, json={'amount': 10.0})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Insufficient balance'
+    response = client.post('/customers/user1/wallet/holds', headers=headers, json={'amount': 10.0})
+    assert response.status_code == 400
+
+    response = client.post(f'/customers/user1/wallet/holds/{hold_id}/capture', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['new_balance'] == 5.0
+
+    # A hold can only be settled once
+    response = client.post(f'/customers/user1/wallet/holds/{hold_id}/void', headers=headers)
+    assert response.status_code == 409
+
+    response = client.post('/customers/user1/wallet/holds', headers=headers, json={'amount': 5.0})
+    hold_id = response.get_json()['hold_id']
+    response = client.post(f'/customers/user1/wallet/holds/{hold_id}/void', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['new_balance'] == 5.0
+
+    response = client.post('/customers/user1/wallet/holds/9999/capture', headers=headers)
+    assert response.status_code == 404
+
+# Test: Expired holds are released by the sweeper
+def test_wallet_hold_expiry(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["user"]}'}
+
+    response = client.post('/customers/user1/wallet/holds', headers=headers, json={'amount': 5.0, 'ttl': 60})
+    assert response.status_code == 201
+    hold_id = response.get_json()['hold_id']
+
+    response = client.post('/customers/user1/wallet/holds', headers=headers, json={'amount': 1.0, 'ttl': 60})
+    assert response.status_code == 400
+
+    hold = db_session.get(WalletHold, hold_id)
+    hold.expires_at = hold.expires_at.replace(year=2000)
+    db_session.commit()
+
+    # Expired holds cannot be captured
+    response = client.post(f'/customers/user1/wallet/holds/{hold_id}/capture', headers=headers)
+    assert response.status_code == 409
+
+    assert expire_holds(db_session) == [hold.customer_id]
+    db_session.expire_all()
+    assert db_session.get(WalletHold, hold_id).status == 'expired'
+
+    response = client.post('/customers/user1/wallet/holds', headers=headers, json={'amount': 5.0, 'ttl': 0})
+    assert response.status_code == 400
+    response = client.post('/customers/user1/wallet/deduct', headers=headers, json={'amount': 5.0})
+    assert response.status_code == 200
+
+# Test: Get customers page by page
+def test_get_customers_paginated(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    total = db_session.query(Customer).count()
+
+    seen = []
+    response = client.get('/customers?limit=1', headers=headers)
+    while True:
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['customers']) <= 1
+        seen.extend(customer['id'] for customer in page['customers'])
+        assert response.headers.get('X-Next-Cursor') == page['next_cursor']
+        if not page['next_cursor']:
+            break
+        response = client.get(f'/customers?limit=1&cursor={page["next_cursor"]}', headers=headers)
+
+    assert seen == sorted(seen)
+    assert len(seen) == total
+
+    # Without limit or cursor, the first page has the default size
+    client.application.config['PAGE_SIZE_DEFAULT'] = 1
+    try:
+        response = client.get('/customers', headers=headers)
+        assert [customer['id'] for customer in response.get_json()['customers']] == seen[:1]
+        assert response.get_json()['next_cursor']
+
+        # The compatibility setting sends every customer as a bare list
+        client.application.config['UNPAGINATED_LISTS'] = True
+        response = client.get('/customers', headers=headers)
+        assert [customer['id'] for customer in response.get_json()] == seen
+        assert 'X-Next-Cursor' not in response.headers
+        assert len(client.get('/customers?limit=1', headers=headers).get_json()['customers']) == 1
+    finally:
+        client.application.config.pop('PAGE_SIZE_DEFAULT')
+        client.application.config.pop('UNPAGINATED_LISTS')
+
+# Test: Get customers with an invalid page
+def test_get_customers_invalid_page(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+
+    response = client.get('/customers?cursor=not-a-cursor', headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid cursor'
+
+    response = client.get('/customers/user1/orders?cursor=W3t9LDFd', headers=headers)  # [{},1]
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid cursor'
+
+    response = client.get('/customers?limit=0', headers=headers)
+    assert response.status_code == 400
+
+# Test: Batch customer lookup
+def test_get_customers_batch(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+
+    response = client.post('/customers/batch', headers=headers, json={
+        'usernames': ['admin', 'user1', 'ghost', 'admin'],
+        'fields': ['id', 'username', 'wallet']
+    })
+    assert response.status_code == 200
+    data = response.get_json()
+    assert set(data['customers']) == {'admin', 'user1'}
+    assert set(data['customers']['user1']) == {'id', 'username', 'wallet'}
+    assert data['missing'] == ['ghost']
+
+    admin_id = data['customers']['admin']['id']
+    response = client.post('/customers/batch', headers=headers, json={'ids': [admin_id, 9999]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['customers'][str(admin_id)]['username'] == 'admin'
+    assert data['missing'] == [9999]
+
+# Test: Batch customer lookup with invalid input
+def test_get_customers_batch_invalid(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+
+    response = client.post('/customers/batch', headers=headers, json={'usernames': ['admin'], 'ids': [1]})
+    assert response.status_code == 400
+    response = client.post('/customers/batch', headers=headers, json={'usernames': ['admin'], 'fields': ['password']})
+    assert response.status_code == 400
+    response = client.post('/customers/batch', headers=headers, json={'ids': list(range(501))})
+    assert response.status_code == 400
+
+    response = client.post(
+        '/customers/batch',
+        headers={'Authorization': f'Bearer {get_auth_token["user"]}'},
+        json={'usernames': ['admin']}
+    )
+    assert response.status_code == 403
+
+    # Other services look customers up with their own token
+    service_token = create_access_token(identity=json.dumps({'username': 'review-service', 'role': 'service'}))
+    response = client.post(
+        '/customers/batch',
+        headers={'Authorization': f'Bearer {service_token}'},
+        json={'usernames': ['admin'], 'fields': ['username']}
+    )
+    assert response.status_code == 200
+    assert response.get_json()['customers'] == {'admin': {'username': 'admin'}}
+
+# Test: Profile cache is read-through and invalidated by writes
+def test_profile_cache(client, db_session, get_auth_token):
+    from customers.app import profile_cache
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    profile_cache.clear()
+
+    first = client.get('/customers/user1', headers=headers).get_json()
+    assert client.get('/customers/user1', headers=headers).get_json() == first
+    assert profile_cache.stats()['hits'] == 1
+
+    response = client.post('/customers/user1/wallet/add', headers=headers, json={'amount': 5})
+    assert response.status_code == 200
+    updated = client.get('/customers/user1', headers=headers).get_json()
+    assert updated['wallet'] == first['wallet'] + 5
+
+    response = client.put('/customers/user1', headers=headers, json={
+        'fullname': first['fullname'],
+        'age': first['age'],
+        'address': '42 Cache Lane',
+        'gender': first['gender'],
+        'marital_status': first['marital_status']
+    })
+    assert response.status_code == 200
+    assert client.get('/customers/user1', headers=headers).get_json()['address'] == '42 Cache Lane'
+
+    stats = client.get('/health').get_json()['profile_cache']
+    assert stats['hits'] == 1 and stats['misses'] == 3
+    assert stats['hit_ratio'] == 0.25
+
+# Test: Bulk customer import from NDJSON and CSV
+def test_import_customers(client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    base = {'fullname': 'Import User', 'password': 'secret123', 'age': 30,
+            'address': '1 Import Rd', 'gender': 'female', 'marital_status': 'single'}
+
+    body = '\n'.join([
+        json.dumps({**base, 'username': 'import1'}),
+        json.dumps({**base, 'username': 'import2', 'wallet': 12.5}),
+        json.dumps({**base, 'username': 'import1'}),
+        json.dumps({**base, 'username': 'admin'}),
+        json.dumps({**base, 'username': 'import3', 'age': 3}),
+        '{not json',
+    ])
+    response = client.post('/customers/import', headers={**headers, 'Content-Type': 'application/x-ndjson'}, data=body)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['imported'] == 2
+    assert [(error['row'], error['error']) for error in data['errors']] == [
+        (3, 'Duplicate username in upload'),
+        (4, 'Username is already taken'),
+        (5, "Invalid value for 'age'. It must be greater than 16."),
+        (6, 'Invalid JSON'),
+    ]
+
+    imported = db_session.query(Customer).filter_by(username='import2').first()
+    assert ph.verify(imported.password, 'secret123')
+    assert get_balance(db_session, 'import2') == 12.5
+    customer = db_session.query(Customer).filter_by(username='import2').first()
+    assert customer.wallet == 0.0
+    assert [(entry.amount_cents, entry.reference) for entry in db_session.query(WalletEntry).filter_by(customer_id=customer.id)] == [
+        (1250, 'import/opening-balance')
+    ]
+
+    body = "fullname,username,password,age,address,gender,marital_status\n" \
+           "CSV Person,csvuser,secret123,41,2 Comma St,male,married\n" \
+           "CSV Person,csvuser2,secret123,old,2 Comma St,male,married\n"
+    response = client.post('/customers/import', headers={**headers, 'Content-Type': 'text/csv'}, data=body)
+    data = response.get_json()
+    assert data['imported'] == 1
+    assert data['errors'] == [{'row': 2, 'username': None, 'error': "Invalid value for 'age'"}]
+    response = client.get('/customers/available?username=csvuser')
+    assert response.get_json()['available'] is False
+
+    response = client.post('/customers/import', headers={**headers, 'Content-Type': 'text/plain'}, data='x')
+    assert response.status_code == 400
+
+# Test: Parallel password hashing keeps the input order
+def test_hash_passwords_parallel():
+    from shared.bulk import hash_passwords
+    passwords = [f'password{i}' for i in range(4)]
+    hashes = hash_passwords(passwords, workers=2, parallel_threshold=2)
+    assert all(ph.verify(hashed, password) for hashed, password in zip(hashes, passwords))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        for _ in range(2):
+            hashes = hash_passwords(passwords, workers=2, parallel_threshold=2, executor=executor)
+            assert all(ph.verify(hashed, password) for hashed, password in zip(hashes, passwords))
+
+# Test: Customer search through the trigram index
+def test_search_customers(client, db_session, get_auth_token):
+    from customers.app import customer_index, build_customer_index
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    build_customer_index()
+    base = {'password': 'secret123', 'age': 30, 'gender': 'male', 'marital_status': 'single'}
+    for username, fullname, address in [
+        ('jonsmith', 'Jonathan Smith', '12 Harbor Road'),
+        ('jsmythe', 'Jon Smythe', '4 Cedar Lane'),
+        ('marygold', 'Mary Gold', '9 Smithfield Street'),
+    ]:
+        response = client.post('/customers', json={**base, 'username': username, 'fullname': fullname, 'address': address})
+        assert response.status_code == 201
+
+    response = client.get('/customers/search?q=smith', headers=headers)
+    assert response.status_code == 200
+    assert customer_index.ready
+    usernames = [customer['username'] for customer in response.get_json()['customers']]
+    assert usernames[:2] == ['jonsmith', 'marygold']
+    assert 'jsmythe' not in usernames
+
+    # Paging walks the same ranking
+    response = client.get('/customers/search?q=smith&limit=1', headers=headers)
+    assert [customer['username'] for customer in response.get_json()['customers']] == ['jonsmith']
+    response = client.get(f'/customers/search?q=smith&limit=1&cursor={response.get_json()["next_cursor"]}', headers=headers)
+    assert [customer['username'] for customer in response.get_json()['customers']] == ['marygold']
+
+    # Writes after the build are reflected
+    response = client.put('/customers/marygold', headers=headers, json={
+        'fullname': 'Mary Gold', 'age': 30, 'address': '9 Elm Street', 'gender': 'female', 'marital_status': 'single'
+    })
+    assert response.status_code == 200
+    response = client.delete('/customers/jonsmith', headers=headers)
+    assert response.status_code == 200
+    response = client.get('/customers/search?q=smith', headers=headers)
+    assert [customer['username'] for customer in response.get_json()['customers']] == []
+    response = client.get('/customers/search?q=elm street', headers=headers)
+    assert [customer['username'] for customer in response.get_json()['customers']] == ['marygold']
+
+    response = client.get('/customers/search?q=ab', headers=headers)
+    assert response.status_code == 400
+
+# Test: Changes made while the index is building are replayed
+def test_search_index_replays_writes_during_build():
+    from shared.search import NGramIndex
+
+    index = NGramIndex()
+    def documents():
+        yield 1, ('alice', 'Alice Wonder')
+        index.remove(1)
+        index.add(2, 'bobby', 'Bobby Tables')
+        yield 3, ('carol', 'Carol Stale')
+        index.add(3, 'carol', 'Carol Fresh')
+
+    index.build(documents())
+    assert index.ready
+    assert [doc_id for _, _, doc_id in index.search('alice')] == []
+    assert [doc_id for _, _, doc_id in index.search('tables')] == [2]
+    assert [doc_id for _, _, doc_id in index.search('fresh')] == [3]
+    assert [doc_id for _, _, doc_id in index.search('stale')] == []
+
+    # Compaction folds the writes into the packed lists without changing results
+    index.add(4, 'bobcat', 'Bob Catt')
+    index.compact()
+    assert [doc_id for _, _, doc_id in index.search('bob')] == [4, 2]
+    assert [doc_id for _, _, doc_id in index.search('bob', limit=1, after=index.search('bob')[0])] == [2]
+    assert [doc_id for _, _, doc_id in index.search('fresh')] == [3]
+
+# Test: Lifetime statistics are maintained incrementally and can be rebuilt
+def test_customer_stats(app, client, db_session, get_auth_token):
+    from shared.models.customer_stats import CustomerStats
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    customer = db_session.query(Customer).filter_by(username='import1').first()
+
+    response = client.get('/customers/import1/stats', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['order_count'] == 0
+
+    item = InventoryItem(name="kiwi", category="food", price_per_item=2.5, stock_count=10)
+    db_session.add(item)
+    db_session.commit()
+    for quantity in (1, 3):
+        db_session.add(Order(customer_id=customer.id, item_id=item.id, quantity=quantity, unit_price=2.5))
+        CustomerStats.record_order(db_session, customer.id, quantity, 2.5 * quantity)
+        db_session.commit()
+    db_session.add(Review(customer_id=customer.id, item_id=item.id, rating=4, comment='Good', status='approved'))
+    CustomerStats.record_review(db_session, customer.id)
+    db_session.commit()
+
+    response = client.get('/customers/import1/stats', headers=headers)
+    data = response.get_json()
+    assert (data['order_count'], data['units_purchased'], data['lifetime_spend'], data['review_count']) == (2, 4, 10.0, 1)
+    assert data['last_purchase_at'] is not None
+
+    # Drift the counters, then rebuild them from history
+    db_session.query(CustomerStats).filter_by(customer_id=customer.id).update({'order_count': 99, 'review_count': 0})
+    db_session.commit()
+    result = app.test_cli_runner().invoke(args=['rebuild-stats'])
+    assert 'Rebuilt statistics for' in result.output
+    db_session.expire_all()
+
+    data = client.get('/customers/import1/stats', headers=headers).get_json()
+    assert (data['order_count'], data['units_purchased'], data['lifetime_spend'], data['review_count']) == (2, 4, 10.0, 1)
+
+    response = client.get('/customers/ghost/stats', headers=headers)
+    assert response.status_code == 404
+
+# Test: Bulk wallet credits are applied once per batch ID
+def test_bulk_credit_wallets(app, client, db_session, get_auth_token):
+    headers = {'Authorization': f'Bearer {get_auth_token["admin"]}'}
+    app.config['BULK_CREDIT_CHUNK_SIZE'] = 2
+    before = {username: get_balance(db_session, username) for username in ('user1', 'import1', 'import2')}
+    payload = {
+        'batch_id': 'promo-2024-01',
+        'credits': [
+            {'username': 'user1', 'amount': 5},
+            {'username': 'import1', 'amount': 2.5},
+            {'username': 'ghost', 'amount': 1},
+            {'username': 'import2', 'amount': 10},
+        ]
+    }
+    try:
+        response = client.post('/customers/wallet/credits', headers=headers, json=payload)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert (data['applied'], data['already_applied'], data['missing']) == (3, 0, ['ghost'])
+
+        # Replaying the batch applies nothing
+        response = client.post('/customers/wallet/credits', headers=headers, json=payload)
+        data = response.get_json()
+        assert (data['applied'], data['already_applied']) == (0, 3)
+        db_session.expire_all()
+        assert get_balance(db_session, 'user1') == before['user1'] + 5
+        assert get_balance(db_session, 'import1') == before['import1'] + 2.5
+        assert get_balance(db_session, 'import2') == before['import2'] + 10
+
+        # A partially applied batch only applies the missing chunk on retry
+        db_session.query(WalletCreditChunk).filter_by(batch_id='promo-2024-01', chunk=1).delete()
+        db_session.query(WalletEntry).filter_by(reference='credit/promo-2024-01').filter(
+            WalletEntry.amount_cents == 1000).delete()
+        db_session.commit()
+        response = client.post('/customers/wallet/credits', headers=headers, json=payload)
+        data = response.get_json()
+        assert (data['applied'], data['already_applied']) == (1, 2)
+        db_session.expire_all()
+        assert get_balance(db_session, 'import2') == before['import2'] + 10
+
+        payload['credits'][0]['amount'] = 50
+        response = client.post('/customers/wallet/credits', headers=headers, json=payload)
+        assert response.status_code == 409
+    finally:
+        app.config.pop('BULK_CREDIT_CHUNK_SIZE')
+
+    response = client.post('/customers/wallet/credits', headers=headers, json={
+        'batch_id': 'dupes', 'credits': [{'username': 'user1', 'amount': 1}, {'username': 'user1', 'amount': 2}]
+    })
+    assert response.status_code == 400
@@ -0,0 +1,228 @@
+from flask import Flask, json, request, jsonify, Response, stream_with_context, g
+from flask_cors import CORS
+import sys, os
+import logging
+import re
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from flask_jwt_extended import JWTManager, verify_jwt_in_request, get_jwt_identity
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+import requests
+from requests.adapters import HTTPAdapter
+
+app = Flask(__name__)
+CORS(app, resources={r"/*": {"origins": "*"}})
+app.config['JWT_SECRET_KEY'] = 'secret-key'
+jwt = JWTManager(app)
+app.logger.setLevel(logging.INFO)
+
+# Base URLs of the services behind the gateway
+SERVICES = {
+    'auth': os.getenv('AUTH_SERVICE_URL', 'http://auth-service:3004'),
+    'customers': os.getenv('CUSTOMER_SERVICE_URL', 'http://customer-service:3000'),
+    'inventory': os.getenv('INVENTORY_SERVICE_URL', 'http://inventory-service:3001'),
+    'reviews': os.getenv('REVIEW_SERVICE_URL', 'http://review-service:3002'),
+    'sales': os.getenv('SALES_SERVICE_URL', 'http://sales-service:3003'),
+}
+
+# Routing table, matched in order: (path pattern, methods or None for any, service, timeout in seconds)
+ROUTES = [
+    (re.compile(r'^/(login|logout)$'), None, 'auth', 10),
+    (re.compile(r'^/customers(/.*)?$'), None, 'customers', 5),
+    (re.compile(r'^/inventory/\d+/wishlist/'), None, 'sales', 10),
+    (re.compile(r'^/inventory/batch$'), {'POST'}, 'sales', 10),
+    (re.compile(r'^/inventory/changes$'), {'GET'}, 'inventory', 10),
+    (re.compile(r'^/inventory/stream$'), {'GET'}, 'inventory', 30),
+    (re.compile(r'^/inventory(/.*)?$'), {'GET'}, 'sales', 5),
+    (re.compile(r'^/inventory(/.*)?$'), None, 'inventory', 5),
+    (re.compile(r'^/purchase/\d+$'), None, 'sales', 15),
+    (re.compile(r'^/orders$'), {'GET'}, 'sales', 10),
+    (re.compile(r'^/reviews(/.*)?$'), None, 'reviews', 10),
+]
+
+# Routes that do not need a token
+PUBLIC_ROUTES = [
+    (re.compile(r'^/login$'), {'POST'}),
+    (re.compile(r'^/customers$'), {'POST'}),
+    (re.compile(r'^/customers/available$'), {'GET'}),
+]
+
+# Headers that only apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+    'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length',
+}
+
+# Headers carrying the identity verified by the gateway. Clients cannot set them.
+IDENTITY_HEADERS = {'x-authenticated-user', 'x-authenticated-role'}
+
+def create_upstream_session(pool_size=50):
+    """
+    Create an HTTP session that keeps connections to the services alive.
+
+    Parameters:
+        pool_size (int): The maximum number of pooled connections kept per service.
+
+    Returns:
+        requests.Session: A session whose connection pools are reused across requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=len(SERVICES), pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+upstream_session = create_upstream_session(int(os.getenv('GATEWAY_POOL_SIZE', '50')))
+
+def resolve_route(path, method):
+    """
+    Find the service and timeout for a request.
+
+    Parameters:
+        path (str): The request path.
+        method (str): The HTTP method.
+
+    Returns:
+        tuple: The service name and timeout, or (None, None) if no route matches.
+    """
+    for pattern, methods, service, timeout in ROUTES:
+        if pattern.match(path) and (methods is None or method in methods):
+            return service, timeout
+    return None, None
+
+def is_public(path, method):
+    return any(pattern.match(path) and method in methods for pattern, methods in PUBLIC_ROUTES)
+
+def verify_identity(path, method):
+    """
+    Verify the JWT of the incoming request once, at the edge.
+
+    Returns:
+        dict or None: The decoded identity, or None for anonymous requests to public routes.
+
+    Raises:
+        JWTExtendedException, PyJWTError: If a token is required and missing or invalid.
+    """
+    verify_jwt_in_request(optional=is_public(path, method))
+    identity = get_jwt_identity()
+    return json.loads(identity) if identity else None
+
+def build_upstream_headers(identity):
+    """
+    Copy the client headers for the upstream request, attach the verified identity and append
+    the client address to `X-Forwarded-For`.
+
+    Client-supplied identity headers are always dropped so they cannot be spoofed.
+    """
+    headers = {
+        key: value for key, value in request.headers.items()
+        if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() not in IDENTITY_HEADERS
+    }
+    if identity:
+        headers['X-Authenticated-User'] = str(identity.get('username', ''))
+        headers['X-Authenticated-Role'] = str(identity.get('role', ''))
+    forwarded_for = request.headers.get('X-Forwarded-For')
+    headers['X-Forwarded-For'] = f'{forwarded_for}, {request.remote_addr}' if forwarded_for else request.remote_addr
+    return headers
+
+@app.before_request
+def start_timer():
+    g.started_at = time.perf_counter()
+
+@app.after_request
+def log_access(response):
+    """
+    Write one access log line per request for every service behind the gateway.
+    """
+    duration_ms = (time.perf_counter() - g.get('started_at', time.perf_counter())) * 1000
+    app.logger.info(
+        '%s %s %s %s %d %.1fms user=%s',
+        request.remote_addr, request.method, request.full_path.rstrip('?'), g.get('service', '-'),
+        response.status_code, duration_ms, g.get('username', '-')
+    )
+    return response
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """
+    Health check endpoint for the gateway and the services behind it.
+
+    Returns:
+        - 200 OK: If all services are operational.
+        - 500 Internal Server Error: If any service is not operational.
+    """
+    services_status = {}
+    for name, url in SERVICES.items():
+        try:
+            response = upstream_session.get(f'{url}/health', timeout=5)
+            services_status[name] = "healthy" if response.status_code == 200 else f"unhealthy: {response.status_code}"
+        except Exception as e:
+            services_status[name] = f"unavailable: {str(e)}"
+
+    overall_status = "healthy" if all(status == "healthy" for status in services_status.values()) else "unhealthy"
+    return jsonify({"status": overall_status, "services": services_status}), 200 if overall_status == "healthy" else 500
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+def proxy(path):
+    """
+    Forward a client request to the service that owns the route.
+
+    The JWT is verified once here and the verified username and role are passed on in the
+    `X-Authenticated-User` and `X-Authenticated-Role` headers, which the services trust
+    instead of decoding the token again. Upstream connections are pooled and kept alive,
+    and each route has its own timeout.
+
+    Returns:
+        - The upstream service's response, streamed back to the client.
+        - 401 Unauthorized: If the route requires a token and it is missing or invalid.
+        - 404 Not Found: If no service owns the route.
+        - 502 Bad Gateway: If the service cannot be reached.
+        - 504 Gateway Timeout: If the service does not answer within the route's timeout.
+    """
+    full_path = '/' + path
+    service, timeout = resolve_route(full_path, request.method)
+    if service is None:
+        return jsonify({'error': 'Route not found'}), 404
+    g.service = service
+
+    try:
+        identity = verify_identity(full_path, request.method)
+    except (JWTExtendedException, PyJWTError) as e:
+        return jsonify({'error': f'Invalid token: {str(e)}'}), 401
+    if identity:
+        g.username = identity.get('username', '-')
+
+    try:
+        upstream = upstream_session.request(
+            request.method,
+            f'{SERVICES[service]}{full_path}',
+            params=request.args,
+            data=request.get_data(),
+            headers=build_upstream_headers(identity),
+            timeout=timeout,
+            stream=True,
+            allow_redirects=False,
+        )
+    except requests.Timeout:
+        return jsonify({'error': f'{service} service timed out'}), 504
+    except requests.RequestException as e:
+        return jsonify({'error': f'{service} service unavailable: {str(e)}'}), 502
+
+    headers = [
+        (key, value) for key, value in upstream.headers.items()
+        if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != 'content-encoding'
+    ]
+
+    def generate():
+        try:
+            for chunk in upstream.iter_content(chunk_size=None):
+                yield chunk
+        finally:
+            upstream.close()
+
+    return Response(stream_with_context(generate()), status=upstream.status_code, headers=headers)
+
+if __name__ == '__main__':
+    app.run(host="0.0.0.0", port=3005, threaded=True)
@@ -0,0 +1,128 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gateway import app as gateway_module
+from gateway.app import app as flask_app, resolve_route
+import io
+import pytest
+import requests
+from flask import json
+from flask_jwt_extended import create_access_token
+
+class FakeUpstream:
+    """
+    Records the requests forwarded by the gateway and answers them with a canned response.
+    """
+    def __init__(self, status_code=200, body=b'{"ok": true}', error=None):
+        self.status_code = status_code
+        self.body = body
+        self.error = error
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append({'method': method, 'url': url, **kwargs})
+        if self.error:
+            raise self.error
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.raw = io.BytesIO(self.body)
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    Replaces the pooled upstream session with a fake one.
+    """
+    fake = FakeUpstream()
+    monkeypatch.setattr(gateway_module, 'upstream_session', fake)
+    return fake
+
+@pytest.fixture(scope='session')
+def client():
+    """
+    Provides a test client for the gateway.
+    """
+    return flask_app.test_client()
+
+@pytest.fixture
+def get_auth_tokens(client):
+    """
+    Creates JWT tokens for an admin and a customer.
+    """
+    with flask_app.app_context():
+        return {
+            'admin': create_access_token(identity=json.dumps({'username': 'admin', "role": "admin"})),
+            'user': create_access_token(identity=json.dumps({'username': 'user1', "role": "customer"})),
+        }
+
+# Test: Routes are resolved to the owning service
+def test_resolve_route():
+    assert resolve_route('/login', 'POST') == ('auth', 10)
+    assert resolve_route('/customers/user1', 'GET') == ('customers', 5)
+    assert resolve_route('/inventory/food', 'GET') == ('sales', 5)
+    assert resolve_route('/inventory/1', 'PUT') == ('inventory', 5)
+    assert resolve_route('/inventory/changes', 'GET') == ('inventory', 10)
+    assert resolve_route('/inventory/stream', 'GET') == ('inventory', 30)
+    assert resolve_route('/inventory/batch', 'POST') == ('sales', 10)
+    assert resolve_route('/inventory/1/wishlist/add', 'POST') == ('sales', 10)
+    assert resolve_route('/purchase/1', 'POST') == ('sales', 15)
+    assert resolve_route('/reviews/1', 'DELETE') == ('reviews', 10)
+    assert resolve_route('/unknown', 'GET') == (None, None)
+
+# Test: Public routes are forwarded without a token
+def test_forward_public_route(client, upstream):
+    response = client.post('/login', json={'username': 'user1', 'password': 'userpass'})
+    assert response.status_code == 200
+    assert response.get_json() == {'ok': True}
+
+    call = upstream.calls[0]
+    assert call['method'] == 'POST'
+    assert call['url'] == 'http://auth-service:3004/login'
+    assert call['timeout'] == 10
+    assert 'X-Authenticated-User' not in call['headers']
+
+# Test: Protected routes need a valid token
+def test_protected_route_requires_token(client, upstream):
+    response = client.get('/customers/user1')
+    assert response.status_code == 401
+    assert upstream.calls == []
+
+    response = client.get('/customers/user1', headers={'Authorization': 'Bearer not-a-token'})
+    assert response.status_code == 401
+    assert upstream.calls == []
+
+# Test: The verified identity and client address are forwarded, and spoofed identity headers are dropped
+def test_forward_identity_headers(client, upstream, get_auth_tokens):
+    response = client.get(
+        '/customers/user1?fields=wallet',
+        headers={
+            'Authorization': f'Bearer {get_auth_tokens["user"]}',
+            'X-Forwarded-For': '203.0.113.7',
+            'X-Authenticated-Role': 'admin'
+        }
+    )
+    assert response.status_code == 200
+
+    call = upstream.calls[0]
+    assert call['url'] == 'http://customer-service:3000/customers/user1'
+    assert call['params']['fields'] == 'wallet'
+    assert call['headers']['X-Forwarded-For'] == '203.0.113.7, 127.0.0.1'
+    assert call['headers']['X-Authenticated-User'] == 'user1'
+    assert call['headers']['X-Authenticated-Role'] == 'customer'
+    assert call['headers']['Authorization'] == f'Bearer {get_auth_tokens["user"]}'
+
+# Test: Upstream timeouts and failures
+def test_upstream_errors(client, monkeypatch, get_auth_tokens):
+    monkeypatch.setattr(gateway_module, 'upstream_session', FakeUpstream(error=requests.Timeout()))
+    response = client.get('/inventory', headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'})
+    assert response.status_code == 504
+
+    monkeypatch.setattr(gateway_module, 'upstream_session', FakeUpstream(error=requests.ConnectionError('refused')))
+    response = client.get('/inventory', headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'})
+    assert response.status_code == 502
+
+# Test: Unknown routes
+def test_unknown_route(client, upstream):
+    response = client.get('/unknown')
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Route not found'
@@ -1,18 +1,35 @@
-from flask import Flask, json, request, jsonify
+from flask import Flask, Response, json, request, jsonify, stream_with_context
 from flask_cors import CORS
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from auth.app import role_required
+from auth.app import identity_required, role_required
 from shared.models.base import Base
 from shared.models.customer import Customer
 from shared.models.review import Review
 from shared.models.inventory import InventoryItem
 from shared.models.order import Order
 from shared.models.wishlist import Wishlist
+from shared.models.customer_stats import CustomerStats
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import text
 from shared.database import engine, SessionLocal
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from shared.schema import upgrade_schema
+from shared.bulk import iter_records, chunked
+from shared.events import EventBroker, format_event
+from shared.tasks import start_periodic_job
+from shared.models.stock_reservation import StockReservation
+from shared.models.catalog_change import CatalogChange
+from shared.models.stock_shard import StockShard
+from shared.stock import (
+    change_stock, adjust_stock, reserve_stock, settle_reservation, expire_reservations, utcnow,
+    get_stock, stock_expression, available_expression, shard_stock, clear_shards, rebalance_shards
+)
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity
+from datetime import timedelta
+import io
 import json
+import time
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
@@ -20,11 +37,65 @@ app.config['JWT_SECRET_KEY'] = 'secret-key'
 jwt = JWTManager(app)
 
 #Base.metadata.drop_all(bind=engine)
-# Create tables if not created
+# Create tables if not created, then add the columns and indexes that older tables are missing
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+
+# Subscribers of GET /inventory/stream, keyed by item ID
+stock_events = EventBroker(int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 1000)))
+
+def item_events(db_session, item_ids):
+    """
+    Build the stream event describing the current state of each of `item_ids`.
+
+    Returns:
+        list: `(item_id, event, data)` tuples. Items that no longer exist get a "deleted" event.
+    """
+    rows = db_session.execute(
+        select(InventoryItem.id, InventoryItem.price_per_item, stock_expression(), available_expression())
+        .where(InventoryItem.id.in_(list(item_ids)))
+    ).all()
+    events = [
+        (item_id, 'item', {'item_id': item_id, 'price_per_item': price, 'stock_count': stock, 'available_stock': available})
+        for item_id, price, stock, available in rows
+    ]
+    found = {row[0] for row in rows}
+    events.extend((item_id, 'deleted', {'item_id': item_id}) for item_id in item_ids if item_id not in found)
+    return events
+
+def publish_item_changes(db_session, item_ids):
+    """
+    Push the new stock and price of `item_ids` to their stream subscribers. Call it after
+    committing, so subscribers never see a change that is rolled back. Failures are logged
+    and never fail the write.
+    """
+    try:
+        watched = stock_events.watched(item_ids)
+        if watched:
+            for item_id, event, data in item_events(db_session, watched):
+                stock_events.publish(item_id, event, data)
+    except Exception:
+        app.logger.exception("Error publishing stock events")
+
+def release_expired_reservations(db_session, batch_size=500):
+    """
+    Release stock reservations whose TTL has passed and publish the restocked items.
+
+    Parameters:
+        batch_size (int): The number of reservations released per transaction.
+    """
+    publish_item_changes(db_session, expire_reservations(db_session, batch_size))
+
+CHANGE_RETENTION_DAYS = int(os.environ.get('CHANGE_RETENTION_DAYS', 7))
+
+def prune_change_log(db_session):
+    """
+    Drop catalog changes older than the retention period.
+    """
+    CatalogChange.prune(db_session, utcnow() - timedelta(days=CHANGE_RETENTION_DAYS))
 
 @app.route('/inventory', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager'])
 def add_item():
     """
@@ -42,7 +113,7 @@ def add_item():
             - category (str): The category the item belongs to.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'product_manager']) - Restricts access to users with 
         "admin" or "product_manager" roles.
 
@@ -62,17 +133,320 @@ def add_item():
 
         new_item = InventoryItem(**data)
         db_session.add(new_item)
+        db_session.flush()
+        CatalogChange.record(db_session, [new_item.id])
         db_session.commit()
 
         return jsonify({'message': 'Good added successfully', 'item_id': new_item.id}), 201
+    except IntegrityError:
+        db_session.rollback()
+        return jsonify({'error': 'SKU is already in use'}), 400
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
 
+IMPORT_FIELDS = ['sku', 'name', 'category', 'price_per_item', 'description', 'stock_count']
+IMPORT_BATCH_SIZE = 1000
+IMPORT_ERROR_LIMIT = 1000
+
+def upsert_items(db_session, rows, attempts=2):
+    """
+    Insert or update a batch of items by SKU and commit it.
+
+    One IN query splits the batch into new and known SKUs, then all new items are written
+    with one multi-row INSERT and all known items with one executemany UPDATE by primary key.
+    If a concurrent import inserts one of the SKUs first, the batch is retried. Every item
+    written is recorded in the catalog change log.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        rows (list): Validated item dicts, each with a unique `sku`.
+        attempts (int): The number of times to try the batch.
+
+    Returns:
+        tuple: The number of items inserted and the number updated.
+    """
+    for attempt in range(attempts):
+        try:
+            existing = dict(db_session.execute(
+                select(InventoryItem.sku, InventoryItem.id).where(InventoryItem.sku.in_([row['sku'] for row in rows]))
+            ).all())
+            new_rows = [row for row in rows if row['sku'] not in existing]
+            updates = [{**row, 'id': existing[row['sku']]} for row in rows if row['sku'] in existing]
+            if new_rows:
+                db_session.execute(insert(InventoryItem), new_rows)
+            if updates:
+                db_session.execute(update(InventoryItem), updates)
+                clear_shards(db_session, [row['id'] for row in updates])
+            item_ids = db_session.execute(
+                select(InventoryItem.id).where(InventoryItem.sku.in_([row['sku'] for row in rows]))
+            ).scalars().all()
+            CatalogChange.record(db_session, sorted(item_ids))
+            db_session.commit()
+            publish_item_changes(db_session, item_ids)
+            return len(new_rows), len(updates)
+        except IntegrityError:
+            db_session.rollback()
+            if attempt == attempts - 1:
+                raise
+
+@app.route('/inventory/import', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'product_manager'])
+def import_items():
+    """
+    Insert or update many inventory items from a streamed upload, matched by SKU.
+
+    The upload is read and validated in batches of 1000 rows, so it never sits in memory whole.
+    Each batch is upserted and committed with set-based statements. Invalid rows are skipped 
+    and reported.
+
+    Endpoint:
+        POST /inventory/import
+
+    Request Body:
+        Newline-delimited JSON (`application/x-ndjson`), CSV with a header row (`text/csv`)
+        or a JSON array (`application/json`) of items with the fields of `POST /inventory` 
+        and a required `sku`.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'product_manager']) - Restricts access to users with 
+        "admin" or "product_manager" roles.
+
+    Returns:
+        - 200 OK: A JSON object with the number of items `inserted` and `updated`, the total 
+        `error_count`, and the first 1000 per-row `errors`.
+        - 400 Bad Request: If the content type is not supported or the body cannot be parsed.
+        - 500 Internal Server Error: If an exception occurs. Batches committed before it are kept.
+    """
+    try:
+        records = iter_records(
+            io.TextIOWrapper(request.stream, encoding='utf-8'),
+            request.mimetype,
+            types={'price_per_item': float, 'stock_count': int}
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    inserted = updated = error_count = 0
+    errors = []
+    seen = set()
+    db_session = SessionLocal()
+    try:
+        for batch in chunked(records, app.config.get('IMPORT_BATCH_SIZE', IMPORT_BATCH_SIZE)):
+            rows = []
+            for row, record, error in batch:
+                if not error:
+                    try:
+                        is_valid, message = InventoryItem.validate_data(record)
+                    except (AttributeError, TypeError):
+                        is_valid, message = False, 'Invalid record'
+                    if not is_valid:
+                        error = message
+                    elif 'sku' not in record:
+                        error = "'sku' is a required field."
+                    elif record['sku'] in seen:
+                        error = 'Duplicate SKU in upload'
+                if error:
+                    error_count += 1
+                    if len(errors) < IMPORT_ERROR_LIMIT:
+                        errors.append({'row': row, 'sku': (record or {}).get('sku'), 'error': error})
+                    continue
+                seen.add(record['sku'])
+                rows.append({field: record[field] for field in IMPORT_FIELDS if field in record})
+
+            if rows:
+                batch_inserted, batch_updated = upsert_items(db_session, rows)
+                inserted += batch_inserted
+                updated += batch_updated
+
+        return jsonify({'inserted': inserted, 'updated': updated, 'error_count': error_count, 'errors': errors}), 200
+    except ValueError as e:
+        db_session.rollback()
+        return jsonify({'error': str(e), 'inserted': inserted, 'updated': updated}), 400
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e), 'inserted': inserted, 'updated': updated}), 500
+    finally:
+        db_session.close()
+
+CHANGES_PAGE_SIZE = 500
+
+@app.route('/inventory/changes', methods=['GET'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def get_catalog_changes():
+    """
+    Retrieve the inventory items that changed after a catalog version, for incremental sync.
+
+    Each changed item is reported once, with its current state, however many times it changed.
+    Items that were deleted are reported as tombstones. Changes only become visible once they are 
+    older than `CHANGE_FEED_SETTLE_SECONDS`, so that a transaction committing out of version order 
+    is not skipped by a client that already moved past its version.
+
+    Endpoint:
+        GET /inventory/changes
+
+    Query Parameters:
+        - since (int): The catalog version the client is synced to. Defaults to 0.
+        - limit (int): Optional maximum number of changes returned. Capped at 500.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'customer', 'product_manager']) - Restricts access to users 
+        with "admin", "customer", or "product_manager" roles.
+
+    Returns:
+        - 200 OK: A JSON object with:
+            - `version` (int): The version to pass as `since` on the next call.
+            - `has_more` (bool): Whether more changes are waiting.
+            - `changes` (list): Objects with the `version` and `item_id` of each change, and either 
+            `deleted: true` or the `item` with its current fields.
+        - 400 Bad Request: If `since` or `limit` is invalid.
+        - 410 Gone: If changes after `since` are no longer retained. The client must refetch the 
+        catalog, then sync from the returned `version`.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', CHANGES_PAGE_SIZE, type=int)
+    if since is None or since < 0:
+        return jsonify({'error': "Invalid 'since'. Must be a non-negative integer."}), 400
+    if limit is None or limit <= 0:
+        return jsonify({'error': "Invalid 'limit'. Must be a positive integer."}), 400
+    limit = min(limit, CHANGES_PAGE_SIZE)
+
+    db_session = SessionLocal()
+    try:
+        horizon = utcnow() - timedelta(seconds=app.config.get('CHANGE_FEED_SETTLE_SECONDS', 2))
+        oldest, newest = db_session.execute(
+            select(func.min(CatalogChange.version), func.max(CatalogChange.version))
+        ).one()
+        if oldest is not None and since < oldest - 1:
+            return jsonify({'error': f'Changes after version {since} are no longer retained', 'version': newest}), 410
+
+        latest = (
+            select(CatalogChange.item_id, func.max(CatalogChange.version).label('version'))
+            .where(CatalogChange.version > since, CatalogChange.created_at <= horizon)
+            .group_by(CatalogChange.item_id)
+            .subquery()
+        )
+        rows = db_session.execute(
+            select(latest.c.version, latest.c.item_id, InventoryItem, stock_expression())
+            .outerjoin(InventoryItem, InventoryItem.id == latest.c.item_id)
+            .order_by(latest.c.version)
+            .limit(limit + 1)
+        ).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        changes = []
+        for version, item_id, item, stock in rows:
+            change = {'version': version, 'item_id': item_id}
+            if item is None:
+                change['deleted'] = True
+            else:
+                change['item'] = {
+                    'id': item.id,
+                    'sku': item.sku,
+                    'name': item.name,
+                    'category': item.category,
+                    'price_per_item': item.price_per_item,
+                    'description': item.description,
+                    'stock_count': stock
+                }
+            changes.append(change)
+
+        version = rows[-1][0] if rows else since
+        return jsonify({'version': version, 'has_more': has_more, 'changes': changes}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+STREAM_ITEMS_MAX = 100
+STREAM_KEEPALIVE_SECONDS = 15
+
+@app.route('/inventory/stream', methods=['GET'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def stream_items():
+    """
+    Stream the stock and price of inventory items as server-sent events while they change.
+
+    The stream starts with the current state of every subscribed item, then sends an `item` 
+    event whenever one changes, or a `deleted` event if it is removed. Changes that arrive 
+    faster than `STREAM_COALESCE_SECONDS` (0.5 by default) are coalesced into one event carrying 
+    the latest state, so a slow client never builds up a backlog. A comment line is sent every 
+    15 seconds to keep idle connections open.
+
+    Endpoint:
+        GET /inventory/stream
+
+    Query Parameters:
+        - items (str): Comma-separated IDs of up to 100 items to watch.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'customer', 'product_manager']) - Restricts access to users 
+        with "admin", "customer", or "product_manager" roles.
+
+    Returns:
+        - 200 OK: A `text/event-stream` of events whose data is a JSON object with the `item_id`,
+        `price_per_item`, `stock_count` and `available_stock` of an item.
+        - 400 Bad Request: If the item IDs are missing or invalid.
+        - 503 Service Unavailable: If too many streams are open.
+    """
+    try:
+        item_ids = sorted({int(value) for value in request.args.get('items', '').split(',') if value.strip()})
+    except ValueError:
+        return jsonify({'error': "Invalid 'items'. Must be comma-separated item IDs."}), 400
+    if not item_ids or len(item_ids) > STREAM_ITEMS_MAX:
+        return jsonify({'error': f"Invalid 'items'. Must list 1 to {STREAM_ITEMS_MAX} item IDs."}), 400
+
+    subscription = stock_events.subscribe(item_ids)
+    if subscription is None:
+        return jsonify({'error': 'Too many open streams'}), 503
+
+    db_session = SessionLocal()
+    try:
+        # Subscribed first, so a change published meanwhile is newer than the snapshot and wins
+        for item_id, event, data in item_events(db_session, item_ids):
+            subscription.push(item_id, event, data, replace=False)
+    except Exception as e:
+        stock_events.unsubscribe(subscription)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+    interval = app.config.get('STREAM_COALESCE_SECONDS', 0.5)
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                events = subscription.drain(STREAM_KEEPALIVE_SECONDS)
+                if not events:
+                    yield ': keepalive\n\n'
+                    continue
+                yield ''.join(format_event(event, data) for _, event, data in sorted(events, key=lambda e: e[0]))
+                time.sleep(interval)
+        finally:
+            stock_events.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Fields that PUT /inventory/<item_id> may change
+UPDATABLE_FIELDS = ['name', 'description', 'price_per_item', 'stock_count', 'category', 'sku']
+
 @app.route('/inventory/<int:item_id>', methods=['PUT'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager'])
 def update_item(item_id):
     """
@@ -91,15 +465,18 @@ def update_item(item_id):
             - price_per_item (float): The price of the item.
             - stock_quantity (int): The available stock quantity of the item.
             - category (str): The category the item belongs to.
+            - sku (str): The item's stock keeping unit.
+        Other fields are ignored. The number of stock slots can only be changed through 
+        `PUT /inventory/<item_id>/stock/shards`.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'product_manager']) - Restricts access to users with 
         "admin" or "product_manager" roles.
 
     Returns:
         - 200 OK: If the item is successfully updated. Includes a success message.
-        - 400 Bad Request: If the input data is invalid.
+        - 400 Bad Request: If the input data is invalid, or `stock_slots` is given.
         - 404 Not Found: If the item with the specified ID does not exist.
         - 500 Internal Server Error: If an exception occurs during the process.
     """
@@ -110,16 +487,121 @@ def update_item(item_id):
         if not item:
             return jsonify({'error': 'Item not found'}), 404
         
+        if 'stock_slots' in data:
+            return jsonify({'error': "'stock_slots' can only be changed through PUT /inventory/<item_id>/stock/shards"}), 400
         is_valid, message = InventoryItem.validate_data(data)
         if not is_valid:
             return jsonify({'error': message}), 400
 
-        for key, value in data.items():
-            if hasattr(item, key):
-                setattr(item, key, value)
+        for key in UPDATABLE_FIELDS:
+            if key in data:
+                setattr(item, key, data[key])
+        if 'stock_count' in data:
+            db_session.flush()
+            clear_shards(db_session, [item_id])
 
+        CatalogChange.record(db_session, [item_id])
         db_session.commit()
+        publish_item_changes(db_session, [item_id])
         return jsonify({'message': f'Item {item_id} updated successfully'}), 200
+    except IntegrityError:
+        db_session.rollback()
+        return jsonify({'error': 'SKU is already in use'}), 400
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+PRICE_UPDATE_IDS_MAX = 5000
+
+@app.route('/inventory/prices', methods=['POST'])
+@identity_required()
+@role_required(['admin'])
+def update_prices():
+    """
+    Change the price of every item in a category or an ID list with one UPDATE.
+
+    Prices are changed by a percentage or by a fixed amount and rounded to cents. The change is 
+    all or nothing: if any item would end up without a positive price, no price is changed. 
+    The changed items are recorded in the catalog change log with one insert, and pushed to 
+    their stream subscribers.
+
+    Endpoint:
+        POST /inventory/prices
+
+    Request Body:
+        A JSON object containing exactly one of:
+            - category (str): The category whose items to reprice.
+            - item_ids (list): The IDs of up to 5000 items to reprice.
+        and exactly one of:
+            - percent (float): The percentage to change prices by, e.g. -10 for 10% off.
+            - amount (float): The amount to add to each price, negative to lower it.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin']) - Restricts access to users with the "admin" role.
+
+    Returns:
+        - 200 OK: If the prices are changed. Includes the number of items `updated`.
+        - 400 Bad Request: If the input data is invalid or an item's price would not stay positive.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    data = request.json or {}
+    valid_categories = ["food", "clothes", "accessories", "electronics"]
+    if ('category' in data) == ('item_ids' in data):
+        return jsonify({'error': "Provide exactly one of 'category' and 'item_ids'."}), 400
+    if ('percent' in data) == ('amount' in data):
+        return jsonify({'error': "Provide exactly one of 'percent' and 'amount'."}), 400
+
+    if 'category' in data:
+        if not isinstance(data['category'], str) or data['category'].lower() not in valid_categories:
+            return jsonify({'error': f"Invalid value for 'category'. Valid options are: {', '.join(valid_categories)}."}), 400
+        # Categories are matched regardless of case, as in the catalog
+        scope = func.lower(InventoryItem.category) == data['category'].lower()
+    else:
+        item_ids = data['item_ids']
+        if (not isinstance(item_ids, list) or not item_ids or len(item_ids) > PRICE_UPDATE_IDS_MAX
+                or not all(isinstance(item_id, int) and not isinstance(item_id, bool) for item_id in item_ids)):
+            return jsonify({'error': f"Invalid 'item_ids'. Must be a list of 1 to {PRICE_UPDATE_IDS_MAX} item IDs."}), 400
+        scope = InventoryItem.id.in_(set(item_ids))
+
+    change = data.get('percent', data.get('amount'))
+    if not isinstance(change, (int, float)) or isinstance(change, bool) or change == 0:
+        return jsonify({'error': 'Invalid price change. Must be a non-zero number.'}), 400
+    if 'percent' in data:
+        if change <= -100:
+            return jsonify({'error': "Invalid value for 'percent'. It must be greater than -100."}), 400
+        new_price = func.round(InventoryItem.price_per_item * (1 + change / 100.0), 2)
+    else:
+        new_price = func.round(InventoryItem.price_per_item + change, 2)
+
+    db_session = SessionLocal()
+    try:
+        rows = db_session.execute(
+            select(InventoryItem.id, new_price > 0).where(scope).order_by(InventoryItem.id).with_for_update()
+        ).all()
+        invalid = [item_id for item_id, positive in rows if not positive]
+        if invalid:
+            db_session.rollback()
+            return jsonify({
+                'error': f'The change would leave {len(invalid)} items without a positive price',
+                'item_ids': invalid[:100]
+            }), 400
+
+        item_ids = [item_id for item_id, _ in rows]
+        if item_ids:
+            db_session.execute(
+                update(InventoryItem)
+                .where(scope)
+                .values(price_per_item=new_price)
+                .execution_options(synchronize_session=False)
+            )
+            CatalogChange.record(db_session, item_ids)
+        db_session.commit()
+        publish_item_changes(db_session, item_ids)
+
+        return jsonify({'message': f'Updated the price of {len(item_ids)} items', 'updated': len(item_ids)}), 200
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -127,12 +609,15 @@ def update_item(item_id):
         db_session.close()
 
 @app.route('/inventory/<int:item_id>', methods=['DELETE'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager'])
 def delete_item(item_id):
     """
     Delete an inventory item and its associated data.
 
+    The statistics of the customers whose orders or reviews of the item are deleted are
+    recomputed in the same transaction.
+
     Endpoint:
         DELETE /inventory/<int:item_id>
 
@@ -140,7 +625,7 @@ def delete_item(item_id):
         item_id (int): The ID of the inventory item to be deleted.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'product_manager']) - Restricts access to users with 
         "admin" or "product_manager" roles.
 
@@ -155,13 +640,23 @@ def delete_item(item_id):
 
         if not item:
             return jsonify({'error': 'Item not found'}), 404
-        
+
+        # Customers whose statistics count the orders and reviews deleted with the item
+        customer_ids = {customer_id for (customer_id,) in db_session.query(Order.customer_id).filter_by(item_id=item.id).distinct()}
+        customer_ids.update(customer_id for (customer_id,) in db_session.query(Review.customer_id).filter_by(item_id=item.id).distinct())
+
         db_session.query(Order).filter_by(item_id=item.id).delete()
         db_session.query(Review).filter_by(item_id=item.id).delete()
         db_session.query(Wishlist).filter_by(item_id=item.id).delete()
+        db_session.query(StockReservation).filter_by(item_id=item.id).delete()
+        db_session.query(StockShard).filter_by(item_id=item.id).delete()
 
         db_session.delete(item)
+        db_session.flush()
+        CustomerStats.refresh(db_session, customer_ids)
+        CatalogChange.record(db_session, [item_id])
         db_session.commit()
+        publish_item_changes(db_session, [item_id])
 
         return jsonify({'message': f'Item {item_id} deleted successfully'}), 200
     except Exception as e:
@@ -171,7 +666,7 @@ def delete_item(item_id):
         db_session.close()
 
 @app.route('/inventory/<int:item_id>/stock/remove', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager','customer'])
 def deduct_item(item_id):
     """
@@ -188,7 +683,7 @@ def deduct_item(item_id):
             - quantity (int): The amount to deduct from the stock. Must be a positive integer.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'product_manager', 'customer']) - Restricts access to users 
         with "admin", "product_manager", or "customer" roles.
 
@@ -206,17 +701,14 @@ def deduct_item(item_id):
     db_session = SessionLocal()
 
     try:
-        item = db_session.query(InventoryItem).filter_by(id=item_id).first()
-        if not item:
-            return jsonify({'error': 'Item not found'}), 404
-
-        if item.stock_count < quantity:
-            return jsonify({'error': 'Not enough stock available'}), 400
-
-        item.stock_count -= quantity
+        new_stock, error = change_stock(db_session, item_id, -quantity)
+        if error:
+            db_session.rollback()
+            return jsonify({'error': error}), 404 if error == 'Item not found' else 400
         db_session.commit()
+        publish_item_changes(db_session, [item_id])
 
-        return jsonify({'message': f'{quantity} items deducted from stock', 'new_stock': item.stock_count}), 200
+        return jsonify({'message': f'{quantity} items deducted from stock', 'new_stock': new_stock}), 200
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -224,7 +716,7 @@ def deduct_item(item_id):
         db_session.close()
 
 @app.route('/inventory/<int:item_id>/stock/add', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager'])
 def add_stock(item_id):
     """
@@ -241,7 +733,7 @@ def add_stock(item_id):
             - quantity (int): The amount to add to the stock. Must be a positive integer.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'product_manager']) - Restricts access to users with 
         "admin" or "product_manager" roles.
 
@@ -260,21 +752,301 @@ def add_stock(item_id):
     db_session = SessionLocal()
 
     try:
-        item = db_session.query(InventoryItem).filter_by(id=item_id).first()
+        new_stock, error = change_stock(db_session, item_id, quantity)
+        if error:
+            db_session.rollback()
+            return jsonify({'error': error}), 404
+        db_session.commit()
+        publish_item_changes(db_session, [item_id])
 
-        if not item:
+        return jsonify({'message': f'Successfully added {quantity} items to stock', 'new_stock': new_stock}), 200
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+STOCK_SLOTS_MAX = 64
+
+@app.route('/inventory/<int:item_id>/stock/shards', methods=['PUT'])
+@identity_required()
+@role_required(['admin', 'product_manager'])
+def set_stock_shards(item_id):
+    """
+    Split an item's stock across several counters, for items bought by many users at once.
+
+    Concurrent purchases of a sharded item each update one random counter rather than all 
+    waiting on the item's row. The counters are evened out in the background, and reads 
+    report their sum, so the item's stock count is unchanged.
+
+    Endpoint:
+        PUT /inventory/<int:item_id>/stock/shards
+
+    Path Parameter:
+        item_id (int): The ID of the inventory item.
+
+    Request Body:
+        A JSON object containing the following field:
+            - slots (int): The number of counters, up to 64. 0 gathers the stock back into the item.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'product_manager']) - Restricts access to users with 
+        "admin" or "product_manager" roles.
+
+    Returns:
+        - 200 OK: If the stock is resharded. Includes the number of slots and the stock count.
+        - 400 Bad Request: If the number of slots is invalid.
+        - 404 Not Found: If the item with the specified ID does not exist.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    data = request.json or {}
+    slots = data.get('slots')
+    if not isinstance(slots, int) or isinstance(slots, bool) or not 0 <= slots <= STOCK_SLOTS_MAX:
+        return jsonify({'error': f"Invalid 'slots'. Must be an integer from 0 to {STOCK_SLOTS_MAX}."}), 400
+
+    db_session = SessionLocal()
+    try:
+        if not shard_stock(db_session, item_id, slots):
             return jsonify({'error': 'Item not found'}), 404
+        db_session.commit()
+
+        return jsonify({
+            'message': f'Stock of item {item_id} split across {slots} slots' if slots else f'Stock of item {item_id} is no longer sharded',
+            'slots': slots,
+            'stock_count': get_stock(db_session, item_id)
+        }), 200
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+STOCK_BATCH_MAX = 500
+
+@app.route('/inventory/stock/batch', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'product_manager', 'customer'])
+def adjust_stock_batch():
+    """
+    Adjust the stock of several items in one transaction, all or nothing.
+
+    Endpoint:
+        POST /inventory/stock/batch
 
-        item.stock_count += quantity
+    Request Body:
+        A JSON object containing the following field:
+            - adjustments (list): Objects with an `item_id` (int) and a non-zero `quantity` (int). 
+            Positive quantities add stock and negative quantities remove it. Each item may appear once.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'product_manager', 'customer']) - Restricts access to users 
+        with "admin", "product_manager", or "customer" roles. Customers may only remove stock.
+
+    Returns:
+        - 200 OK: If every adjustment is applied. Includes the new stock count of each item.
+        - 400 Bad Request: If the input data is invalid or an item does not have enough stock. 
+        Nothing is applied, and the failing `item_id` is included.
+        - 403 Forbidden: If a customer attempts to add stock.
+        - 404 Not Found: If an item does not exist. Nothing is applied.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    data = request.json or {}
+    adjustments = data.get('adjustments')
+    if not isinstance(adjustments, list) or not adjustments or len(adjustments) > STOCK_BATCH_MAX:
+        return jsonify({'error': f"Invalid 'adjustments'. Must be a list of 1 to {STOCK_BATCH_MAX} items."}), 400
+
+    deltas = {}
+    for adjustment in adjustments:
+        item_id = adjustment.get('item_id') if isinstance(adjustment, dict) else None
+        quantity = adjustment.get('quantity') if isinstance(adjustment, dict) else None
+        if (not all(isinstance(value, int) and not isinstance(value, bool) for value in (item_id, quantity))
+                or quantity == 0):
+            return jsonify({'error': 'Invalid adjustment. Each needs an integer item_id and a non-zero integer quantity.'}), 400
+        if item_id in deltas:
+            return jsonify({'error': f'Item {item_id} appears more than once', 'item_id': item_id}), 400
+        deltas[item_id] = quantity
+
+    user = json.loads(get_jwt_identity())
+    if user['role'] == 'customer' and any(quantity > 0 for quantity in deltas.values()):
+        return jsonify({'error': 'Customers can only remove stock'}), 403
+
+    db_session = SessionLocal()
+    try:
+        stock, error, failed_item_id = adjust_stock(db_session, deltas)
+        if error:
+            db_session.rollback()
+            return jsonify({'error': error, 'item_id': failed_item_id}), 404 if error == 'Item not found' else 400
         db_session.commit()
+        publish_item_changes(db_session, sorted(deltas))
 
-        return jsonify({'message': f'Successfully added {quantity} items to stock', 'new_stock': item.stock_count}), 200
+        return jsonify({
+            'message': f'Adjusted stock of {len(deltas)} items',
+            'items': [{'item_id': item_id, 'new_stock': stock[item_id]} for item_id in sorted(stock)]
+        }), 200
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
-    
+
+@app.route('/inventory/<int:item_id>/reservations', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'product_manager', 'customer'])
+def reserve_item(item_id):
+    """
+    Reserve units of an inventory item for a checkout.
+
+    Reserved units stay in stock but can no longer be removed or reserved by anyone else until 
+    the reservation is committed, released or expires.
+
+    Endpoint:
+        POST /inventory/<int:item_id>/reservations
+
+    Path Parameter:
+        item_id (int): The ID of the inventory item to reserve.
+
+    Request Body:
+        A JSON object containing the following fields:
+            - quantity (int): The number of units to reserve. Must be a positive integer.
+            - ttl (int): Optional number of seconds the reservation is kept, between 1 and 900. Defaults to 120.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'product_manager', 'customer']) - Restricts access to users 
+        with "admin", "product_manager", or "customer" roles.
+
+    Returns:
+        - 201 Created: If the units are reserved. Includes the reservation ID and expiry time.
+        - 400 Bad Request: If the input data is invalid or there is not enough available stock.
+        - 404 Not Found: If the item with the specified ID does not exist.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    data = request.json or {}
+    quantity = data.get('quantity', 0)
+    ttl = data.get('ttl', 120)
+
+    if not isinstance(quantity, int) or quantity <= 0:
+        return jsonify({'error': 'Invalid quantity. Must be a positive integer.'}), 400
+    if not isinstance(ttl, int) or not (1 <= ttl <= 900):
+        return jsonify({'error': 'Invalid ttl. Must be an integer between 1 and 900.'}), 400
+
+    db_session = SessionLocal()
+    try:
+        user = json.loads(get_jwt_identity())
+
+        reservation, error = reserve_stock(db_session, item_id, quantity, ttl, user['username'])
+        if error:
+            db_session.rollback()
+            return jsonify({'error': error}), 404 if error == 'Item not found' else 400
+        db_session.commit()
+        publish_item_changes(db_session, [item_id])
+
+        return jsonify({
+            'message': f'Reserved {quantity} unit(s) of item {item_id}',
+            'reservation_id': reservation.id,
+            'expires_at': reservation.expires_at.isoformat()
+        }), 201
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+def settle_item_reservation(reservation_id, status):
+    """
+    Commit or release a stock reservation on behalf of the reservation endpoints.
+
+    Parameters:
+        reservation_id (int): The ID of the reservation.
+        status (str): Either "committed" or "released".
+
+    Returns:
+        tuple: A JSON response and status code.
+    """
+    db_session = SessionLocal()
+    try:
+        user = json.loads(get_jwt_identity())
+
+        reservation = db_session.query(StockReservation).filter_by(id=reservation_id).first()
+        if not reservation:
+            return jsonify({'error': 'Reservation not found'}), 404
+
+        if 'admin' not in user['role'] and reservation.owner != user['username']:
+            return jsonify({'error': 'Invalid user'}), 400
+
+        if not settle_reservation(db_session, reservation, status):
+            db_session.rollback()
+            return jsonify({'error': 'Reservation is no longer active'}), 409
+        db_session.commit()
+        publish_item_changes(db_session, [reservation.item_id])
+
+        new_stock = get_stock(db_session, reservation.item_id)
+        return jsonify({
+            'message': f'Reservation {reservation_id} {status}',
+            'new_stock': new_stock
+        }), 200
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
+@app.route('/inventory/reservations/<int:reservation_id>/commit', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'product_manager', 'customer'])
+def commit_reservation(reservation_id):
+    """
+    Commit a stock reservation, removing the reserved units from stock.
+
+    Endpoint:
+        POST /inventory/reservations/<int:reservation_id>/commit
+
+    Path Parameter:
+        reservation_id (int): The ID of the reservation to commit.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'product_manager', 'customer']) - Restricts access to users 
+        with "admin", "product_manager", or "customer" roles.
+
+    Returns:
+        - 200 OK: If the reservation is committed. Includes the item's new stock count.
+        - 400 Bad Request: If a non-admin user attempts to commit another user's reservation.
+        - 404 Not Found: If the reservation does not exist.
+        - 409 Conflict: If the reservation was already settled or has expired.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    return settle_item_reservation(reservation_id, "committed")
+
+@app.route('/inventory/reservations/<int:reservation_id>/release', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'product_manager', 'customer'])
+def release_reservation(reservation_id):
+    """
+    Release a stock reservation, making the reserved units available again.
+
+    Endpoint:
+        POST /inventory/reservations/<int:reservation_id>/release
+
+    Path Parameter:
+        reservation_id (int): The ID of the reservation to release.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin', 'product_manager', 'customer']) - Restricts access to users 
+        with "admin", "product_manager", or "customer" roles.
+
+    Returns:
+        - 200 OK: If the reservation is released.
+        - 400 Bad Request: If a non-admin user attempts to release another user's reservation.
+        - 404 Not Found: If the reservation does not exist.
+        - 409 Conflict: If the reservation was already settled or has expired.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    return settle_item_reservation(reservation_id, "released")
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -302,7 +1074,11 @@ def health_check():
     return jsonify({
         "status": overall_status,
         "database": db_status,
+        "open_streams": len(stock_events),
     }), 200 if overall_status == "healthy" else 500
 
 if __name__ == '__main__':
+    start_periodic_job(release_expired_reservations, 15, app.logger, "releasing expired reservations")
+    start_periodic_job(prune_change_log, 3600, app.logger, "pruning the catalog change log")
+    start_periodic_job(rebalance_shards, 5, app.logger, "rebalancing stock shards")
     app.run(host="0.0.0.0", port=3001)
\ No newline at end of file
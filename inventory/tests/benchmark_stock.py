@@ -0,0 +1,92 @@
+"""
+Benchmark stock removals of one hot item under contention, with and without sharded stock.
+
+Each worker thread removes one unit per transaction until the item sells out, as
+`POST /inventory/<item_id>/stock/remove` does. Run it against the MySQL database of the
+docker-compose setup; SQLite serializes all writers and shows no difference.
+
+Usage:
+    DATABASE_URL=mysql+pymysql://... python inventory/tests/benchmark_stock.py --threads 32 --slots 16
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import threading
+import time
+from shared.database import engine, SessionLocal
+from shared.models.base import Base
+from shared.models.customer import Customer
+from shared.models.review import Review
+from shared.models.inventory import InventoryItem
+from shared.models.order import Order
+from shared.models.wishlist import Wishlist
+from shared.models.catalog_change import CatalogChange
+from shared.models.stock_shard import StockShard
+from shared.stock import change_stock, shard_stock
+
+def run(units, threads, slots):
+    """
+    Sell out an item of `units` units with `threads` concurrent buyers and return the removals per second.
+    """
+    db_session = SessionLocal()
+    item = InventoryItem(name="Benchmark item", category="electronics", price_per_item=1, stock_count=units)
+    db_session.add(item)
+    db_session.commit()
+    item_id = item.id
+    if slots:
+        shard_stock(db_session, item_id, slots)
+        db_session.commit()
+    db_session.close()
+
+    sold = []
+    def buyer():
+        count = 0
+        session = SessionLocal()
+        try:
+            while True:
+                try:
+                    _, error = change_stock(session, item_id, -1)
+                except Exception:
+                    # Deadlock or lock wait timeout: retry like a client would
+                    session.rollback()
+                    continue
+                if error:
+                    session.rollback()
+                    break
+                session.commit()
+                count += 1
+        finally:
+            session.close()
+            sold.append(count)
+
+    workers = [threading.Thread(target=buyer) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    db_session = SessionLocal()
+    db_session.query(StockShard).filter_by(item_id=item_id).delete()
+    db_session.query(CatalogChange).filter_by(item_id=item_id).delete()
+    db_session.query(InventoryItem).filter_by(id=item_id).delete()
+    db_session.commit()
+    db_session.close()
+
+    assert sum(sold) == units, f"sold {sum(sold)} of {units} units"
+    return units / elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--units', type=int, default=5000, help='units of stock to sell out')
+    parser.add_argument('--threads', type=int, default=32, help='concurrent buyers')
+    parser.add_argument('--slots', type=int, default=16, help='stock counters for the sharded run')
+    args = parser.parse_args()
+
+    engine.echo = False
+    Base.metadata.create_all(bind=engine)
+    single = run(args.units, args.threads, 0)
+    sharded = run(args.units, args.threads, args.slots)
+    print(f"single row:    {single:10.1f} removals/s")
+    print(f"{args.slots:3d} slots:     {sharded:10.1f} removals/s ({sharded / single:.2f}x)")
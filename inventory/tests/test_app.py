@@ -269,6 +269,26 @@ def test_update_item_invalid_data(client, db_session, get_auth_tokens):
     data = response.get_json()
     assert "Invalid value for 'stock_count'" in data['error']
 
+    # Stock slots are only changed through the shards endpoint
+    slots = db_session.query(InventoryItem.stock_slots).filter_by(id=1).scalar()
+    for stock_slots in (8, 'abc'):
+        response = client.put(
+            f'/inventory/{1}',
+            headers={'Authorization': f'Bearer {get_auth_tokens["admin"]}'},
+            json={
+                'name': 'Updated Test Item',
+                'description': 'Updated description',
+                'price_per_item': 20,
+                'stock_count': 20,
+                'category': 'food',
+                'stock_slots': stock_slots
+            }
+        )
+        assert response.status_code == 400
+        assert "'stock_slots'" in response.get_json()['error']
+    db_session.expire_all()
+    assert db_session.query(InventoryItem.stock_slots).filter_by(id=1).scalar() == slots
+
 # Test: Update item that does not exist
 def test_update_item_no_item(client, db_session, get_auth_tokens):
     response = client.put(
@@ -301,6 +321,31 @@ def test_delete_item(client, db_session, get_auth_tokens):
     item = db_session.query(InventoryItem).filter_by(id=1).first()
     assert item is None
 
+# Test: Deleting an item updates the statistics of customers who ordered or reviewed it
+def test_delete_item_updates_customer_stats(client, db_session, get_auth_tokens):
+    from shared.models.customer_stats import CustomerStats
+    customer = Customer(
+        fullname="Stats User", username="statsuser", age=30, address="1 Main St", gender="male",
+        marital_status="single", password=ph.hash("statspass"), role="customer", wallet=0.0
+    )
+    kept = InventoryItem(name="Kept Mug", category="accessories", price_per_item=5.0, stock_count=10)
+    dropped = InventoryItem(name="Dropped Mug", category="accessories", price_per_item=3.0, stock_count=10)
+    db_session.add_all([customer, kept, dropped])
+    db_session.commit()
+    db_session.add_all([
+        Order(customer_id=customer.id, item_id=kept.id, quantity=1, unit_price=5.0),
+        Order(customer_id=customer.id, item_id=dropped.id, quantity=2, unit_price=3.0),
+        Review(customer_id=customer.id, item_id=dropped.id, rating=4, comment="Sturdy", status="approved")
+    ])
+    db_session.commit()
+    CustomerStats.rebuild(db_session)
+
+    response = client.delete(f'/inventory/{dropped.id}', headers={'Authorization': f'Bearer {get_auth_tokens["admin"]}'})
+    assert response.status_code == 200
+    db_session.expire_all()
+    stats = db_session.get(CustomerStats, customer.id)
+    assert (stats.order_count, stats.units_purchased, stats.lifetime_spend_cents, stats.review_count) == (1, 1, 500, 0)
+
 # Test: Delete item that does not exist
 def test_delete_item_no_item(client, db_session, get_auth_tokens):
     response = client.delete(
@@ -415,4 +460,337 @@ def test_add_stock_bad_amount(client, db_session, get_auth_tokens):
     )
     assert response.status_code == 400
     data = response.get_json()
-    assert data['error'] == 'Invalid quantity. Must be a positive integer.'
\ No newline at end of file
+    assert data['error'] == 'Invalid quantity. Must be a positive integer.'
+# Test: Concurrent stock removals never oversell
+def test_remove_stock_concurrent(client, db_session, get_auth_tokens):
+    import threading
+    item = InventoryItem(name="Limited", category="electronics", price_per_item=10, stock_count=20)
+    db_session.add(item)
+    db_session.commit()
+    item_id = item.id
+    headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+    statuses = []
+
+    def buy():
+        response = flask_app.test_client().post(f'/inventory/{item_id}/stock/remove', headers=headers, json={'quantity': 3})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=buy) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses.count(200) == 6
+    assert statuses.count(400) == 4
+    db_session.expire_all()
+    assert db_session.query(InventoryItem).filter_by(id=item_id).first().stock_count == 2
+
+# Test: Batch stock adjustments are all or nothing
+def test_adjust_stock_batch(client, db_session, get_auth_tokens):
+    first = InventoryItem(name="Batch One", category="food", price_per_item=1, stock_count=5)
+    second = InventoryItem(name="Batch Two", category="food", price_per_item=1, stock_count=1)
+    db_session.add_all([first, second])
+    db_session.commit()
+    headers = {'Authorization': f'Bearer {get_auth_tokens["manager"]}'}
+
+    response = client.post('/inventory/stock/batch', headers=headers, json={'adjustments': [
+        {'item_id': first.id, 'quantity': -2},
+        {'item_id': second.id, 'quantity': -3},
+    ]})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Not enough stock available', 'item_id': second.id}
+    db_session.expire_all()
+    assert db_session.query(InventoryItem).filter_by(id=first.id).first().stock_count == 5
+
+    response = client.post('/inventory/stock/batch', headers=headers, json={'adjustments': [
+        {'item_id': second.id, 'quantity': 4},
+        {'item_id': first.id, 'quantity': -2},
+    ]})
+    assert response.status_code == 200
+    assert response.get_json()['items'] == [
+        {'item_id': first.id, 'new_stock': 3},
+        {'item_id': second.id, 'new_stock': 5},
+    ]
+
+    response = client.post('/inventory/stock/batch', headers=headers, json={'adjustments': [
+        {'item_id': 99999, 'quantity': 1},
+    ]})
+    assert response.status_code == 404
+
+    # true is not item 1
+    response = client.post('/inventory/stock/batch', headers=headers, json={'adjustments': [
+        {'item_id': True, 'quantity': 1},
+    ]})
+    assert response.status_code == 400
+
+    response = client.post('/inventory/stock/batch',
+                           headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'},
+                           json={'adjustments': [{'item_id': first.id, 'quantity': 1}]})
+    assert response.status_code == 403
+
+# Test: Reservations hold stock until committed or released
+def test_stock_reservations(client, db_session, get_auth_tokens):
+    item = InventoryItem(name="Reserved", category="food", price_per_item=1, stock_count=5)
+    db_session.add(item)
+    db_session.commit()
+    item_id = item.id
+    user_headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+    manager_headers = {'Authorization': f'Bearer {get_auth_tokens["manager"]}'}
+
+    response = client.post(f'/inventory/{item_id}/reservations', headers=user_headers, json={'quantity': 3})
+    assert response.status_code == 201
+    first = response.get_json()['reservation_id']
+
+    # Reserved units can be neither reserved again nor removed directly
+    response = client.post(f'/inventory/{item_id}/reservations', headers=user_headers, json={'quantity': 3})
+    assert response.status_code == 400
+    response = client.post(f'/inventory/{item_id}/stock/remove', headers=user_headers, json={'quantity': 3})
+    assert response.status_code == 400
+
+    response = client.post(f'/inventory/{item_id}/reservations', headers=user_headers, json={'quantity': 2})
+    second = response.get_json()['reservation_id']
+
+    # Only the owner (or an admin) settles a reservation
+    response = client.post(f'/inventory/reservations/{first}/commit', headers=manager_headers)
+    assert response.status_code == 400
+
+    response = client.post(f'/inventory/reservations/{first}/commit', headers=user_headers)
+    assert response.status_code == 200
+    assert response.get_json()['new_stock'] == 2
+    response = client.post(f'/inventory/reservations/{first}/commit', headers=user_headers)
+    assert response.status_code == 409
+
+    response = client.post(f'/inventory/reservations/{second}/release', headers=user_headers)
+    assert response.status_code == 200
+    assert response.get_json()['new_stock'] == 2
+    response = client.post(f'/inventory/{item_id}/stock/remove', headers=user_headers, json={'quantity': 2})
+    assert response.status_code == 200
+
+    response = client.post('/inventory/99999/reservations', headers=user_headers, json={'quantity': 1})
+    assert response.status_code == 404
+
+# Test: Expired reservations are released by the reaper
+def test_expired_reservations_released(client, db_session, get_auth_tokens):
+    from datetime import timedelta
+    from shared.models.stock_reservation import StockReservation
+    from shared.stock import expire_reservations, utcnow
+    item = InventoryItem(name="Expiring", category="food", price_per_item=1, stock_count=1)
+    db_session.add(item)
+    db_session.commit()
+    reservation = StockReservation(item_id=item.id, quantity=1, owner='user1', status='held',
+                                   expires_at=utcnow() - timedelta(seconds=1))
+    db_session.add(reservation)
+    db_session.commit()
+    headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+
+    response = client.post(f'/inventory/reservations/{reservation.id}/commit', headers=headers)
+    assert response.status_code == 409
+
+    assert item.id in expire_reservations(db_session)
+    response = client.post(f'/inventory/{item.id}/reservations', headers=headers, json={'quantity': 1})
+    assert response.status_code == 201
+
+# Test: Import items by SKU
+def test_import_items(client, db_session, get_auth_tokens):
+    headers = {'Authorization': f'Bearer {get_auth_tokens["manager"]}'}
+    body = "\n".join([
+        json.dumps({'sku': 'IMP-1', 'name': 'Pear', 'category': 'food', 'price_per_item': 2.5, 'stock_count': 10}),
+        json.dumps({'sku': 'IMP-2', 'name': 'Shirt', 'category': 'clothes', 'price_per_item': 15, 'stock_count': 3}),
+        json.dumps({'sku': 'IMP-2', 'name': 'Shirt', 'category': 'clothes', 'price_per_item': 15, 'stock_count': 3}),
+        json.dumps({'sku': 'IMP-3', 'name': 'Bad', 'category': 'toys', 'price_per_item': 1, 'stock_count': 1}),
+        "{not json"
+    ])
+    response = client.post('/inventory/import', headers=headers, data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['inserted'] == 2
+    assert data['updated'] == 0
+    assert data['error_count'] == 3
+    assert [error['row'] for error in data['errors']] == [3, 4, 5]
+    assert data['errors'][0]['error'] == 'Duplicate SKU in upload'
+
+    body = "sku,name,category,price_per_item,stock_count\nIMP-1,Pear,food,3.0,20\nIMP-4,Mixer,electronics,80,2\nIMP-5,Lamp,electronics,abc,2\n"
+    response = client.post('/inventory/import', headers=headers, data=body, content_type='text/csv')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['inserted'], data['updated'], data['error_count']) == (1, 1, 1)
+
+    pear = db_session.query(InventoryItem).filter_by(sku='IMP-1').one()
+    assert (pear.price_per_item, pear.stock_count) == (3.0, 20)
+
+    response = client.post('/inventory/import', headers=headers, data='x', content_type='text/plain')
+    assert response.status_code == 400
+    response = client.post('/inventory/import', headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'},
+                           data=body, content_type='text/csv')
+    assert response.status_code == 403
+
+# Test: Catalog change feed
+def test_catalog_changes(client, app, db_session, get_auth_tokens):
+    from datetime import datetime
+    from sqlalchemy import func
+    from shared.models.catalog_change import CatalogChange
+    app.config['CHANGE_FEED_SETTLE_SECONDS'] = 0
+    headers = {'Authorization': f'Bearer {get_auth_tokens["manager"]}'}
+    since = db_session.query(func.max(CatalogChange.version)).scalar()
+
+    response = client.post('/inventory', headers=headers, json={'name': 'Kettle', 'category': 'electronics', 'price_per_item': 30, 'stock_count': 5})
+    kettle = response.get_json()['item_id']
+    response = client.post('/inventory', headers=headers, json={'name': 'Scarf', 'category': 'clothes', 'price_per_item': 12, 'stock_count': 5})
+    scarf = response.get_json()['item_id']
+    client.put(f'/inventory/{kettle}', headers=headers, json={'name': 'Kettle', 'category': 'electronics', 'price_per_item': 25, 'stock_count': 5})
+    client.post(f'/inventory/{kettle}/stock/add', headers=headers, json={'quantity': 2})
+    client.delete(f'/inventory/{scarf}', headers=headers)
+
+    response = client.get(f'/inventory/changes?since={since}', headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [change['item_id'] for change in data['changes']] == [kettle, scarf]
+    assert data['changes'][0]['item']['price_per_item'] == 25
+    assert data['changes'][0]['item']['stock_count'] == 7
+    assert data['changes'][1]['deleted'] is True
+    assert data['version'] == since + 5
+    assert data['has_more'] is False
+
+    response = client.get(f'/inventory/changes?since={since}&limit=1', headers=headers)
+    data = response.get_json()
+    assert len(data['changes']) == 1 and data['has_more'] is True
+    response = client.get(f'/inventory/changes?since={data["version"]}', headers=headers)
+    assert [change['item_id'] for change in response.get_json()['changes']] == [scarf]
+
+    # Changes that were pruned can no longer be synced from
+    CatalogChange.prune(db_session, datetime.max)
+    response = client.get(f'/inventory/changes?since={since}', headers=headers)
+    assert response.status_code == 410
+    assert response.get_json()['version'] == since + 5
+    response = client.get(f'/inventory/changes?since={since + 5}', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['changes'] == []
+
+    response = client.get('/inventory/changes?since=-1', headers=headers)
+    assert response.status_code == 400
+
+# Test: Sharded stock counters
+def test_sharded_stock(client, db_session, get_auth_tokens):
+    from shared.models.stock_shard import StockShard
+    from shared.stock import rebalance_shards, get_stock
+    item = InventoryItem(name="Hot Drop", category="clothes", price_per_item=99, stock_count=10)
+    db_session.add(item)
+    db_session.commit()
+    item_id = item.id
+    manager_headers = {'Authorization': f'Bearer {get_auth_tokens["manager"]}'}
+    user_headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+
+    def shard_counts():
+        db_session.expire_all()
+        return [shard.count for shard in db_session.query(StockShard).filter_by(item_id=item_id).order_by(StockShard.slot)]
+
+    response = client.put(f'/inventory/{item_id}/stock/shards', headers=manager_headers, json={'slots': 4})
+    assert response.status_code == 200
+    assert response.get_json()['stock_count'] == 10
+    assert shard_counts() == [3, 3, 2, 2]
+
+    response = client.post(f'/inventory/{item_id}/stock/remove', headers=user_headers, json={'quantity': 3})
+    assert response.get_json()['new_stock'] == 7
+    # No single slot holds 5 units any more, so they are drained across slots
+    response = client.post(f'/inventory/{item_id}/stock/remove', headers=user_headers, json={'quantity': 5})
+    assert response.get_json()['new_stock'] == 2
+    response = client.post(f'/inventory/{item_id}/stock/remove', headers=user_headers, json={'quantity': 3})
+    assert response.status_code == 400
+
+    response = client.post(f'/inventory/{item_id}/reservations', headers=user_headers, json={'quantity': 2})
+    assert response.status_code == 201
+    reservation_id = response.get_json()['reservation_id']
+    assert sum(shard_counts()) == 0
+    assert get_stock(db_session, item_id) == 2
+    response = client.post(f'/inventory/reservations/{reservation_id}/release', headers=user_headers)
+    assert response.get_json()['new_stock'] == 2
+
+    response = client.post(f'/inventory/{item_id}/stock/add', headers=manager_headers, json={'quantity': 6})
+    assert response.get_json()['new_stock'] == 8
+    assert item_id in rebalance_shards(db_session)
+    assert shard_counts() == [2, 2, 2, 2]
+
+    response = client.put(f'/inventory/{item_id}/stock/shards', headers=manager_headers, json={'slots': 0})
+    assert response.get_json()['stock_count'] == 8
+    assert shard_counts() == []
+    db_session.refresh(item)
+    assert item.stock_count == 8
+
+    response = client.put(f'/inventory/{item_id}/stock/shards', headers=manager_headers, json={'slots': 100})
+    assert response.status_code == 400
+    response = client.put('/inventory/99999/stock/shards', headers=manager_headers, json={'slots': 2})
+    assert response.status_code == 404
+
+# Test: Stream of stock and price changes
+def test_stream_items(client, app, db_session, get_auth_tokens):
+    from inventory.app import stock_events
+    app.config['STREAM_COALESCE_SECONDS'] = 0
+    item = InventoryItem(name="Streamed", category="food", price_per_item=4, stock_count=10)
+    db_session.add(item)
+    db_session.commit()
+    item_id = item.id
+    headers = {'Authorization': f'Bearer {get_auth_tokens["manager"]}'}
+
+    response = client.get(f'/inventory/stream?items={item_id},99999', headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    snapshot = next(chunks).decode()
+    assert f'"item_id": {item_id}, "price_per_item": 4.0, "stock_count": 10' in snapshot
+    assert 'event: deleted\ndata: {"item_id": 99999}' in snapshot
+
+    # Rapid changes are coalesced into one event with the latest state
+    client.post(f'/inventory/{item_id}/stock/remove', headers=headers, json={'quantity': 1})
+    client.post(f'/inventory/{item_id}/stock/remove', headers=headers, json={'quantity': 2})
+    client.put(f'/inventory/{item_id}', headers=headers, json={'name': 'Streamed', 'category': 'food', 'price_per_item': 5, 'stock_count': 7})
+    update = next(chunks).decode()
+    assert update.count('event: item') == 1
+    assert '"price_per_item": 5.0, "stock_count": 7' in update
+
+    assert len(stock_events) == 1
+    response.close()
+    assert len(stock_events) == 0
+
+    response = client.get('/inventory/stream?items=abc', headers=headers)
+    assert response.status_code == 400
+
+# Test: Bulk price updates
+def test_update_prices(client, db_session, get_auth_tokens):
+    items = [
+        InventoryItem(name="Necklace", category="accessories", price_per_item=100, stock_count=1),
+        InventoryItem(name="Bracelet", category="accessories", price_per_item=19.99, stock_count=1),
+        InventoryItem(name="Socks", category="clothes", price_per_item=5, stock_count=1)
+    ]
+    db_session.add_all(items)
+    db_session.commit()
+    necklace, bracelet, socks = [item.id for item in items]
+    headers = {'Authorization': f'Bearer {get_auth_tokens["admin"]}'}
+
+    def price(item_id):
+        return db_session.query(InventoryItem.price_per_item).filter_by(id=item_id).scalar()
+
+    accessories = db_session.query(InventoryItem).filter_by(category='accessories').count()
+    response = client.post('/inventory/prices', headers=headers, json={'category': 'Accessories', 'percent': -10})
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == accessories
+    assert (price(necklace), price(bracelet), price(socks)) == (90.0, 17.99, 5.0)
+
+    response = client.post('/inventory/prices', headers=headers, json={'item_ids': [bracelet, socks], 'amount': 2.5})
+    assert response.get_json()['updated'] == 2
+    assert (price(bracelet), price(socks)) == (20.49, 7.5)
+
+    # All or nothing when a price would drop to zero
+    response = client.post('/inventory/prices', headers=headers, json={'item_ids': [necklace, socks], 'amount': -10})
+    assert response.status_code == 400
+    assert response.get_json()['item_ids'] == [socks]
+    assert price(necklace) == 90.0
+
+    response = client.post('/inventory/prices', headers=headers, json={'category': 'accessories', 'item_ids': [1], 'percent': 5})
+    assert response.status_code == 400
+    response = client.post('/inventory/prices', headers=headers, json={'category': 'accessories', 'percent': -100})
+    assert response.status_code == 400
+    response = client.post('/inventory/prices', headers={'Authorization': f'Bearer {get_auth_tokens["manager"]}'},
+                           json={'category': 'accessories', 'percent': 5})
+    assert response.status_code == 403
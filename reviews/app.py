@@ -2,20 +2,23 @@ from flask import Flask, json, request, jsonify, current_app
 from flask_cors import CORS
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from auth.app import role_required
+from auth.app import identity_required, role_required, rate_limit, get_rate_limit_stats
 from shared.models.base import Base
 from shared.models.customer import Customer
 from shared.models.review import Review
 from shared.models.inventory import InventoryItem
+from shared.models.customer_stats import CustomerStats
 from shared.database import engine, SessionLocal
+from shared.schema import upgrade_schema
+from shared.pagination import get_page_args, paginate, paginated_response
 from sqlalchemy.sql import text
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity
 import json
 from better_profanity import profanity
 import requests
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor"])
 app.config['JWT_SECRET_KEY'] = 'secret-key'
 jwt = JWTManager(app)
 
@@ -39,36 +42,119 @@ def get_customer_details(username,headers):
         raise Exception('Unexpected content type: JSON expected')
     return response.json()
 
+def get_customers_details(usernames,headers,key='usernames',fields=None):
+    """
+    Retrieve the data of many customers from the customer service in one request.
+
+    Parameters:
+        usernames (list): The usernames (or IDs, see `key`) of the customers whose details are to be retrieved.
+        headers (dict): A dictionary of HTTP headers to include in the request. Typically includes 
+                        authentication headers.
+        key (str): Either "usernames" or "ids", naming what `usernames` holds.
+        fields (list): Optional subset of customer fields to retrieve.
+
+    Returns:
+        dict: A map from each username (or ID, as a string) found to its customer details. Unknown 
+        customers are left out.
+        rasies an exception
+
+    """
+    customers = {}
+    usernames = list(dict.fromkeys(usernames))
+    for start in range(0, len(usernames), 500):
+        payload = {key: usernames[start:start + 500]}
+        if fields:
+            payload['fields'] = fields
+        response = requests.post(
+            'http://customer-service:3000/customers/batch',
+            json=payload,
+            timeout=5,
+            headers=headers
+        )
+        response.raise_for_status()
+        if response.headers.get('Content-Type') != 'application/json':
+            raise Exception('Unexpected content type: JSON expected')
+        customers.update(response.json()['customers'])
+    return customers
+
+def get_items_details(item_ids,headers,fields=None):
+    """
+    Retrieve the data of many items from the sales service in one request per 500 items.
+
+    Parameters:
+        item_ids (list): The IDs of the items whose details are to be retrieved.
+        headers (dict): A dictionary of HTTP headers to include in the request. Typically includes 
+                        authentication headers.
+        fields (list): Optional subset of item fields to retrieve.
+
+    Returns:
+        dict: A map from each item ID found to its details. Unknown items are left out.
+        rasies an exception
+
+    """
+    items = {}
+    item_ids = list(dict.fromkeys(item_ids))
+    for start in range(0, len(item_ids), 500):
+        payload = {'item_ids': item_ids[start:start + 500]}
+        if fields:
+            payload['fields'] = fields
+        response = requests.post(
+            'http://sales-service:3003/inventory/batch',
+            json=payload,
+            timeout=5,
+            headers=headers
+        )
+        response.raise_for_status()
+        if response.headers.get('Content-Type') != 'application/json':
+            raise Exception('Unexpected content type: JSON expected')
+        items.update({int(item_id): item for item_id, item in response.json()['items'].items()})
+    return items
+
 def get_item_exists(item_id,headers):
     """
-    Retrieve item data from the inventory service.
+    Check that an item exists in the inventory.
 
     Parameters:
-        username (str): The username of the customer whose details are to be retrieved.
+        item_id (int): The ID of the item to check.
         headers (dict): A dictionary of HTTP headers to include in the request. Typically includes 
                         authentication headers.
 
     Returns:
-        dict: A JSON object containing customer details if the request is successful.
+        bool: True if the item exists, False otherwise.
         rasies an exception
 
     """
-    response = requests.get(f'http://sales-service:3003/inventory/{item_id}', timeout=5, headers=headers)
-    response.raise_for_status()
-    if response.headers.get('Content-Type') != 'application/json':
-        raise Exception('Unexpected content type: JSON expected')
-    return True
+    return item_id in get_items_details([item_id], headers, fields=['id'])
+
+def get_service_headers():
+    """
+    Build the headers of a request made by the review service on its own behalf.
+
+    Used for internal endpoints, such as `POST /customers/batch`, that the caller's own
+    token may not be allowed to reach.
+
+    Returns:
+        dict: The HTTP headers, with a token carrying the "service" role.
+    """
+    jwt_token = create_access_token(identity=json.dumps({'username': 'review-service', 'role': 'service'}))
+    return {
+        'Authorization': f'Bearer {jwt_token}',
+        'Content-Type': 'application/json'
+    }
 
 app.config['GET_CUSTOMER_DATA_FUNC'] = get_customer_details
+app.config['GET_CUSTOMERS_DATA_FUNC'] = get_customers_details
 app.config['GET_ITEM_EXISTS_FUNC'] = get_item_exists
+app.config['GET_ITEMS_DATA_FUNC'] = get_items_details
 
 #Base.metadata.drop_all(bind=engine)
-# Create tables if not created
+# Create tables if not created, then add the columns and indexes that older tables are missing
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 # Get details of a specific review.
 @app.route('/reviews/<int:review_id>', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager','customer'])
 def get_review_details(review_id):
     """
@@ -81,7 +167,7 @@ def get_review_details(review_id):
         review_id (int): The ID of the review to retrieve.
 
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['admin', 'product_manager', 'customer']) - Restricts access based on roles.
 
     Returns:
@@ -112,21 +198,30 @@ def get_review_details(review_id):
 
 # Get all reviews submitted by a specific customer.
 @app.route('/reviews/customer/', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer'])
 def get_customer_reviews():
     """
-    Get all reviews submitted by a specific customer.
+    Get the reviews submitted by the logged-in customer, one page at a time.
 
     Endpoint:
         GET /reviews/customer/
 
+    Query Parameters:
+        - limit (int): Optional page size, the configured default if not given. Capped at the
+          configured maximum page size.
+        - cursor (str): Optional cursor returned with the previous page.
+
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['admin', 'customer']) - Restricts access based on roles.
 
     Returns:
-        - 200 OK: JSON list of reviews submitted by the customer.
+        - 200 OK: JSON list of reviews submitted by the customer, ordered by ID, each with the
+        name of the reviewed item. The list is sent as `reviews` in a JSON object, with the
+        `next_cursor` (also in the `X-Next-Cursor` header), unless `UNPAGINATED_LISTS` is on and
+        no page was requested.
+        - 400 Bad Request: If the limit or cursor is invalid.
         - 404 Not Found: If the customer has no reviews.
         - 500 Internal Server Error: If an error occurs.
     """
@@ -143,15 +238,23 @@ def get_customer_reviews():
         get_customer_data_func = current_app.config['GET_CUSTOMER_DATA_FUNC']
         customer = get_customer_data_func(user['username'],headers)
 
-        reviews = db_session.query(Review).filter_by(customer_id=customer["id"]).all()
+        limit, cursor = get_page_args()
+        query = db_session.query(Review).filter_by(customer_id=customer["id"])
+        reviews, next_cursor = paginate(query, [Review.id], limit, cursor)
 
-        if not reviews:
+        if not reviews and not cursor:
             return jsonify({'message': 'No reviews found for this customer'}), 404
 
+        get_items_data_func = current_app.config['GET_ITEMS_DATA_FUNC']
+        items = get_items_data_func(
+            [review.item_id for review in reviews], headers, fields=['name']
+        ) if reviews else {}
+
         review_list = [
             {
                 'id': review.id,
                 'item_id': review.item_id,
+                'item_name': items.get(review.item_id, {}).get('name'),
                 'rating': review.rating,
                 'comment': review.comment,
                 'status': review.status,
@@ -159,18 +262,20 @@ def get_customer_reviews():
             }
             for review in reviews
         ]
-        return jsonify(review_list), 200
+        return paginated_response(review_list, next_cursor, 'reviews')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         db_session.close()
 
 @app.route('/reviews/product/<int:item_id>', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager', 'customer'])
 def get_product_reviews(item_id):
     """
-    Get all reviews for a specific product.
+    Get the reviews for a specific product, one page at a time.
 
     Endpoint:
         GET /reviews/product/<int:item_id>
@@ -178,33 +283,43 @@ def get_product_reviews(item_id):
     Path Parameter:
         item_id (int): The ID of the product to retrieve reviews for.
 
+    Query Parameters:
+        - limit (int): Optional page size, the configured default if not given. Capped at the
+          configured maximum page size.
+        - cursor (str): Optional cursor returned with the previous page.
+
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['admin', 'product_manager', 'customer']) - Restricts access based on roles.
 
     Returns:
-        - 200 OK: JSON list of reviews for the specified product.
+        - 200 OK: JSON list of reviews for the specified product, ordered by ID, each with the
+        reviewer's username. The list is sent as `reviews` in a JSON object, with the
+        `next_cursor` (also in the `X-Next-Cursor` header), unless `UNPAGINATED_LISTS` is on and
+        no page was requested.
+        - 400 Bad Request: If the limit or cursor is invalid.
         - 404 Not Found: If no reviews exist for the product.
         - 500 Internal Server Error: If an error occurs.
     """
     db_session = SessionLocal()
     try:
-        user = json.loads(get_jwt_identity())
-
-        # Get customer details
-        jwt_token = create_access_token(identity=get_jwt_identity())
-        headers = {
-            'Authorization': f'Bearer {jwt_token}',
-            'Content-Type': 'application/json'
-        }
-        reviews = db_session.query(Review).filter_by(item_id=item_id).all()
-        if not reviews:
+        limit, cursor = get_page_args()
+        query = db_session.query(Review).filter_by(item_id=item_id)
+        reviews, next_cursor = paginate(query, [Review.id], limit, cursor)
+        if not reviews and not cursor:
             return jsonify({'message': 'No reviews found for this product'}), 404
 
+        # Reviewers are looked up with the service's own token, since customers may not list other customers
+        get_customers_data_func = current_app.config['GET_CUSTOMERS_DATA_FUNC']
+        customers = get_customers_data_func(
+            [review.customer_id for review in reviews], get_service_headers(), key='ids', fields=['username']
+        ) if reviews else {}
+
         review_list = [
             {
                 'id': review.id,
                 'customer_id': review.customer_id,
+                'username': customers.get(str(review.customer_id), {}).get('username'),
                 'rating': review.rating,
                 'comment': review.comment,
                 'status': review.status,
@@ -212,7 +327,9 @@ def get_product_reviews(item_id):
             }
             for review in reviews
         ]
-        return jsonify(review_list), 200
+        return paginated_response(review_list, next_cursor, 'reviews')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
@@ -221,8 +338,9 @@ def get_product_reviews(item_id):
 profanity.load_censor_words()
 
 @app.route('/reviews/<int:item_id>', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['customer', 'admin'])
+@rate_limit(20, 60)
 def submit_review(item_id):
     """
     Submit a new review.
@@ -234,7 +352,7 @@ def submit_review(item_id):
         item_id (int): The ID of the product to review.
 
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['customer', 'admin']) - Restricts access to customers and admins.
 
     Request Body:
@@ -247,6 +365,7 @@ def submit_review(item_id):
         - 201 Created: If the review is successfully submitted.
         - 404 Not Found: If item doesn't exist
         - 400 Bad Request: If validation fails.
+        - 429 Too Many Requests: If the user submitted too many reviews in the last minute.
         - 500 Internal Server Error: If an error occurs.
     """
     data = request.json
@@ -290,6 +409,7 @@ def submit_review(item_id):
             status=data.get("status", "approved").lower()
         )
         db_session.add(new_review)
+        CustomerStats.record_review(db_session, customer["id"])
         db_session.commit()
 
         return jsonify({
@@ -306,7 +426,7 @@ def submit_review(item_id):
         
 # Update an existing review.
 @app.route('/reviews/<int:review_id>', methods=['PUT'])
-@jwt_required()
+@identity_required()
 @role_required(['customer','admin'])
 def update_review(review_id):
     """
@@ -319,7 +439,7 @@ def update_review(review_id):
         review_id (int): The ID of the review to update.
 
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['customer']) - Restricts access to customers only.
 
     Request Body:
@@ -374,7 +494,7 @@ def update_review(review_id):
 
 # Delete a review.
 @app.route('/reviews/<int:review_id>', methods=['DELETE'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer'])
 def delete_review(review_id):
     """
@@ -387,7 +507,7 @@ def delete_review(review_id):
         review_id (int): The ID of the review to delete.
 
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['admin', 'customer']) - Restricts access to admins and customers.
 
     Returns:
@@ -417,6 +537,7 @@ def delete_review(review_id):
         if 'admin' not in user['role'] and review.customer_id != customer["id"]:
             return jsonify({'error': 'Invalid user'}), 400
 
+        CustomerStats.record_review(db_session, review.customer_id, -1)
         db_session.delete(review)
         db_session.commit()
         return jsonify({'message': 'Review deleted successfully'}), 200
@@ -428,7 +549,7 @@ def delete_review(review_id):
 
 # Flag a review
 @app.route('/reviews/flag/<int:review_id>', methods=['PUT'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager', 'customer'])
 def flag_review(review_id):
     """
@@ -441,7 +562,7 @@ def flag_review(review_id):
         review_id (int): The ID of the review to flag.
     
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['admin', 'product_manager', 'customer']) - Restricts access based on roles.
 
     Returns:
@@ -466,7 +587,7 @@ def flag_review(review_id):
 
 # Approve a review
 @app.route('/reviews/approve/<int:review_id>', methods=['PUT'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'product_manager'])
 def approve_review(review_id):
     """
@@ -479,7 +600,7 @@ def approve_review(review_id):
         review_id (int): The ID of the review to approve.
 
     Decorators:
-        @jwt_required() - Requires authentication via JWT.
+        @identity_required() - Requires authentication via JWT.
         @role_required(['admin', 'product_manager']) - Restricts access to admins and product managers.
 
     Returns:
@@ -552,7 +673,8 @@ def health_check():
         "status": overall_status,
         "database": db_status,
         "customer_service": customer_service_status,
-        "sales_service_status": sales_service_status
+        "sales_service_status": sales_service_status,
+        "rate_limited": get_rate_limit_stats()
     }), 200 if overall_status == "healthy" else 500
 
 if __name__ == '__main__':
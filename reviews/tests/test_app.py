@@ -183,14 +183,53 @@ def test_get_review_by_id(client, db_session, get_auth_token, add_test_data):
 
 
 def test_get_product_reviews(client, db_session, get_auth_token, add_test_data):
-    response = client.get(
-        '/reviews/product/1',
-        headers={"Authorization": f"Bearer {get_auth_token['user']}"}
-    )
+    lookups = []
+    def mock_get_customers_data(values, headers, key='usernames', fields=None):
+        lookups.append((values, headers))
+        return {str(value): {'username': 'testuser'} for value in values}
+
+    with client.application.app_context():
+        client.application.config['GET_CUSTOMERS_DATA_FUNC'] = mock_get_customers_data
+
+        response = client.get(
+            '/reviews/product/1',
+            headers={"Authorization": f"Bearer {get_auth_token['user']}"}
+        )
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data) > 0
+    assert data['reviews'][0]['comment'] == "Great product!"
+    assert data['reviews'][0]['username'] == "testuser"
+
+    # All reviewers are fetched in one lookup, with the service's token rather than the customer's
+    assert len(lookups) == 1
+    with client.application.test_request_context(headers=lookups[0][1]):
+        from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+        verify_jwt_in_request()
+        assert json.loads(get_jwt_identity())['role'] == 'service'
+
+def test_get_customer_reviews(client, db_session, get_auth_token, add_test_data):
+    lookups = []
+    def mock_get_items_data(item_ids, headers, fields=None):
+        lookups.append(item_ids)
+        return {item_id: {'name': 'Test Item'} for item_id in item_ids}
+
+    with client.application.app_context():
+        client.application.config['GET_CUSTOMER_DATA_FUNC'] = lambda username, headers: {
+            "id": 1,
+            "username": username,
+        }
+        client.application.config['GET_ITEMS_DATA_FUNC'] = mock_get_items_data
+
+        response = client.get(
+            '/reviews/customer/',
+            headers={"Authorization": f"Bearer {get_auth_token['user']}"}
+        )
     assert response.status_code == 200
     data = response.get_json()
     assert len(data) > 0
-    assert data[0]['comment'] == "Great product!"
+    assert all(review['item_name'] == "Test Item" for review in data['reviews'])
+    assert len(lookups) == 1
 
 
 def test_update_review(client, db_session, get_auth_token, add_test_data):
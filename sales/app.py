@@ -2,21 +2,31 @@ from flask import Flask, json, request, jsonify , current_app
 from flask_cors import CORS
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from auth.app import role_required
+from auth.app import identity_required, role_required, rate_limit, get_rate_limit_stats
 from shared.models.wishlist import Wishlist
 from shared.models.base import Base
 from shared.models.customer import Customer
 from shared.models.review import Review
 from shared.models.order import Order
 from shared.models.inventory import InventoryItem
+from shared.models.customer_stats import CustomerStats
+from shared.stock import available_expression, stock_expression, get_stock
 from shared.database import engine, SessionLocal
+from shared.schema import upgrade_schema
+from shared.pagination import get_page_args, paginate, paginated_response, encode_cursor, decode_cursor
+from shared.catalog import ColumnarCatalog, SORTS as CATALOG_SORTS
+from shared.typeahead import PrefixIndex
+from shared.tasks import start_periodic_job
 from sqlalchemy.sql import text
-from flask_jwt_extended import JWTManager, create_access_token, get_jwt, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt, get_jwt_identity
 import json
 import requests
+import threading
+from datetime import datetime
+from sqlalchemy.sql import func
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor"])
 app.config['JWT_SECRET_KEY'] = 'secret-key'
 jwt = JWTManager(app)
 
@@ -40,77 +50,318 @@ def get_customer_details(username,headers):
         raise Exception('Unexpected content type: JSON expected')
     return response.json() 
 
-def remove_stock(item_id,quantity,headers):
+def get_customers_details(usernames,headers,key='usernames',fields=None):
     """
-    Remove stock for a specific inventory item.
+    Retrieve the data of many customers from the customer service in one request.
 
     Parameters:
-        item_id (int): The ID of the inventory item whose stock is to be deducted.
-        quantity (int): The quantity to deduct from the stock. Must be a positive integer.
+        usernames (list): The usernames (or IDs, see `key`) of the customers whose details are to be retrieved.
+        headers (dict): A dictionary of HTTP headers to include in the request. Typically includes 
+                        authentication headers.
+        key (str): Either "usernames" or "ids", naming what `usernames` holds.
+        fields (list): Optional subset of customer fields to retrieve.
+
+    Returns:
+        dict: A map from each username (or ID, as a string) found to its customer details. Unknown 
+        customers are left out.
+        rasies an exception
+
+    """
+    customers = {}
+    usernames = list(dict.fromkeys(usernames))
+    for start in range(0, len(usernames), 500):
+        payload = {key: usernames[start:start + 500]}
+        if fields:
+            payload['fields'] = fields
+        response = requests.post(
+            'http://customer-service:3000/customers/batch',
+            json=payload,
+            timeout=5,
+            headers=headers
+        )
+        response.raise_for_status()
+        if response.headers.get('Content-Type') != 'application/json':
+            raise Exception('Unexpected content type: JSON expected')
+        customers.update(response.json()['customers'])
+    return customers
+
+def reserve_stock(item_id,quantity,headers):
+    """
+    Reserve units of an inventory item for the duration of a checkout.
+
+    Parameters:
+        item_id (int): The ID of the inventory item to reserve.
+        quantity (int): The number of units to reserve. Must be a positive integer.
+        headers (dict): A dictionary of HTTP headers to include in the request, typically 
+                        including authentication headers.
+
+    Returns:
+        int: The ID of the reservation, or None if there is not enough available stock.
+        raises an exception for any other error.
+    """
+    reservation_payload = {"quantity": quantity, "ttl": 60}
+    reservation_response = requests.post(
+        f'http://inventory-service:3001/inventory/{item_id}/reservations',
+        json=reservation_payload,
+        headers=headers,
+        timeout=5
+    )
+    if reservation_response.status_code == 400:
+        return None
+    reservation_response.raise_for_status()  # Raise exception for HTTP errors
+    if reservation_response.headers.get('Content-Type') != 'application/json':
+        raise Exception('Unexpected content type: JSON expected from inventory service')
+    return reservation_response.json()['reservation_id']
+
+def settle_stock_reservation(reservation_id,action,headers):
+    """
+    Commit or release a stock reservation.
+
+    Parameters:
+        reservation_id (int): The ID of the reservation returned by `reserve_stock`.
+        action (str): Either "commit" or "release".
         headers (dict): A dictionary of HTTP headers to include in the request, typically 
                         including authentication headers.
 
     Returns:
         None: The function raises an exception if there is an error during the process.
-"""
-    stock_payload = {"quantity": quantity}
-    stock_response = requests.post(
-            f'http://inventory-service:3001/inventory/{item_id}/stock/remove',
-            json=stock_payload,
-            headers=headers,
-            timeout=5
+    """
+    settle_response = requests.post(
+        f'http://inventory-service:3001/inventory/reservations/{reservation_id}/{action}',
+        headers=headers,
+        timeout=5
     )
-    stock_response.raise_for_status()  # Raise exception for HTTP errors
-    if stock_response.headers.get('Content-Type') != 'application/json':
+    settle_response.raise_for_status()  # Raise exception for HTTP errors
+    if settle_response.headers.get('Content-Type') != 'application/json':
         raise Exception('Unexpected content type: JSON expected from inventory service')
 
-def deduct_wallet(username,total_cost,headers):
-        """
-    Deduct funds from a customer's wallet.
+def commit_stock_reservation(reservation_id,headers):
+    settle_stock_reservation(reservation_id, "commit", headers)
+
+def release_stock_reservation(reservation_id,headers):
+    settle_stock_reservation(reservation_id, "release", headers)
+
+def hold_wallet(username,total_cost,headers):
+    """
+    Reserve funds on a customer's wallet for the duration of a checkout.
 
     Parameters:
-        username (str): The username of the customer whose wallet balance is to be deducted.
-        total_cost (float): The amount to deduct from the customer's wallet. Must be a positive number.
+        username (str): The username of the customer whose funds are reserved.
+        total_cost (float): The amount to reserve. Must be a positive number.
+        headers (dict): A dictionary of HTTP headers to include in the request, typically 
+                        including authentication headers.
+
+    Returns:
+        int: The ID of the hold, or None if the available balance is insufficient.
+        raises an exception for any other error.
+    """
+    hold_payload = {"amount": total_cost, "ttl": 60}
+    hold_response = requests.post(
+        f'http://customer-service:3000/customers/{username}/wallet/holds',
+        json=hold_payload,
+        headers=headers,
+        timeout=5
+    )
+    if hold_response.status_code == 400:
+        return None
+    hold_response.raise_for_status()  # Raise exception for HTTP errors
+    if hold_response.headers.get('Content-Type') != 'application/json':
+        raise Exception('Unexpected content type: JSON expected from wallet service')
+    return hold_response.json()['hold_id']
+
+def settle_wallet_hold(username,hold_id,action,headers):
+    """
+    Capture or void a wallet hold.
+
+    Parameters:
+        username (str): The username of the customer who owns the hold.
+        hold_id (int): The ID of the hold returned by `hold_wallet`.
+        action (str): Either "capture" or "void".
         headers (dict): A dictionary of HTTP headers to include in the request, typically 
                         including authentication headers.
 
     Returns:
         None: The function raises an exception if there is an error during the process.
+    """
+    settle_response = requests.post(
+        f'http://customer-service:3000/customers/{username}/wallet/holds/{hold_id}/{action}',
+        headers=headers,
+        timeout=5
+    )
+    settle_response.raise_for_status()  # Raise exception for HTTP errors
+    if settle_response.headers.get('Content-Type') != 'application/json':
+        raise Exception('Unexpected content type: JSON expected from wallet service')
 
+def capture_wallet_hold(username,hold_id,headers):
+    settle_wallet_hold(username, hold_id, "capture", headers)
+
+def void_wallet_hold(username,hold_id,headers):
+    settle_wallet_hold(username, hold_id, "void", headers)
+
+def refund_wallet(username,amount,headers):
     """
-        wallet_payload = {"amount": total_cost}
-        wallet_response = requests.post(
-            f'http://customer-service:3000/customers/{username}/wallet/deduct',
-            json=wallet_payload,
-            headers=headers,
-            timeout=5
-        )
-        wallet_response.raise_for_status()  # Raise exception for HTTP errors
-        if wallet_response.headers.get('Content-Type') != 'application/json':
-            raise Exception('Unexpected content type: JSON expected from wallet service')
+    Credit an amount back to a customer's wallet.
+
+    Parameters:
+        username (str): The username of the customer to refund.
+        amount (float): The amount to credit. Must be a positive number.
+        headers (dict): A dictionary of HTTP headers to include in the request, typically 
+                        including authentication headers.
+
+    Returns:
+        None: The function raises an exception if there is an error during the process.
+    """
+    refund_response = requests.post(
+        f'http://customer-service:3000/customers/{username}/wallet/add',
+        json={"amount": amount},
+        headers=headers,
+        timeout=5
+    )
+    refund_response.raise_for_status()  # Raise exception for HTTP errors
+    if refund_response.headers.get('Content-Type') != 'application/json':
+        raise Exception('Unexpected content type: JSON expected from wallet service')
 
 # Set the default function in app config
 app.config['GET_CUSTOMER_DATA_FUNC'] = get_customer_details
-app.config['REMOVE_STOCK_FUNC'] = remove_stock
-app.config['DEDUCT_WALLET_FUNC'] = deduct_wallet
-
-# Create tables if not created
+app.config['GET_CUSTOMERS_DATA_FUNC'] = get_customers_details
+app.config['RESERVE_STOCK_FUNC'] = reserve_stock
+app.config['COMMIT_RESERVATION_FUNC'] = commit_stock_reservation
+app.config['RELEASE_RESERVATION_FUNC'] = release_stock_reservation
+app.config['HOLD_WALLET_FUNC'] = hold_wallet
+app.config['CAPTURE_HOLD_FUNC'] = capture_wallet_hold
+app.config['VOID_HOLD_FUNC'] = void_wallet_hold
+app.config['REFUND_WALLET_FUNC'] = refund_wallet
+
+# Create tables if not created, then add the columns and indexes that older tables are missing
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 # Configure JWT
 app.config['JWT_SECRET_KEY'] = 'secret-key'
 jwt = JWTManager(app)
     
+# Columnar snapshot of the catalog that the listing endpoints filter in memory, loaded on a
+# background thread by start_catalog_load() and refreshed from the catalog change log
+catalog = ColumnarCatalog()
+catalog_loader = None
+catalog_loader_lock = threading.Lock()
+# Prefix index of item names for suggestions, kept in step with the catalog snapshot
+typeahead = PrefixIndex()
+catalog.listeners.append(typeahead.follow)
+
+def load_catalog():
+    """
+    Load the catalog snapshot, and the indexes that follow it, with a full scan.
+    """
+    db_session = SessionLocal()
+    try:
+        catalog.load(db_session)
+    except Exception:
+        app.logger.exception("Error loading the catalog snapshot")
+    finally:
+        db_session.close()
+
+def start_catalog_load():
+    """
+    Load the catalog snapshot on a background thread, unless it is loaded or being loaded.
+    """
+    global catalog_loader
+    with catalog_loader_lock:
+        if catalog.loaded or (catalog_loader is not None and catalog_loader.is_alive()):
+            return
+        catalog_loader = threading.Thread(target=load_catalog, name="loading the catalog snapshot", daemon=True)
+        catalog_loader.start()
+
+def load_popularity(db_session):
+    """
+    Replace the popularity scores of the suggestion index with the units sold of every item.
+    The index ranks its short prefixes again on this thread, so suggestions carry on meanwhile.
+    """
+    typeahead.set_scores(db_session.query(Order.item_id, func.sum(Order.quantity)).group_by(Order.item_id).all())
+
+def catalog_loading():
+    """
+    Start loading the catalog snapshot if needed and return the 503 response for requests
+    that arrive before it is ready.
+    """
+    start_catalog_load()
+    response = jsonify({'error': 'The catalog is still loading. Try again shortly.'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+def list_catalog(categories=None):
+    """
+    Serve one page of the catalog snapshot, filtered and sorted by the request's query parameters.
+
+    Parameters:
+        categories (list): Categories to restrict the listing to, in addition to any in the `category` parameter.
+
+    Returns:
+        tuple: A JSON response and status code, 503 if the snapshot is still loading.
+
+    Raises:
+        ValueError: If a query parameter or the cursor is invalid.
+    """
+    if not catalog.loaded:
+        return catalog_loading()
+    limit, cursor = get_page_args()
+    sort = request.args.get('sort', 'id')
+    if sort not in CATALOG_SORTS:
+        raise ValueError(f"Invalid sort. Valid options are: {', '.join(CATALOG_SORTS)}.")
+    if categories is None and request.args.get('category'):
+        categories = [category for category in request.args['category'].split(',') if category]
+    try:
+        min_price = float(request.args['min_price']) if 'min_price' in request.args else None
+        max_price = float(request.args['max_price']) if 'max_price' in request.args else None
+    except ValueError:
+        raise ValueError('Invalid price. Must be a number.')
+    in_stock = request.args.get('in_stock')
+    if in_stock not in (None, 'true', 'false'):
+        raise ValueError("Invalid in_stock. Must be 'true' or 'false'.")
+    after = decode_cursor(cursor, 1 if sort == 'id' else 2) if cursor else None
+    if after and not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in after):
+        raise ValueError('Invalid cursor')
+
+    db_session = SessionLocal()
+    try:
+        catalog.refresh(db_session, max_age=current_app.config.get('CATALOG_REFRESH_SECONDS', 1))
+    finally:
+        db_session.close()
+
+    items, has_more = catalog.query(
+        categories=categories, min_price=min_price, max_price=max_price,
+        in_stock=None if in_stock is None else in_stock == 'true',
+        sort=sort, after=after, limit=limit
+    )
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor([last['id']] if sort == 'id' else [last['price_per_item'], last['id']])
+    return paginated_response([{"name": item['name'], "price": item['price_per_item']} for item in items], next_cursor, 'items')
+
 @app.route('/inventory', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def get_inventory():
     """
-    Retrieve all items in the inventory with their name and price.
+    Retrieve the items in the inventory with their name and price, one page at a time.
+
+    Items are served from an in-memory columnar snapshot of the catalog, kept up to date from 
+    the catalog change log, so any combination of filters is answered without a database query.
 
     **Endpoint**:
         GET /inventory
 
+    **Query Parameters**:
+        - `category` (str): Optional comma-separated categories to include.
+        - `min_price` (float): Optional lowest price to include.
+        - `max_price` (float): Optional highest price to include.
+        - `in_stock` (str): Optional `true` to only include items in stock, or `false` for sold out items.
+        - `sort` (str): Optional order: `id` (default), `price` (cheapest first) or `-price` (dearest first).
+        - `limit` (int): Optional page size. Capped at the configured maximum page size. Every
+          matching item is returned if neither `limit` nor `cursor` is given.
+        - `cursor` (str): Optional cursor returned with the previous page.
+
     **Access Control**:
         - Users must have one of the following roles:
           - `admin`: Can view all inventory items.
@@ -118,23 +369,23 @@ def get_inventory():
           - `product_manager`: Can view all inventory items.
 
     **Returns**:
-        - 200 OK: A JSON array containing the details of all inventory items. Each item includes:
+        - 200 OK: A JSON array containing the details of the inventory items, in the requested order. Each item includes:
             - `name` (str): The name of the inventory item.
             - `price` (float): The price per item.
+          The array is sent as `items` in a JSON object, with the `next_cursor` (also in the
+          `X-Next-Cursor` header), unless `UNPAGINATED_LISTS` is on and no page was requested.
+        - 400 Bad Request: If a filter, the sort, the limit or the cursor is invalid.
         - 500 Internal Server Error: If an error occurs during the process.
     """
-    db_session = SessionLocal()
     try:
-        goods = db_session.query(InventoryItem.name, InventoryItem.price_per_item).all()
-        json_results = [{"name": name, "price": price} for name, price in goods]
-        return jsonify(json_results), 200
+        return list_catalog()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
-    finally:
-        db_session.close()
 
 @app.route('/inventory/<string:category>', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def get_inventory_category(category):
     """
@@ -152,24 +403,148 @@ def get_inventory_category(category):
           - `customer`: Can view items in any category.
           - `product_manager`: Can view items in any category.
 
+    **Query Parameters**:
+        - `min_price`, `max_price`, `in_stock`, `sort`: Optional filters and order, as for `GET /inventory`.
+        - `limit` (int): Optional page size. Capped at the configured maximum page size. Every
+          matching item is returned if neither `limit` nor `cursor` is given.
+        - `cursor` (str): Optional cursor returned with the previous page.
+
     **Returns**:
-        - 200 OK: A JSON array containing the details of all inventory items in the specified category. Each item includes:
+        - 200 OK: A JSON array containing the details of the inventory items in the specified category, in the requested order. Each item includes:
             - `name` (str): The name of the inventory item.
             - `price` (float): The price per item.
+          The array is sent as `items` in a JSON object, with the `next_cursor` (also in the
+          `X-Next-Cursor` header), unless `UNPAGINATED_LISTS` is on and no page was requested.
+        - 400 Bad Request: If a filter, the sort, the limit or the cursor is invalid.
+        - 500 Internal Server Error: If an error occurs during the process.
+    """
+    try:
+        return list_catalog([category])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+SUGGEST_QUERY_MAX = 100
+SUGGEST_LIMIT_MAX = 50
+
+@app.route('/inventory/suggest', methods=['GET'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def suggest_items():
+    """
+    Suggest items whose name, or a word of it, starts with the typed text, most popular first.
+
+    Suggestions come from an in-memory prefix index of item names, kept up to date from the 
+    catalog change log, and are ranked by the units sold of each item. Units sold are reloaded
+    by the `load_popularity` background job, never on the request path.
+
+    **Endpoint**:
+        GET /inventory/suggest
+
+    **Query Parameters**:
+        - `q` (str): The typed text, matched case-insensitively. At most 100 characters.
+        - `limit` (int): Optional number of suggestions, 10 by default and at most 50.
+
+    **Access Control**:
+        - Users must have one of the following roles:
+          - `admin`: Can view all inventory items.
+          - `customer`: Can view all inventory items.
+          - `product_manager`: Can view all inventory items.
+
+    **Returns**:
+        - 200 OK: A JSON object with `suggestions`, a list of items, each with `id`, `name` 
+        and `popularity` (units sold).
+        - 400 Bad Request: If `q` is missing or too long, or the limit is invalid.
+        - 503 Service Unavailable: If the catalog snapshot or the prefix index is still loading.
         - 500 Internal Server Error: If an error occurs during the process.
     """
+    prefix = request.args.get('q', '')
+    if not prefix.strip() or len(prefix) > SUGGEST_QUERY_MAX:
+        return jsonify({'error': f"Provide a 'q' of 1 to {SUGGEST_QUERY_MAX} characters"}), 400
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SUGGEST_LIMIT_MAX:
+        return jsonify({'error': f'Invalid limit. Must be between 1 and {SUGGEST_LIMIT_MAX}.'}), 400
+
+    if not (catalog.loaded and typeahead.ready):
+        return catalog_loading()
     db_session = SessionLocal()
     try:
-        goods = db_session.query(InventoryItem.name, InventoryItem.price_per_item).filter(InventoryItem.category == category).all()
-        json_results = [{"name": name, "price": price} for name, price in goods]
-        return jsonify(json_results), 200
+        catalog.refresh(db_session, max_age=current_app.config.get('CATALOG_REFRESH_SECONDS', 1))
     except Exception as e:
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
     finally:
         db_session.close()
 
+    suggestions = typeahead.suggest(prefix, limit)
+    return jsonify({'suggestions': [
+        {'id': item_id, 'name': name, 'popularity': int(score)} for item_id, name, score in suggestions
+    ]}), 200
+
+ITEM_FIELDS = ['id', 'name', 'category', 'price_per_item', 'description', 'stock_count', 'available_stock']
+ITEM_BATCH_MAX = 500
+
+@app.route('/inventory/batch', methods=['POST'])
+@identity_required()
+@role_required(['admin', 'customer', 'product_manager'])
+def get_items_batch():
+    """
+    Retrieve many inventory items in a single indexed query.
+
+    **Endpoint**:
+        POST /inventory/batch
+
+    **Request Body**:
+        A JSON object containing:
+            - `item_ids` (list[int]): The IDs of up to 500 items to look up.
+            - `fields` (list[str]): Optional subset of item fields to return. Stock counts are only 
+            computed when `stock_count` or `available_stock` is requested.
+
+    **Access Control**:
+        - Users must have one of the following roles:
+          - `admin`: Can view all inventory items.
+          - `customer`: Can view all inventory items.
+          - `product_manager`: Can view all inventory items.
+
+    **Returns**:
+        - 200 OK: A JSON object with `items`, a map from each requested item ID to the item's fields, 
+        and `missing`, the requested IDs that do not exist.
+        - 400 Bad Request: If the IDs or fields are invalid, or more than 500 IDs are requested.
+        - 500 Internal Server Error: If an error occurs during the process.
+    """
+    data = request.json or {}
+    item_ids = data.get('item_ids')
+    fields = data.get('fields', ITEM_FIELDS)
+
+    if not isinstance(item_ids, list) or not all(isinstance(item_id, int) and not isinstance(item_id, bool) for item_id in item_ids):
+        return jsonify({'error': "Provide an 'item_ids' list of integers"}), 400
+    if len(item_ids) > ITEM_BATCH_MAX:
+        return jsonify({'error': f'At most {ITEM_BATCH_MAX} items can be requested at once'}), 400
+    if not isinstance(fields, list) or not set(fields) <= set(ITEM_FIELDS):
+        return jsonify({'error': f"Invalid 'fields'. Valid options are: {', '.join(ITEM_FIELDS)}."}), 400
+
+    db_session = SessionLocal()
+    try:
+        columns = [InventoryItem.id] + [getattr(InventoryItem, field) for field in fields if field not in ('id', 'stock_count', 'available_stock')]
+        if 'stock_count' in fields:
+            columns.append(stock_expression().label('stock_count'))
+        if 'available_stock' in fields:
+            columns.append(available_expression().label('available_stock'))
+        rows = db_session.query(*columns).filter(InventoryItem.id.in_(set(item_ids))).all() if item_ids else []
+
+        found = {str(row.id): {field: getattr(row, field) for field in fields} for row in rows}
+        missing = [item_id for item_id in dict.fromkeys(item_ids) if str(item_id) not in found]
+        return jsonify({'items': found, 'missing': missing}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
 @app.route('/inventory/<int:item_id>', methods=['GET'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer', 'product_manager'])
 def get_item_details(item_id):
     """
@@ -192,16 +567,22 @@ def get_item_details(item_id):
     """
     db_session = SessionLocal()
     try:
-        item = db_session.query(InventoryItem).filter(InventoryItem.id == item_id).first()
-        if item is None:
+        row = (
+            db_session.query(InventoryItem, stock_expression().label('stock_count'), available_expression().label('available_stock'))
+            .filter(InventoryItem.id == item_id)
+            .first()
+        )
+        if row is None:
             return jsonify({"error": "Item not found"}), 404
+        item = row.InventoryItem
         item_details = {
             "id": item.id,
             "name": item.name,
             "category": item.category,
             "price_per_item": item.price_per_item,
             "description": item.description,
-            "stock_count": item.stock_count
+            "stock_count": row.stock_count,
+            "available_stock": row.available_stock
         }
         return jsonify(item_details), 200
     except Exception as e:
@@ -210,7 +591,7 @@ def get_item_details(item_id):
         db_session.close()
 
 @app.route('/inventory/<int:item_id>/wishlist/add', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['customer','admin','product_manager'])
 def add_wishlist(item_id):
     """
@@ -223,7 +604,7 @@ def add_wishlist(item_id):
         item_id (int): The ID of the inventory item to be added to the wishlist.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['customer', 'admin', 'product_manager']) - Restricts access to users 
         with "customer", "admin", or "product_manager" roles.
 
@@ -271,7 +652,7 @@ def add_wishlist(item_id):
         db_session.close()
 
 @app.route('/inventory/<int:item_id>/wishlist/remove', methods=['DELETE'])
-@jwt_required()
+@identity_required()
 @role_required(['customer','admin'])
 def remove_wishlist(item_id):
     """
@@ -284,7 +665,7 @@ def remove_wishlist(item_id):
         item_id (int): The ID of the inventory item to be removed from the wishlist.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['customer', 'admin']) - Restricts access to users with "customer" 
         or "admin" roles.
 
@@ -332,8 +713,9 @@ def remove_wishlist(item_id):
         
 
 @app.route('/purchase/<int:item_id>', methods=['POST'])
-@jwt_required()
+@identity_required()
 @role_required(['admin', 'customer'])
+@rate_limit(30, 60)
 def purchase_item(item_id):
     """
     Handle item purchase by a logged-in customer and log the order.
@@ -349,7 +731,7 @@ def purchase_item(item_id):
             - quantity (int): The quantity of the item to purchase. Must be a positive integer.
 
     Decorators:
-        @jwt_required() - Ensures the user is authenticated using a JWT token.
+        @identity_required() - Ensures the user is authenticated using a JWT token.
         @role_required(['admin', 'customer']) - Restricts access to users with "admin" or 
         "customer" roles.
 
@@ -357,6 +739,7 @@ def purchase_item(item_id):
         - 200 OK: If the purchase is successful. Includes a success message and the order ID.
         - 400 Bad Request: If the quantity is invalid, stock is insufficient, or the wallet 
         balance is insufficient.
+        - 429 Too Many Requests: If the user placed too many purchases in the last minute.
         - 500 Internal Server Error: If an exception occurs during the process.
     """
     data = request.json
@@ -384,23 +767,62 @@ def purchase_item(item_id):
 
         # Check if there is enough stock and if the user has sufficient wallet balance
         total_cost = item.price_per_item * quantity
-        if item.stock_count < quantity:
+        if get_stock(db_session, item_id) < quantity:
             return jsonify({'error': 'Not enough stock available'}), 400
         if customer["wallet"] < total_cost:
             return jsonify({'error': 'Insufficient wallet balance'}), 400
 
-        # Deduct from customer's wallet via API
-        deduct_wallet_func = current_app.config['DEDUCT_WALLET_FUNC']
-        deduct_wallet_func(user['username'],total_cost,headers)
-        
-        # Deduct stock via inventory API
-        remove_stock_func = current_app.config['REMOVE_STOCK_FUNC']
-        remove_stock_func(item_id,quantity,headers)
+        # Reserve the units, so no other buyer can take them during checkout
+        reserve_stock_func = current_app.config['RESERVE_STOCK_FUNC']
+        release_reservation_func = current_app.config['RELEASE_RESERVATION_FUNC']
+        reservation_id = reserve_stock_func(item_id,quantity,headers)
+        if reservation_id is None:
+            return jsonify({'error': 'Not enough stock available'}), 400
+
+        # Reserve the funds, so nothing is charged if the stock update fails
+        hold_wallet_func = current_app.config['HOLD_WALLET_FUNC']
+        hold_id = hold_wallet_func(user['username'],total_cost,headers)
+        if hold_id is None:
+            release_reservation_func(reservation_id,headers)
+            return jsonify({'error': 'Insufficient wallet balance'}), 400
+
+        # Charge the reserved funds while the units are still reserved, releasing both
+        # reservations if it fails so nothing is taken without payment
+        try:
+            capture_hold_func = current_app.config['CAPTURE_HOLD_FUNC']
+            capture_hold_func(user['username'],hold_id,headers)
+        except Exception:
+            try:
+                current_app.config['VOID_HOLD_FUNC'](user['username'],hold_id,headers)
+            except Exception:
+                pass  # Already expired or captured; an expired hold no longer reserves funds
+            try:
+                release_reservation_func(reservation_id,headers)
+            except Exception:
+                pass  # Already expired or released; the inventory reaper covers anything left held
+            raise
+
+        # Take the reserved units out of stock, refunding the charge if it fails
+        try:
+            commit_reservation_func = current_app.config['COMMIT_RESERVATION_FUNC']
+            commit_reservation_func(reservation_id,headers)
+        except Exception:
+            try:
+                current_app.config['REFUND_WALLET_FUNC'](user['username'],total_cost,headers)
+            except Exception:
+                current_app.logger.exception(f"Error refunding {total_cost} to {user['username']} for reservation {reservation_id}")
+            try:
+                release_reservation_func(reservation_id,headers)
+            except Exception:
+                pass  # Already expired or released; the inventory reaper covers anything left held
+            raise
 
         # Log the order in the local database
-        new_order = Order(customer_id=customer["id"], item_id=item.id, quantity=quantity)
+        new_order = Order(customer_id=customer["id"], item_id=item.id, quantity=quantity, unit_price=item.price_per_item)
         db_session.add(new_order)
+        CustomerStats.record_order(db_session, customer["id"], quantity, total_cost)
         db_session.commit()
+        typeahead.add_score(item_id, quantity)
         remove_wishlist(item_id)
         return jsonify({
             "message": f"{customer['username']} successfully purchased {quantity} unit(s) of {item.name}.",
@@ -413,6 +835,112 @@ def purchase_item(item_id):
     finally:
         db_session.close()
 
+ORDER_FILTER_MAX_VALUES = 500
+
+@app.route('/orders', methods=['GET'])
+@identity_required()
+@role_required(['admin'])
+def get_orders():
+    """
+    Retrieve orders across all customers, one page at a time, newest first.
+
+    Filters can be combined. Each maps to an indexed range scan: item filters use the
+    (item_id, created_at) index, customer filters the (customer_id, created_at) index, 
+    and date windows alone the created_at index.
+
+    Endpoint:
+        GET /orders
+
+    Query Parameters:
+        - item_id (int): Optional item ID. May be repeated to match any of several items.
+        - customer (str): Optional username. May be repeated to match any of several customers.
+        - customer_id (int): Optional customer ID. May be repeated.
+        - from (str): Optional ISO 8601 date or datetime. Only orders placed at or after it are returned.
+        - to (str): Optional ISO 8601 date or datetime. Only orders placed before it are returned.
+        - limit (int): Optional page size, the configured default if not given. Capped at the
+          configured maximum page size.
+        - cursor (str): Optional cursor returned with the previous page.
+
+    Decorators:
+        @identity_required() - Ensures the user is authenticated using a JWT token.
+        @role_required(['admin']) - Restricts access to users with the "admin" role.
+
+    Returns:
+        - 200 OK: A JSON object containing the page of orders, each with the customer's username,
+        the item name, unit price and total, and the `next_cursor`.
+        - 400 Bad Request: If a filter, the limit or the cursor is invalid.
+        - 500 Internal Server Error: If an exception occurs during the process.
+    """
+    db_session = SessionLocal()
+    try:
+        jwt_token = create_access_token(identity=get_jwt_identity())
+        headers = {
+            'Authorization': f'Bearer {jwt_token}',
+            'Content-Type': 'application/json'
+        }
+        get_customers_data_func = current_app.config['GET_CUSTOMERS_DATA_FUNC']
+
+        filters = []
+        for param, column in (('item_id', Order.item_id), ('customer_id', Order.customer_id)):
+            values = request.args.getlist(param)
+            if values:
+                if not all(value.isdigit() for value in values) or len(values) > ORDER_FILTER_MAX_VALUES:
+                    return jsonify({'error': f"Invalid '{param}'. Must be up to {ORDER_FILTER_MAX_VALUES} positive integers."}), 400
+                filters.append(column.in_({int(value) for value in values}))
+
+        usernames = request.args.getlist('customer')
+        if usernames:
+            if len(usernames) > ORDER_FILTER_MAX_VALUES:
+                return jsonify({'error': f"Invalid 'customer'. At most {ORDER_FILTER_MAX_VALUES} usernames can be given."}), 400
+            customers = get_customers_data_func(usernames, headers, fields=['id'])
+            filters.append(Order.customer_id.in_({customer['id'] for customer in customers.values()}))
+
+        for param in ('from', 'to'):
+            if request.args.get(param):
+                try:
+                    bound = datetime.fromisoformat(request.args[param])
+                except ValueError:
+                    return jsonify({'error': f"Invalid '{param}'. Must be an ISO 8601 date or datetime."}), 400
+                filters.append(Order.created_at >= bound if param == 'from' else Order.created_at < bound)
+
+        limit, cursor = get_page_args()
+        unit_price = func.coalesce(Order.unit_price, InventoryItem.price_per_item)
+        query = (
+            db_session.query(
+                Order.id, Order.customer_id, Order.item_id, InventoryItem.name, Order.quantity,
+                unit_price.label('unit_price'), Order.created_at
+            )
+            .join(InventoryItem, InventoryItem.id == Order.item_id)
+            .filter(*filters)
+        )
+        orders, next_cursor = paginate(query, [Order.created_at, Order.id], limit, cursor, descending=True)
+
+        customers = get_customers_data_func(
+            [order.customer_id for order in orders], headers, key='ids', fields=['username']
+        ) if orders else {}
+
+        orders_list = [
+            {
+                'order_id': order.id,
+                'customer_id': order.customer_id,
+                'username': customers.get(str(order.customer_id), {}).get('username'),
+                'item_id': order.item_id,
+                'item_name': order.name,
+                'quantity': order.quantity,
+                'unit_price': order.unit_price,
+                'total': round(order.quantity * order.unit_price, 2),
+                'created_at': order.created_at.isoformat() if order.created_at else None
+            }
+            for order in orders
+        ]
+        return paginated_response({'orders': orders_list}, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        db_session.close()
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -462,9 +990,12 @@ def health_check():
         "status": overall_status,
         "database": db_status,
         "customer_service": customer_service_status,
-        "inventory_service": inventory_service_status
+        "inventory_service": inventory_service_status,
+        "rate_limited": get_rate_limit_stats()
     }), 200 if overall_status == "healthy" else 500
 
 
 if __name__ == '__main__':
+    start_catalog_load()
+    start_periodic_job(load_popularity, app.config.get('POPULARITY_REFRESH_SECONDS', 300), app.logger, "loading item popularity")
     app.run(host="0.0.0.0", port=3003)
@@ -1,6 +1,7 @@
 import os, sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import pytest
+from datetime import datetime
 from flask import json
 from shared.database import engine, SessionLocal
 from shared.models.base import Base
@@ -8,8 +9,9 @@ from shared.models.customer import Customer
 from shared.models.review import Review
 from shared.models.inventory import InventoryItem
 from shared.models.order import Order
+from shared.models.customer_stats import CustomerStats
 from shared.models.wishlist import Wishlist
-from sales.app import app as flask_app
+from sales.app import app as flask_app, load_catalog, load_popularity
 from flask_jwt_extended import create_access_token
 from argon2 import PasswordHasher
 
@@ -37,16 +39,45 @@ def app():
             "role":"customer",
             "wallet":500.0
             }
-    def mock_deduct_wallet(username,total_cost,headers):
-        print("hellooo")
+    def mock_get_customers_data(values,headers,key='usernames',fields=None):
+        session = SessionLocal()
+        try:
+            column = Customer.username if key == 'usernames' else Customer.id
+            customers = session.query(Customer).filter(column.in_(values)).all()
+            return {
+                str(getattr(customer, column.key)): {'id': customer.id, 'username': customer.username}
+                for customer in customers
+            }
+        finally:
+            session.close()
+
+    def mock_hold_wallet(username,total_cost,headers):
+        return 1
+
+    def mock_settle_hold(username,hold_id,headers):
         return 0
     
-    def mock_remove_stock(item_id,quantity,headers):
+    def mock_reserve_stock(item_id,quantity,headers):
+        session = SessionLocal()
+        try:
+            item = session.query(InventoryItem).filter_by(id=item_id).first()
+            return 1 if item.stock_count >= quantity else None
+        finally:
+            session.close()
+
+    def mock_settle_reservation(reservation_id,headers):
         return 0
 
     flask_app.config['GET_CUSTOMER_DATA_FUNC'] = mock_get_customer_data
-    flask_app.config['REMOVE_STOCK_FUNC'] = mock_remove_stock
-    flask_app.config['DEDUCT_WALLET_FUNC'] = mock_deduct_wallet
+    flask_app.config['CATALOG_REFRESH_SECONDS'] = 0
+    flask_app.config['GET_CUSTOMERS_DATA_FUNC'] = mock_get_customers_data
+    flask_app.config['RESERVE_STOCK_FUNC'] = mock_reserve_stock
+    flask_app.config['COMMIT_RESERVATION_FUNC'] = mock_settle_reservation
+    flask_app.config['RELEASE_RESERVATION_FUNC'] = mock_settle_reservation
+    flask_app.config['HOLD_WALLET_FUNC'] = mock_hold_wallet
+    flask_app.config['CAPTURE_HOLD_FUNC'] = mock_settle_hold
+    flask_app.config['VOID_HOLD_FUNC'] = mock_settle_hold
+    load_catalog()
 
     yield flask_app
     # Teardown: Drop all tables
@@ -196,8 +227,7 @@ def test_get_items(client, db_session, get_auth_tokens, ):
         headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'}
     )
     assert response.status_code == 200
-    data = response.get_json()
-    assert isinstance(data, list)
+    data = response.get_json()['items']
     assert len(data) >= 1 
     assert data[0]['name'] == 'Apple'
 
@@ -211,8 +241,7 @@ def test_get_items_by_category(client, db_session, get_auth_tokens, ):
         headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'}
     )
     assert response.status_code == 200
-    data = response.get_json()
-    assert isinstance(data, list)
+    data = response.get_json()['items']
     assert len(data) >= 1
     assert data[0]['name'] == 'Apple'
 
@@ -344,6 +373,11 @@ def test_purchase_item(client, db_session, get_auth_tokens ):
     assert order is not None
     assert order.quantity == 2
 
+    stats = db_session.query(CustomerStats).filter_by(customer_id=order.customer_id).first()
+    assert stats.order_count == 1
+    assert stats.units_purchased == 2
+    assert stats.lifetime_spend_cents == round(order.quantity * order.unit_price * 100)
+
 def test_purchase_item_insufficient_amount(client, db_session, get_auth_tokens, ):
     """
     Test purchasing an item when the wallet balance is insufficient.
@@ -389,4 +423,288 @@ def test_purchase_item_no_item(client, db_session, get_auth_tokens, ):
     )
     assert response.status_code == 404
     data = response.get_json()
-    assert data['error'] == 'Item not found'
\ No newline at end of file
+    assert data['error'] == 'Item not found'
+
+def test_purchase_item_stock_failure_refunds(client, db_session, get_auth_tokens, ):
+    """
+    Test that the charge is refunded and the reservation released when the stock update fails.
+    """
+    calls = []
+
+    def failing_commit_reservation(reservation_id,headers):
+        raise Exception('Inventory service unavailable')
+
+    keys = ('COMMIT_RESERVATION_FUNC', 'RELEASE_RESERVATION_FUNC', 'CAPTURE_HOLD_FUNC', 'VOID_HOLD_FUNC', 'REFUND_WALLET_FUNC')
+    original = {key: flask_app.config.get(key) for key in keys}
+    flask_app.config['COMMIT_RESERVATION_FUNC'] = failing_commit_reservation
+    flask_app.config['RELEASE_RESERVATION_FUNC'] = lambda reservation_id, headers: calls.append(('release', reservation_id))
+    flask_app.config['CAPTURE_HOLD_FUNC'] = lambda username, hold_id, headers: calls.append(('capture', hold_id))
+    flask_app.config['VOID_HOLD_FUNC'] = lambda username, hold_id, headers: calls.append(('void', hold_id))
+    flask_app.config['REFUND_WALLET_FUNC'] = lambda username, amount, headers: calls.append(('refund', amount))
+    try:
+        response = client.post(
+            f'/purchase/{1}',
+            headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'},
+            json={'quantity': 1}
+        )
+    finally:
+        flask_app.config.update(original)
+
+    assert response.status_code == 500
+    assert calls == [('capture', 1), ('refund', 50.0), ('release', 1)]
+
+def test_purchase_item_capture_failure_releases_stock(client, db_session, get_auth_tokens, ):
+    """
+    Test that no stock is taken and both reservations are released when the charge fails.
+    """
+    calls = []
+
+    def failing_capture(username,hold_id,headers):
+        raise Exception('Hold expired')
+
+    keys = ('COMMIT_RESERVATION_FUNC', 'RELEASE_RESERVATION_FUNC', 'CAPTURE_HOLD_FUNC', 'VOID_HOLD_FUNC')
+    original = {key: flask_app.config[key] for key in keys}
+    flask_app.config['COMMIT_RESERVATION_FUNC'] = lambda reservation_id, headers: calls.append(('commit', reservation_id))
+    flask_app.config['RELEASE_RESERVATION_FUNC'] = lambda reservation_id, headers: calls.append(('release', reservation_id))
+    flask_app.config['CAPTURE_HOLD_FUNC'] = failing_capture
+    flask_app.config['VOID_HOLD_FUNC'] = lambda username, hold_id, headers: calls.append(('void', hold_id))
+    orders = db_session.query(Order).count()
+    try:
+        response = client.post(
+            f'/purchase/{1}',
+            headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'},
+            json={'quantity': 1}
+        )
+    finally:
+        flask_app.config.update(original)
+
+    assert response.status_code == 500
+    assert calls == [('void', 1), ('release', 1)]
+    assert db_session.query(Order).count() == orders
+
+def test_purchase_item_hold_rejected(client, db_session, get_auth_tokens, ):
+    """
+    Test that a rejected wallet hold releases the stock reservation before any stock is removed.
+    """
+    calls = []
+    keys = ('HOLD_WALLET_FUNC', 'COMMIT_RESERVATION_FUNC', 'RELEASE_RESERVATION_FUNC')
+    original = {key: flask_app.config[key] for key in keys}
+    flask_app.config['HOLD_WALLET_FUNC'] = lambda username, total_cost, headers: None
+    flask_app.config['COMMIT_RESERVATION_FUNC'] = lambda reservation_id, headers: calls.append(('commit', reservation_id))
+    flask_app.config['RELEASE_RESERVATION_FUNC'] = lambda reservation_id, headers: calls.append(('release', reservation_id))
+    try:
+        response = client.post(
+            f'/purchase/{1}',
+            headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'},
+            json={'quantity': 1}
+        )
+    finally:
+        flask_app.config.update(original)
+
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Insufficient wallet balance'
+    assert calls == [('release', 1)]
+
+def test_get_items_paginated(client, db_session, get_auth_tokens, ):
+    """
+    Test paging through the inventory with a cursor.
+    """
+    for name in ('Banana', 'Cherry'):
+        db_session.add(InventoryItem(name=name, price_per_item=2.0, stock_count=10, category="food"))
+    db_session.commit()
+
+    headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+    response = client.get('/inventory/food?limit=2', headers=headers)
+    assert response.status_code == 200
+    first_page = [item['name'] for item in response.get_json()['items']]
+    assert len(first_page) == 2
+    cursor = response.get_json()['next_cursor']
+    assert response.headers['X-Next-Cursor'] == cursor
+
+    response = client.get(f'/inventory/food?limit=2&cursor={cursor}', headers=headers)
+    assert response.status_code == 200
+    second_page = [item['name'] for item in response.get_json()['items']]
+    assert response.get_json()['next_cursor'] is None
+    assert 'X-Next-Cursor' not in response.headers
+    assert sorted(first_page + second_page) == ['Apple', 'Banana', 'Cherry']
+
+    # Without limit or cursor, the first page has the default size
+    response = client.get('/inventory/food', headers=headers)
+    assert sorted(item['name'] for item in response.get_json()['items']) == ['Apple', 'Banana', 'Cherry']
+    assert response.get_json()['next_cursor'] is None
+
+    # The compatibility setting sends every item as a bare list
+    client.application.config['UNPAGINATED_LISTS'] = True
+    try:
+        response = client.get('/inventory/food', headers=headers)
+        assert sorted(item['name'] for item in response.get_json()) == ['Apple', 'Banana', 'Cherry']
+    finally:
+        client.application.config.pop('UNPAGINATED_LISTS')
+
+def test_get_orders_with_filters(client, db_session, get_auth_tokens):
+    """
+    Test listing orders across customers with item, customer and date filters.
+    """
+    admin = db_session.query(Customer).filter_by(username='admin').first()
+    user = db_session.query(Customer).filter_by(username='user1').first()
+    pear = InventoryItem(name="Pear", price_per_item=2.0, stock_count=10, category="food")
+    db_session.add(pear)
+    db_session.commit()
+    db_session.add_all([
+        Order(customer_id=admin.id, item_id=pear.id, quantity=1, unit_price=2.0, created_at=datetime(2023, 5, 1)),
+        Order(customer_id=user.id, item_id=pear.id, quantity=2, unit_price=2.0, created_at=datetime(2023, 6, 1)),
+        Order(customer_id=user.id, item_id=pear.id, quantity=3, unit_price=1.5, created_at=datetime(2023, 7, 1)),
+    ])
+    db_session.commit()
+    headers = {'Authorization': f'Bearer {get_auth_tokens["admin"]}'}
+
+    response = client.get(f'/orders?item_id={pear.id}&limit=2', headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [order['quantity'] for order in data['orders']] == [3, 2]
+    assert data['orders'][0]['username'] == 'user1'
+    assert data['orders'][0]['total'] == 4.5
+
+    response = client.get(f'/orders?item_id={pear.id}&limit=2&cursor={data["next_cursor"]}', headers=headers)
+    data = response.get_json()
+    assert [order['username'] for order in data['orders']] == ['admin']
+    assert data['next_cursor'] is None
+
+    response = client.get(f'/orders?item_id={pear.id}&customer=user1&from=2023-06-15', headers=headers)
+    assert [order['quantity'] for order in response.get_json()['orders']] == [3]
+
+    response = client.get(f'/orders?item_id={pear.id}&to=2023-06-01', headers=headers)
+    assert [order['quantity'] for order in response.get_json()['orders']] == [1]
+
+    response = client.get('/orders?item_id=abc', headers=headers)
+    assert response.status_code == 400
+
+    response = client.get('/orders', headers={'Authorization': f'Bearer {get_auth_tokens["user"]}'})
+    assert response.status_code == 403
+
+def test_get_items_batch(client, db_session, get_auth_tokens):
+    """
+    Test looking up many items in one request.
+    """
+    items = [InventoryItem(name=name, price_per_item=3.0, stock_count=4, category="clothes") for name in ('Gloves', 'Beanie')]
+    db_session.add_all(items)
+    db_session.commit()
+    gloves, beanie = [item.id for item in items]
+
+    headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+    response = client.post('/inventory/batch', headers=headers, json={'item_ids': [gloves, beanie, 99999, gloves]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['missing'] == [99999]
+    assert data['items'][str(gloves)]['name'] == 'Gloves'
+    assert data['items'][str(beanie)]['available_stock'] == 4
+
+    response = client.post('/inventory/batch', headers=headers, json={'item_ids': [beanie], 'fields': ['name', 'price_per_item']})
+    assert response.get_json()['items'] == {str(beanie): {'name': 'Beanie', 'price_per_item': 3.0}}
+
+    response = client.post('/inventory/batch', headers=headers, json={'item_ids': [beanie], 'fields': ['password']})
+    assert response.status_code == 400
+    response = client.post('/inventory/batch', headers=headers, json={'item_ids': list(range(501))})
+    assert response.status_code == 400
+
+def test_get_inventory_filters(client, db_session, get_auth_tokens):
+    """
+    Test filtering and sorting the catalog snapshot, and refreshing it from the change log.
+    """
+    from shared.models.catalog_change import CatalogChange
+    from sales.app import catalog
+    items = [
+        InventoryItem(name="Tablet", price_per_item=300.0, stock_count=0, category="electronics"),
+        InventoryItem(name="Earbuds", price_per_item=40.0, stock_count=5, category="electronics"),
+        InventoryItem(name="Cable", price_per_item=8.0, stock_count=50, category="electronics")
+    ]
+    db_session.add_all(items)
+    db_session.commit()
+    tablet = items[0]
+
+    headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+    response = client.get('/inventory/electronics?sort=-price&in_stock=true', headers=headers)
+    assert response.status_code == 200
+    assert [item['name'] for item in response.get_json()['items']] == ['Earbuds', 'Cable']
+
+    response = client.get('/inventory?category=electronics,clothes&min_price=10&max_price=400&sort=price&limit=1', headers=headers)
+    assert [item['name'] for item in response.get_json()['items']] == ['Earbuds']
+    cursor = response.get_json()['next_cursor']
+    response = client.get(f'/inventory?category=electronics,clothes&min_price=10&max_price=400&sort=price&limit=1&cursor={cursor}', headers=headers)
+    assert [item['name'] for item in response.get_json()['items']] == ['Tablet']
+
+    # Restocking goes through the change log
+    tablet.stock_count = 3
+    db_session.add(CatalogChange(item_id=tablet.id))
+    db_session.commit()
+    catalog.settle_seconds = 0
+    response = client.get('/inventory/electronics?sort=-price&in_stock=true', headers=headers)
+    assert [item['name'] for item in response.get_json()['items']] == ['Tablet', 'Earbuds', 'Cable']
+
+    response = client.get('/inventory?sort=name', headers=headers)
+    assert response.status_code == 400
+    response = client.get('/inventory?min_price=cheap', headers=headers)
+    assert response.status_code == 400
+
+def test_get_inventory_while_loading(client, get_auth_tokens, monkeypatch):
+    """
+    Test that listings are unavailable until the catalog snapshot is loaded.
+    """
+    import sales.app
+    monkeypatch.setattr(sales.app.catalog, 'loaded', False)
+    monkeypatch.setattr(sales.app, 'start_catalog_load', lambda: None)
+    headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+    response = client.get('/inventory', headers=headers)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+def test_suggest_items(client, db_session, get_auth_tokens):
+    """
+    Test prefix suggestions ranked by units sold, and following renames from the change log.
+    """
+    from shared.models.catalog_change import CatalogChange
+    from sales.app import catalog
+    user = db_session.query(Customer).filter_by(username="user1").first()
+    items = [
+        InventoryItem(name="Zephyr Lamp", price_per_item=20.0, stock_count=5, category="electronics"),
+        InventoryItem(name="Zesty Zephyr Sauce", price_per_item=4.0, stock_count=5, category="food"),
+        InventoryItem(name="Zinc Bowl", price_per_item=9.0, stock_count=5, category="accessories")
+    ]
+    db_session.add_all(items)
+    db_session.commit()
+    lamp, sauce, bowl = items
+    db_session.add(Order(customer_id=user.id, item_id=sauce.id, quantity=4, unit_price=4.0))
+    db_session.commit()
+
+    load_popularity(db_session)
+    headers = {'Authorization': f'Bearer {get_auth_tokens["user"]}'}
+    response = client.get('/inventory/suggest?q=ZEP', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['suggestions'] == [
+        {'id': sauce.id, 'name': 'Zesty Zephyr Sauce', 'popularity': 4},
+        {'id': lamp.id, 'name': 'Zephyr Lamp', 'popularity': 0}
+    ]
+    response = client.get('/inventory/suggest?q=z&limit=1', headers=headers)
+    assert [item['id'] for item in response.get_json()['suggestions']] == [sauce.id]
+
+    # Renames go through the change log
+    bowl.name = "Zephyr Bowl"
+    db_session.add(CatalogChange(item_id=bowl.id))
+    db_session.commit()
+    catalog.settle_seconds = 0
+    response = client.get('/inventory/suggest?q=zephyr b', headers=headers)
+    assert [item['name'] for item in response.get_json()['suggestions']] == ['Zephyr Bowl']
+    response = client.get('/inventory/suggest?q=zinc', headers=headers)
+    assert response.get_json()['suggestions'] == []
+
+    # Characters beyond the Basic Multilingual Plane still sort inside the prefix range
+    mug = InventoryItem(name="Zephyr\U0001f642 Mug", price_per_item=6.0, stock_count=5, category="accessories")
+    db_session.add(mug)
+    db_session.commit()
+    response = client.get('/inventory/suggest?q=zephyr', headers=headers)
+    assert mug.id in [item['id'] for item in response.get_json()['suggestions']]
+
+    response = client.get('/inventory/suggest?q=', headers=headers)
+    assert response.status_code == 400
+    response = client.get('/inventory/suggest?q=zep&limit=500', headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,64 @@
+import hashlib
+import math
+import threading
+
+class CountingBloomFilter:
+    """
+    Counting Bloom filter for fast, approximate set membership checks.
+
+    Each slot holds a small counter instead of a single bit, so members can be
+    removed as well as added. Lookups never return false negatives for members
+    that were added; they may return false positives at roughly `error_rate`.
+
+    Attributes:
+        capacity (int): The number of members the filter is sized for.
+        error_rate (float): The target false positive rate at `capacity` members.
+        size (int): The number of counter slots.
+        hash_count (int): The number of slots each member maps to.
+        count (int): The number of members currently added.
+        ready (bool): Whether the filter has been populated and can answer negative lookups.
+
+    Methods:
+        add(value): Add a member to the filter.
+        remove(value): Remove a previously added member from the filter.
+        __contains__(value): Return True if the value is probably a member.
+    """
+    MAX_COUNTER = 255
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.counters = bytearray(self.size)
+        self.count = 0
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def _indexes(self, value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        with self.lock:
+            for index in self._indexes(value):
+                if self.counters[index] < self.MAX_COUNTER:
+                    self.counters[index] += 1
+            self.count += 1
+
+    def remove(self, value):
+        with self.lock:
+            indexes = self._indexes(value)
+            if not all(self.counters[index] for index in indexes):
+                return
+            for index in indexes:
+                # Saturated counters may be shared by more members than they can count
+                if self.counters[index] < self.MAX_COUNTER:
+                    self.counters[index] -= 1
+            self.count -= 1
+
+    def __contains__(self, value):
+        counters = self.counters
+        return all(counters[index] for index in self._indexes(value))
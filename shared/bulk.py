@@ -0,0 +1,144 @@
+"""
+Helpers for bulk imports: parsing uploaded records, chunking and parallel password hashing.
+
+Uploads may be newline-delimited JSON, CSV with a header row, or a JSON array, parsed
+from a string or streamed from the request. Parsing never stops at a bad record; it
+yields a per-row error instead so the caller can report every problem in one response.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from argon2 import PasswordHasher
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+CSV_TYPES = ("text/csv",)
+JSON_TYPES = ("application/json",)
+
+def parse_records(body, mimetype, types=None):
+    """
+    Parse an uploaded body into records.
+
+    Parameters:
+        body (str): The raw request body.
+        mimetype (str): The content type of the body.
+        types (dict): Optional map of CSV column names to callables converting their values,
+                      since CSV cells are always strings.
+
+    Returns:
+        list: `(row, record, error)` tuples, where `row` is the 1-based record number and
+        exactly one of `record` and `error` is set.
+
+    Raises:
+        ValueError: If the content type is not supported or a JSON array body is malformed.
+    """
+    return list(iter_records(io.StringIO(body), mimetype, types))
+
+def iter_records(stream, mimetype, types=None):
+    """
+    Lazily parse records from a text stream, so large uploads never sit in memory whole.
+
+    NDJSON and CSV are read line by line. A JSON array has to be read completely before
+    its first record is returned.
+
+    Parameters:
+        stream (TextIO): The text stream to read, such as the wrapped request stream.
+        mimetype (str): The content type of the stream.
+        types (dict): Optional map of CSV column names to callables converting their values.
+
+    Yields:
+        tuple: `(row, record, error)` tuples, as returned by `parse_records`.
+
+    Raises:
+        ValueError: If the content type is not supported or a JSON array body is malformed.
+    """
+    if mimetype in NDJSON_TYPES:
+        return _iter_ndjson(stream)
+    if mimetype in CSV_TYPES:
+        return _iter_csv(stream, types or {})
+    if mimetype in JSON_TYPES:
+        try:
+            records = json.load(stream)
+        except json.JSONDecodeError:
+            raise ValueError("Invalid JSON body")
+        if not isinstance(records, list):
+            raise ValueError("JSON body must be an array of objects")
+        return (_check_record(row, record) for row, record in enumerate(records, start=1))
+    raise ValueError(f"Unsupported content type. Use one of: {', '.join(NDJSON_TYPES + CSV_TYPES + JSON_TYPES)}.")
+
+def _check_record(row, record):
+    if not isinstance(record, dict):
+        return row, None, "Record must be an object"
+    return row, record, None
+
+def _iter_ndjson(stream):
+    row = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            yield _check_record(row, json.loads(line))
+        except json.JSONDecodeError:
+            yield row, None, "Invalid JSON"
+
+def _iter_csv(stream, types):
+    reader = csv.DictReader(stream)
+    for row, record in enumerate(reader, start=1):
+        if None in record:
+            yield row, None, "Too many columns"
+            continue
+        record = {key: value for key, value in record.items() if value not in (None, "")}
+        try:
+            for column, convert in types.items():
+                if column in record:
+                    record[column] = convert(record[column])
+        except ValueError:
+            yield row, None, f"Invalid value for '{column}'"
+            continue
+        yield row, record, None
+
+def chunked(items, size):
+    """
+    Yield successive lists of at most `size` items from a list or any other iterable.
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+_hasher = PasswordHasher()
+
+def _hash_password(password):
+    return _hasher.hash(password)
+
+def hash_passwords(passwords, workers=None, parallel_threshold=32, executor=None):
+    """
+    Hash many passwords with Argon2, spreading the work across a process pool.
+
+    Small batches are hashed inline, where handing them to worker processes would cost more
+    than it saves. Callers hashing several batches should pass one `executor` for all of them,
+    so the worker processes start once rather than once per batch.
+
+    Parameters:
+        passwords (list): The plain text passwords.
+        workers (int): The number of worker processes. Defaults to the CPU count.
+        parallel_threshold (int): The smallest batch hashed in parallel.
+        executor (ProcessPoolExecutor): Optional pool of `workers` processes to hash with. A pool
+                                        is started and shut down for this call if not given.
+
+    Returns:
+        list: The hashes, in the same order as `passwords`.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < parallel_threshold:
+        return [_hash_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    if executor is not None:
+        return list(executor.map(_hash_password, passwords, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_hash_password, passwords, chunksize=chunksize))
@@ -0,0 +1,293 @@
+"""
+In-process columnar snapshot of the inventory catalog for fast filtered listing.
+
+The catalog is held as NumPy arrays (IDs, prices, available stock, category codes and interned
+names) sorted by item ID, so filters are evaluated as vectorized boolean masks and sorted
+pages are picked with a partial sort rather than a database query.
+
+A snapshot is loaded once from a full scan and then refreshed incrementally from the catalog
+change log: only items changed since the last version seen, plus items inserted with a higher
+ID, are re-read. Each refresh builds new arrays and swaps them in at once, so readers never
+see a half-applied refresh. Changes are only treated as seen once they are older than
+`settle_seconds`, so a transaction committing out of version order is picked up on a later
+refresh instead of being skipped.
+
+Other in-memory indexes of the catalog can follow the same refreshes by registering a
+listener, which is called with the `(item_id, name)` pairs of every loaded or changed item.
+"""
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import func, select
+from shared.models.catalog_change import CatalogChange
+from shared.models.inventory import InventoryItem
+from shared.stock import available_expression, utcnow
+
+Snapshot = namedtuple("Snapshot", ["ids", "prices", "available", "categories", "names", "orders"])
+Snapshot.__new__.__defaults__ = (None,)
+
+SORTS = ("id", "price", "-price")
+
+def _empty_snapshot():
+    return Snapshot(
+        np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64),
+        np.empty(0, dtype=np.int16), np.empty(0, dtype=object), {}
+    )
+
+class ColumnarCatalog:
+    """
+    Thread-safe columnar snapshot of the inventory catalog.
+
+    Attributes:
+        version (int): The catalog version up to which every change has been applied.
+        loaded (bool): Whether the snapshot has been loaded.
+        settle_seconds (float): How old a change must be before the version moves past it.
+        listeners (list): Callables invoked as `listener(items, removed, full)` after each load
+                          (`full` True, `items` holding every item) or refresh (`items` holding
+                          the changed items and `removed` the deleted IDs).
+    """
+    def __init__(self, settle_seconds=2):
+        self.version = 0
+        self.loaded = False
+        self.settle_seconds = settle_seconds
+        self.refreshed_at = 0.0
+        self.listeners = []
+        self._snapshot = _empty_snapshot()
+        self._category_codes = {}
+        self._category_names = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._snapshot.ids)
+
+    def _code(self, category):
+        category = category.lower()
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._category_names)
+            self._category_names.append(category)
+        return code
+
+    def _columns(self, rows):
+        ids, prices, available, categories, names = [], [], [], [], []
+        for item_id, name, category, price, count in rows:
+            ids.append(item_id)
+            names.append(sys.intern(name))
+            categories.append(self._code(category))
+            prices.append(price)
+            available.append(count)
+        names_array = np.empty(len(names), dtype=object)
+        names_array[:] = names
+        return Snapshot(
+            np.array(ids, dtype=np.int64), np.array(prices, dtype=np.float64), np.array(available, dtype=np.int64),
+            np.array(categories, dtype=np.int16), names_array, {}
+        )
+
+    def _select(self):
+        return select(InventoryItem.id, InventoryItem.name, InventoryItem.category, InventoryItem.price_per_item, available_expression())
+
+    def load(self, db_session, batch_size=10000):
+        """
+        Replace the snapshot with a full scan of the catalog.
+        """
+        with self._lock:
+            self._load(db_session, batch_size)
+
+    def _load(self, db_session, batch_size=10000):
+        # Read the version first, so changes made during the scan are applied by the next refresh
+        version = db_session.execute(select(func.max(CatalogChange.version))).scalar() or 0
+        rows = db_session.execute(self._select().order_by(InventoryItem.id).execution_options(yield_per=batch_size))
+        self._snapshot = self._columns(rows)
+        self.version = version
+        self.loaded = True
+        self.refreshed_at = time.monotonic()
+        self._notify(self._snapshot, [], True)
+
+    def refresh(self, db_session, max_age=0):
+        """
+        Bring a loaded snapshot up to date. Does nothing until `load()` has finished, so callers
+        never wait for the full scan.
+
+        Parameters:
+            db_session (Session): The session to read with.
+            max_age (float): Skip the refresh if the last one is more recent than this many seconds.
+                             If another thread is already refreshing, return at once and let
+                             callers read the current snapshot.
+        """
+        if not self.loaded or time.monotonic() - self.refreshed_at < max_age:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self.refreshed_at >= max_age:
+                self._refresh(db_session)
+        finally:
+            self._lock.release()
+
+    def _refresh(self, db_session):
+        oldest = db_session.execute(select(func.min(CatalogChange.version))).scalar()
+        if oldest is not None and self.version < oldest - 1:
+            # Changes were pruned before they were applied
+            self._load(db_session)
+            return
+
+        horizon = utcnow() - timedelta(seconds=self.settle_seconds)
+        changes = db_session.execute(
+            select(CatalogChange.version, CatalogChange.item_id, CatalogChange.created_at)
+            .where(CatalogChange.version > self.version)
+            .order_by(CatalogChange.version)
+        ).all()
+        version = self.version
+        for change_version, _, created_at in changes:
+            if created_at > horizon:
+                break
+            version = change_version
+
+        snapshot = self._snapshot
+        changed = {item_id for _, item_id, _ in changes}
+        # Items inserted without going through the change log still have higher IDs
+        condition = InventoryItem.id > (int(snapshot.ids[-1]) if len(snapshot.ids) else 0)
+        if changed:
+            condition = condition | InventoryItem.id.in_(changed)
+        rows = db_session.execute(self._select().where(condition).order_by(InventoryItem.id)).all()
+
+        found = {row[0] for row in rows}
+        updates = self._columns(rows)
+        deleted = [item_id for item_id in changed if item_id not in found]
+        self._snapshot = self._apply(snapshot, updates, deleted)
+        self.version = version
+        self.refreshed_at = time.monotonic()
+        if len(updates.ids) or deleted:
+            self._notify(updates, deleted, False)
+
+    def _notify(self, snapshot, removed, full):
+        items = list(zip(snapshot.ids.tolist(), snapshot.names))
+        for listener in self.listeners:
+            listener(items, removed, full)
+
+    def _apply(self, snapshot, updates, deleted):
+        """
+        Return a new snapshot with `updates` upserted by ID and the `deleted` IDs removed.
+        """
+        if not len(updates.ids) and not deleted:
+            return snapshot
+        positions = np.searchsorted(snapshot.ids, updates.ids)
+        clipped = np.minimum(positions, max(len(snapshot.ids) - 1, 0))
+        existing = (positions < len(snapshot.ids)) & (snapshot.ids[clipped] == updates.ids) if len(snapshot.ids) else np.zeros(len(updates.ids), dtype=bool)
+
+        columns = [column.copy() for column in snapshot[:5]]
+        for column, values in zip(columns, updates):
+            column[positions[existing]] = values[existing]
+
+        # Price orders only go stale when prices or membership change, not on stock changes
+        reorder = bool(deleted) or not existing.all() or np.any(snapshot.prices[positions[existing]] != updates.prices[existing])
+        if reorder:
+            keep = ~np.isin(columns[0], np.array(deleted, dtype=np.int64)) if deleted else slice(None)
+            columns = [
+                np.concatenate([column[keep], values[~existing]])
+                for column, values in zip(columns, updates)
+            ]
+            if len(columns[0]) > 1 and np.any(columns[0][1:] < columns[0][:-1]):
+                order = np.argsort(columns[0], kind="stable")
+                columns = [column[order] for column in columns]
+        return Snapshot(*columns, {} if reorder else snapshot.orders)
+
+    def _order(self, snapshot, sort):
+        """
+        Return the permutation of a snapshot's rows for a price sort and the sort keys in that
+        order, computing them on first use.
+        """
+        cached = snapshot.orders.get(sort)
+        if cached is None:
+            keys = snapshot.prices if sort == "price" else -snapshot.prices
+            permutation = np.lexsort((snapshot.ids, keys))
+            cached = snapshot.orders[sort] = (permutation, keys[permutation])
+        return cached
+
+    def query(self, categories=None, min_price=None, max_price=None, in_stock=None, sort="id", after=None, limit=50, chunk_size=4096):
+        """
+        Select one page of items matching all the given filters.
+
+        Rows are scanned in sort order from the cursor position, a chunk at a time, and the
+        filters are evaluated as vectorized masks over each chunk, so a page costs time in
+        proportion to the rows it has to skip rather than to the size of the catalog.
+
+        Parameters:
+            categories (list): Only include items in one of these categories.
+            min_price (float): Only include items priced at least this much.
+            max_price (float): Only include items priced at most this much.
+            in_stock (bool): Only include items with (True) or without (False) stock available to buy,
+                             so units held by reservations do not count.
+            sort (str): "id", "price" (cheapest first) or "-price" (dearest first). Ties are broken by ID.
+            after (list): The sort keys of the last item of the previous page: `[id]` when sorting by ID,
+                          `[price, id]` otherwise.
+            limit (int): The page size, or None for every matching item.
+            chunk_size (int): The number of rows scanned at a time. Doubles after every chunk.
+
+        Returns:
+            tuple: A list of item dicts with `id`, `name`, `category`, `price_per_item` and `available_stock`,
+            and whether more items match.
+        """
+        snapshot = self._snapshot
+        size = len(snapshot.ids)
+        if sort == "id":
+            permutation = None
+            start = int(np.searchsorted(snapshot.ids, after[0], side="right")) if after else 0
+        else:
+            permutation, keys = self._order(snapshot, sort)
+            start = 0
+            if after:
+                key = after[0] if sort == "price" else -after[0]
+                start = int(np.searchsorted(keys, key, side="left"))
+                end = int(np.searchsorted(keys, key, side="right"))
+                start += int(np.searchsorted(snapshot.ids[permutation[start:end]], after[1], side="right"))
+            # The price bounds cut the scanned range directly
+            lowest, highest = (min_price, max_price) if sort == "price" else (
+                None if max_price is None else -max_price, None if min_price is None else -min_price)
+            if lowest is not None:
+                start = max(start, int(np.searchsorted(keys, lowest, side="left")))
+            if highest is not None:
+                size = int(np.searchsorted(keys, highest, side="right"))
+
+        allowed = None
+        if categories is not None:
+            allowed = np.zeros(max(len(self._category_names), 1), dtype=bool)
+            allowed[[self._category_codes[category.lower()] for category in categories if category.lower() in self._category_codes]] = True
+
+        found = []
+        position = start
+        while position < size and (limit is None or sum(len(indices) for indices in found) <= limit):
+            end = min(position + chunk_size, size)
+            indices = np.arange(position, end) if permutation is None else permutation[position:end]
+            mask = np.ones(len(indices), dtype=bool)
+            if allowed is not None:
+                mask &= allowed[snapshot.categories[indices]]
+            if min_price is not None or max_price is not None:
+                prices = snapshot.prices[indices]
+                if min_price is not None:
+                    mask &= prices >= min_price
+                if max_price is not None:
+                    mask &= prices <= max_price
+            if in_stock is not None:
+                mask &= (snapshot.available[indices] > 0) == in_stock
+            found.append(indices[mask])
+            position = end
+            chunk_size *= 2
+
+        indices = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        if limit is not None:
+            indices = indices[:limit + 1]
+        items = [
+            {
+                "id": int(snapshot.ids[index]),
+                "name": snapshot.names[index],
+                "category": self._category_names[snapshot.categories[index]],
+                "price_per_item": float(snapshot.prices[index]),
+                "available_stock": int(snapshot.available[index])
+            }
+            for index in indices[:limit]
+        ]
+        return items, limit is not None and len(indices) > limit
@@ -0,0 +1,113 @@
+"""
+In-process publish/subscribe broker for server-sent events.
+
+Writers publish the latest state of a key (such as an item ID) after they commit, and each
+subscriber keeps only the newest unsent state per key it watches. Rapid changes to one key
+therefore coalesce into a single event, and a subscriber's buffer can never hold more than
+one entry per watched key, however slow its client reads.
+
+The broker lives in the memory of one process, so subscribers only see changes published by
+the same process.
+"""
+import json
+import threading
+
+class Subscription:
+    """
+    The pending events of one subscriber, keyed by the key they describe.
+
+    Attributes:
+        keys (frozenset): The keys the subscriber watches.
+    """
+    def __init__(self, keys):
+        self.keys = frozenset(keys)
+        self._pending = {}
+        self._condition = threading.Condition()
+
+    def push(self, key, event, data, replace=True):
+        """
+        Queue an event for `key`. Unless `replace` is False, it supersedes any unsent event for the key.
+        """
+        with self._condition:
+            if replace or key not in self._pending:
+                self._pending[key] = (event, data)
+                self._condition.notify()
+
+    def drain(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for events, then return and clear all pending ones.
+
+        Returns:
+            list: `(key, event, data)` tuples, empty if the wait timed out.
+        """
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+            pending, self._pending = self._pending, {}
+        return [(key, event, data) for key, (event, data) in pending.items()]
+
+class EventBroker:
+    """
+    Thread-safe registry of subscriptions, indexed by the keys they watch.
+
+    Attributes:
+        max_subscribers (int): The maximum number of concurrent subscriptions.
+    """
+    def __init__(self, max_subscribers=1000):
+        self.max_subscribers = max_subscribers
+        self._subscriptions = set()
+        self._watchers = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, keys):
+        """
+        Start watching `keys`.
+
+        Returns:
+            Subscription: The new subscription, or None if the broker is full.
+        """
+        subscription = Subscription(keys)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                return None
+            self._subscriptions.add(subscription)
+            for key in subscription.keys:
+                self._watchers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            for key in subscription.keys:
+                watchers = self._watchers.get(key)
+                if watchers is not None:
+                    watchers.discard(subscription)
+                    if not watchers:
+                        del self._watchers[key]
+
+    def watched(self, keys):
+        """
+        Return the subset of `keys` that at least one subscriber watches, so writers can skip
+        looking up state nobody is waiting for.
+        """
+        with self._lock:
+            return [key for key in keys if key in self._watchers]
+
+    def publish(self, key, event, data):
+        """
+        Deliver the latest `data` for `key` to every subscriber watching it, replacing any
+        event for the key they have not sent yet.
+        """
+        with self._lock:
+            watchers = list(self._watchers.get(key, ()))
+        for subscription in watchers:
+            subscription.push(key, event, data)
+
+def format_event(event, data):
+    """
+    Encode one server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
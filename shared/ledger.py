@@ -0,0 +1,375 @@
+"""
+Wallet ledger helpers.
+
+A customer's balance is the latest `WalletSnapshot` plus every `WalletEntry` written
+after it. Customers without a snapshot start from `Customer.wallet`, which the
+compactor keeps equal to the latest snapshot balance. Entries are only ever inserted.
+
+Credits neither lock nor update the customer row, so any number of them can run at
+once. Debits and holds do lock it (see `lock_customer`), because their balance check
+must not interleave with another debit of the same wallet: debits of one customer run
+one at a time, while debits of different customers run in parallel. The compactor also
+updates `Customer.wallet`, in short batches off the request path.
+
+Funds reserved by active `WalletHold` rows are not available for new debits or holds
+until they are captured (turned into a debit entry), voided or expired.
+"""
+import hashlib
+import json
+import math
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import BigInteger, cast, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from shared.models.customer import Customer
+from shared.models.wallet import WalletEntry, WalletSnapshot, WalletHold, WalletCreditChunk
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def to_cents(amount):
+    return int(round(amount * 100))
+
+def from_cents(cents):
+    return cents / 100.0
+
+def is_valid_amount(amount):
+    """
+    Check that a request amount in dollars is a number worth at least one cent.
+
+    Booleans are rejected although Python counts them as numbers, and so are amounts
+    that round to 0 cents, which would write empty ledger entries.
+    """
+    return (
+        isinstance(amount, (int, float)) and not isinstance(amount, bool)
+        and math.isfinite(amount) and to_cents(amount) > 0
+    )
+
+def _latest_snapshot(column, customer_id):
+    return (
+        select(column)
+        .where(WalletSnapshot.customer_id == customer_id)
+        .order_by(WalletSnapshot.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+def base_balance_expression(customer_id=Customer.id):
+    """
+    SQL expression for the balance (in cents) a customer had at their latest snapshot.
+    """
+    return func.coalesce(
+        _latest_snapshot(WalletSnapshot.balance_cents, customer_id),
+        cast(func.round(Customer.wallet * 100), BigInteger)
+    )
+
+def balance_expression(customer_id=Customer.id):
+    """
+    SQL expression for a customer's current balance in cents, correlated to `Customer`.
+    """
+    last_entry_id = func.coalesce(_latest_snapshot(WalletSnapshot.last_entry_id, customer_id), 0)
+    recent = (
+        select(func.coalesce(func.sum(WalletEntry.amount_cents), 0))
+        .where(WalletEntry.customer_id == customer_id, WalletEntry.id > last_entry_id)
+        .scalar_subquery()
+    )
+    return base_balance_expression(customer_id) + recent
+
+def held_expression(customer_id=Customer.id):
+    """
+    SQL expression for the total (in cents) reserved by a customer's active holds.
+    """
+    return (
+        select(func.coalesce(func.sum(WalletHold.amount_cents), 0))
+        .where(WalletHold.customer_id == customer_id, WalletHold.status == "held")
+        .scalar_subquery()
+    )
+
+def available_expression(customer_id=Customer.id):
+    """
+    SQL expression for the balance (in cents) a customer can still spend or reserve.
+    """
+    return balance_expression(customer_id) - held_expression(customer_id)
+
+def get_balance(db_session, username):
+    """
+    Return a customer's current balance in dollars, or None if the customer does not exist.
+    """
+    cents = db_session.execute(
+        select(balance_expression()).where(Customer.username == username)
+    ).scalar()
+    return None if cents is None else from_cents(cents)
+
+def get_balances(db_session, customer_ids):
+    """
+    Return a dict mapping each customer ID to its current balance in dollars.
+    """
+    if not customer_ids:
+        return {}
+    rows = db_session.execute(
+        select(Customer.id, balance_expression()).where(Customer.id.in_(customer_ids))
+    ).all()
+    return {customer_id: from_cents(cents) for customer_id, cents in rows}
+
+def lock_customer(db_session, username):
+    """
+    Lock a customer's row until the end of the transaction.
+
+    Debits and holds take this lock before their guarded INSERT ... SELECT, so concurrent
+    debits of the same wallet queue up on one row instead of deadlocking on the ledger's
+    gap locks. This serializes debits per customer, the price of checking the balance.
+    Credits do not take it.
+
+    Returns:
+        int: The customer's ID, or None if the customer does not exist.
+    """
+    return db_session.query(Customer.id).filter(Customer.username == username).with_for_update().scalar()
+
+def post_entry(db_session, username, amount, reference=None):
+    """
+    Append a credit or debit to a customer's ledger in a single INSERT ... SELECT.
+
+    Debits only insert a row if the available balance (excluding active holds) covers
+    them, so the check and the write are one statement. They lock the customer's row
+    first, see `lock_customer`. The caller commits.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        username (str): The username of the customer.
+        amount (float): The amount in dollars. Negative amounts are debits.
+        reference (str): Optional reference stored with the entry.
+
+    Returns:
+        tuple: The new balance in dollars (or None on failure) and an error message (or None on success).
+    """
+    cents = to_cents(amount)
+    source = select(Customer.id, literal(cents, BigInteger), literal(reference)).where(Customer.username == username)
+    if cents < 0:
+        if lock_customer(db_session, username) is None:
+            return None, 'Customer not found'
+        source = source.where(available_expression() >= -cents)
+
+    result = db_session.execute(
+        insert(WalletEntry).from_select(['customer_id', 'amount_cents', 'reference'], source)
+    )
+    if result.rowcount == 0:
+        if db_session.query(Customer.id).filter(Customer.username == username).first() is None:
+            return None, 'Customer not found'
+        return None, 'Insufficient balance'
+    return get_balance(db_session, username), None
+
+def credit_wallets(db_session, batch_id, credits, reference=None, chunk_size=500):
+    """
+    Credit many wallets at once, one transaction per chunk of `chunk_size` credits.
+
+    Each chunk resolves its usernames with one IN query and writes its ledger entries with one
+    multi-row INSERT, together with a `WalletCreditChunk` marker keyed by (batch_id, chunk).
+    Replaying a batch skips the chunks whose marker already exists, so every credit is applied
+    at most once even if a previous attempt failed part way. Replays must send the same credits
+    in the same order; the chunk checksums reject anything else.
+
+    Parameters:
+        db_session (Session): The database session to write with. Committed once per chunk.
+        batch_id (str): The client-supplied identifier of the batch.
+        credits (list): `(username, amount)` pairs with positive amounts in dollars.
+        reference (str): Optional reference stored with the entries. Defaults to "credit/<batch_id>".
+        chunk_size (int): The number of credits applied per transaction.
+
+    Returns:
+        tuple: A summary dict (or None on failure) and an error message (or None on success). The summary
+        holds the number of wallets `applied` by this call, the number `already_applied` by earlier
+        calls, the `credited` usernames and the `missing` usernames of the chunks applied by this call.
+    """
+    reference = reference or f"credit/{batch_id}"
+    cents = [(username, to_cents(amount)) for username, amount in credits]
+    chunks = [cents[start:start + chunk_size] for start in range(0, len(cents), chunk_size)]
+    checksums = [
+        hashlib.sha256(json.dumps(chunk, separators=(",", ":")).encode()).hexdigest()
+        for chunk in chunks
+    ]
+    conflict = 'Batch ID was already used with different credits'
+
+    recorded = {
+        chunk: (checksum, applied)
+        for chunk, checksum, applied in db_session.execute(
+            select(WalletCreditChunk.chunk, WalletCreditChunk.checksum, WalletCreditChunk.applied)
+            .where(WalletCreditChunk.batch_id == batch_id)
+        )
+    }
+    if any(chunk >= len(chunks) or checksum != checksums[chunk] for chunk, (checksum, _) in recorded.items()):
+        return None, conflict
+
+    summary = {'applied': 0, 'already_applied': 0, 'credited': [], 'missing': []}
+    for index, chunk in enumerate(chunks):
+        if index in recorded:
+            summary['already_applied'] += recorded[index][1]
+            continue
+        try:
+            db_session.execute(insert(WalletCreditChunk).values(
+                batch_id=batch_id, chunk=index, checksum=checksums[index], applied=0
+            ))
+        except IntegrityError:
+            # A concurrent call applied this chunk first
+            db_session.rollback()
+            checksum, applied = db_session.execute(
+                select(WalletCreditChunk.checksum, WalletCreditChunk.applied)
+                .where(WalletCreditChunk.batch_id == batch_id, WalletCreditChunk.chunk == index)
+            ).one()
+            if checksum != checksums[index]:
+                return None, conflict
+            summary['already_applied'] += applied
+            continue
+
+        customer_ids = dict(db_session.execute(
+            select(Customer.username, Customer.id).where(Customer.username.in_([username for username, _ in chunk]))
+        ).all())
+        entries = [
+            {'customer_id': customer_ids[username], 'amount_cents': amount_cents, 'reference': reference}
+            for username, amount_cents in chunk if username in customer_ids
+        ]
+        if entries:
+            db_session.execute(insert(WalletEntry).values(entries))
+        db_session.execute(
+            update(WalletCreditChunk)
+            .where(WalletCreditChunk.batch_id == batch_id, WalletCreditChunk.chunk == index)
+            .values(applied=len(entries))
+        )
+        db_session.commit()
+
+        summary['applied'] += len(entries)
+        summary['credited'].extend(username for username, _ in chunk if username in customer_ids)
+        summary['missing'].extend(username for username, _ in chunk if username not in customer_ids)
+    return summary, None
+
+def place_hold(db_session, username, amount, ttl):
+    """
+    Reserve funds on a customer's wallet in a single INSERT ... SELECT.
+
+    The hold is only written if the available balance covers it. Like debits, it locks the
+    customer's row first, see `lock_customer`. The caller commits.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        username (str): The username of the customer.
+        amount (float): The amount in dollars to reserve.
+        ttl (int): The number of seconds before the hold expires.
+
+    Returns:
+        tuple: The new `WalletHold` (or None on failure) and an error message (or None on success).
+    """
+    cents = to_cents(amount)
+    expires_at = utcnow() + timedelta(seconds=ttl)
+    if lock_customer(db_session, username) is None:
+        return None, 'Customer not found'
+    source = (
+        select(Customer.id, literal(cents, BigInteger), literal("held"), literal(expires_at))
+        .where(Customer.username == username, available_expression() >= cents)
+    )
+    result = db_session.execute(
+        insert(WalletHold).from_select(['customer_id', 'amount_cents', 'status', 'expires_at'], source)
+    )
+    if result.rowcount == 0:
+        if db_session.query(Customer.id).filter(Customer.username == username).first() is None:
+            return None, 'Customer not found'
+        return None, 'Insufficient balance'
+    return db_session.get(WalletHold, result.lastrowid), None
+
+def settle_hold(db_session, hold, status):
+    """
+    Move an active hold to its final state.
+
+    The transition is a conditional UPDATE on the hold's status and expiry, so a hold can
+    only be captured or voided once and never after it expires. Capturing also appends the
+    matching debit to the ledger. The caller commits.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        hold (WalletHold): The hold to settle.
+        status (str): Either "captured" or "voided".
+
+    Returns:
+        bool: True if the hold was active and has been settled.
+    """
+    conditions = [WalletHold.id == hold.id, WalletHold.status == "held"]
+    if status == "captured":
+        conditions.append(WalletHold.expires_at > utcnow())
+    result = db_session.execute(
+        update(WalletHold).where(*conditions).values(status=status).execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        return False
+    if status == "captured":
+        db_session.execute(insert(WalletEntry).values(
+            customer_id=hold.customer_id, amount_cents=-hold.amount_cents, reference=f"hold/{hold.id}"
+        ))
+    return True
+
+def expire_holds(db_session, batch_size=500):
+    """
+    Release holds whose TTL has passed, one batch per transaction.
+
+    Returns:
+        list: The IDs of the customers whose holds were released.
+    """
+    customer_ids = set()
+    while True:
+        rows = db_session.execute(
+            select(WalletHold.id, WalletHold.customer_id)
+            .where(WalletHold.status == "held", WalletHold.expires_at <= utcnow())
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return list(customer_ids)
+        db_session.execute(
+            update(WalletHold)
+            .where(WalletHold.id.in_([hold_id for hold_id, _ in rows]), WalletHold.status == "held")
+            .values(status="expired")
+            .execution_options(synchronize_session=False)
+        )
+        db_session.commit()
+        customer_ids.update(customer_id for _, customer_id in rows)
+
+def compact_wallets(db_session, up_to_entry_id, batch_size=500):
+    """
+    Roll ledger entries into new snapshots.
+
+    Only entries with an ID up to `up_to_entry_id` are compacted. Callers should pass a
+    watermark read one compaction interval earlier, so entries from transactions that
+    were still open at that time are never skipped.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        up_to_entry_id (int): The highest entry ID that may be included in a snapshot.
+        batch_size (int): The number of customers compacted per transaction.
+
+    Returns:
+        int: The number of snapshots written.
+    """
+    written = 0
+    while True:
+        last_entry_id = func.coalesce(_latest_snapshot(WalletSnapshot.last_entry_id, Customer.id), 0)
+        # Base balance, entry range and sum come from one statement, so each snapshot is
+        # consistent even if another compactor runs at the same time.
+        rows = db_session.execute(
+            select(Customer.id, base_balance_expression(), func.max(WalletEntry.id), func.sum(WalletEntry.amount_cents))
+            .join(WalletEntry, WalletEntry.customer_id == Customer.id)
+            .where(WalletEntry.id <= up_to_entry_id, WalletEntry.id > last_entry_id)
+            .group_by(Customer.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return written
+
+        snapshots = [
+            {'customer_id': customer_id, 'balance_cents': base + amount, 'last_entry_id': last_id}
+            for customer_id, base, last_id, amount in rows
+        ]
+        db_session.execute(insert(WalletSnapshot), snapshots)
+        db_session.execute(update(Customer), [
+            {'id': snapshot['customer_id'], 'wallet': from_cents(snapshot['balance_cents'])}
+            for snapshot in snapshots
+        ])
+        db_session.commit()
+        written += len(snapshots)
+
+def max_entry_id(db_session):
+    return db_session.query(func.coalesce(func.max(WalletEntry.id), 0)).scalar()
@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, DateTime, Index, insert, select, delete, func
+from shared.models.base import Base
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class CatalogChange(Base):
+    """
+    CatalogChange model definition.
+
+    Classes:
+        CatalogChange(Base): Represents one change to an inventory item in the catalog change log.
+        The log only records which item changed; readers join the item's current row, and an item
+        that no longer exists is reported as deleted (a tombstone).
+
+    Attributes:
+        version (int): The catalog version the change produced. Auto-incremented primary key, so
+        versions only ever increase.
+        item_id (int): The ID of the changed item. Not a foreign key, since tombstones outlive the item.
+        created_at (datetime): The UTC time the change was recorded.
+
+    Methods:
+        record(db_session, item_ids):
+            Bumps the catalog version once for each changed item.
+        prune(db_session, before, batch_size):
+            Drops changes older than the retention period.
+    """
+    __tablename__ = 'catalog_changes'
+    version = Column(Integer, primary_key=True, autoincrement=True)
+    item_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
+
+    __table_args__ = (
+        Index('ix_catalog_changes_created_at', 'created_at'),
+    )
+
+    @classmethod
+    def record(cls, db_session, item_ids):
+        """
+        Record a change to each of `item_ids` in the caller's transaction, with one multi-row INSERT.
+
+        Call it as the last write before committing, so versions become visible in close to the
+        order they were assigned.
+        """
+        if item_ids:
+            db_session.execute(insert(cls), [{'item_id': item_id} for item_id in item_ids])
+
+    @classmethod
+    def prune(cls, db_session, before, batch_size=5000):
+        """
+        Delete the changes recorded before `before`, one batch per transaction.
+
+        The newest change is always kept, so the current catalog version stays known, and
+        changes are deleted from the oldest up, so the retained versions are always contiguous.
+
+        Returns:
+            int: The number of changes deleted.
+        """
+        deleted = 0
+        while True:
+            newest = db_session.execute(select(func.max(cls.version))).scalar()
+            if newest is None:
+                return deleted
+            versions = db_session.execute(
+                select(cls.version)
+                .where(cls.created_at < before, cls.version < newest)
+                .order_by(cls.version)
+                .limit(batch_size)
+            ).scalars().all()
+            if not versions:
+                return deleted
+            db_session.execute(delete(cls).where(cls.version <= versions[-1]))
+            db_session.commit()
+            deleted += len(versions)
@@ -0,0 +1,179 @@
+from sqlalchemy import Column, Integer, BigInteger, ForeignKey, DateTime, update, insert, select, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+from shared.models.base import Base
+from shared.models.customer import Customer
+from shared.models.inventory import InventoryItem
+from shared.models.order import Order
+from shared.models.review import Review
+
+class CustomerStats(Base):
+    """
+    CustomerStats model definition.
+
+    Classes:
+        CustomerStats(Base): Represents the lifetime statistics of a customer, maintained incrementally
+        as orders and reviews are written so that reading them never scans `orders` or `reviews`.
+
+    Attributes:
+        customer_id (int): The ID of the customer. Primary key and foreign key referencing the `customers` table.
+        order_count (int): The number of orders placed.
+        units_purchased (int): The total number of units ordered.
+        lifetime_spend_cents (int): The total amount spent on orders, in cents.
+        last_purchase_at (datetime): The timestamp of the most recent order, or null if there is none.
+        review_count (int): The number of reviews written.
+        updated_at (datetime): The timestamp when the statistics last changed.
+
+    Methods:
+        record_order(db_session, customer_id, quantity, amount):
+            Adds an order to a customer's statistics.
+        record_review(db_session, customer_id, delta):
+            Adds or removes reviews from a customer's statistics.
+        refresh(db_session, customer_ids, batch_size):
+            Recomputes the statistics of some customers from their order and review history.
+        rebuild(db_session, batch_size):
+            Recomputes every customer's statistics from the order and review history.
+    """
+    __tablename__ = 'customer_stats'
+    customer_id = Column(Integer, ForeignKey('customers.id'), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    units_purchased = Column(Integer, nullable=False, default=0)
+    lifetime_spend_cents = Column(BigInteger, nullable=False, default=0)
+    last_purchase_at = Column(DateTime(timezone=True), nullable=True)
+    review_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    @classmethod
+    def _increment(cls, db_session, customer_id, values, initial):
+        """
+        Apply `values` to a customer's row with one UPDATE, creating the row from `initial` if it
+        does not exist yet. The insert runs in a savepoint so that losing a race to a concurrent
+        insert only retries the update. The caller commits.
+        """
+        statement = update(cls).where(cls.customer_id == customer_id).values(**values)
+        if db_session.execute(statement).rowcount:
+            return
+        try:
+            with db_session.begin_nested():
+                db_session.execute(insert(cls).values(customer_id=customer_id, **initial))
+        except IntegrityError:
+            db_session.execute(statement)
+
+    @classmethod
+    def record_order(cls, db_session, customer_id, quantity, amount):
+        """
+        Add an order to a customer's statistics in the caller's transaction.
+
+        Parameters:
+            db_session (Session): The session writing the order.
+            customer_id (int): The ID of the customer who placed the order.
+            quantity (int): The number of units ordered.
+            amount (float): The total price of the order in dollars.
+        """
+        amount_cents = int(round(amount * 100))
+        cls._increment(db_session, customer_id, {
+            'order_count': cls.order_count + 1,
+            'units_purchased': cls.units_purchased + quantity,
+            'lifetime_spend_cents': cls.lifetime_spend_cents + amount_cents,
+            'last_purchase_at': func.now()
+        }, {
+            'order_count': 1,
+            'units_purchased': quantity,
+            'lifetime_spend_cents': amount_cents,
+            'last_purchase_at': func.now(),
+            'review_count': 0
+        })
+
+    @classmethod
+    def record_review(cls, db_session, customer_id, delta=1):
+        """
+        Add (or, with a negative `delta`, remove) reviews from a customer's statistics in the caller's transaction.
+        """
+        cls._increment(db_session, customer_id, {
+            'review_count': cls.review_count + delta
+        }, {
+            'order_count': 0,
+            'units_purchased': 0,
+            'lifetime_spend_cents': 0,
+            'review_count': max(delta, 0)
+        })
+
+    @classmethod
+    def _replace(cls, db_session, scope):
+        """
+        Recompute the statistics of the customers selected by `scope`, a function returning a
+        condition on a customer ID column, with one DELETE and one INSERT ... SELECT. Orders
+        without a recorded unit price are valued at the item's current price. The caller commits.
+        """
+        orders = (
+            select(
+                Order.customer_id,
+                func.count(Order.id).label('order_count'),
+                func.sum(Order.quantity).label('units_purchased'),
+                func.sum(Order.quantity * func.coalesce(Order.unit_price, InventoryItem.price_per_item)).label('spend'),
+                func.max(Order.created_at).label('last_purchase_at')
+            )
+            .join(InventoryItem, InventoryItem.id == Order.item_id)
+            .where(scope(Order.customer_id))
+            .group_by(Order.customer_id)
+            .subquery()
+        )
+        reviews = (
+            select(Review.customer_id, func.count(Review.id).label('review_count'))
+            .where(scope(Review.customer_id))
+            .group_by(Review.customer_id)
+            .subquery()
+        )
+        rows = (
+            select(
+                Customer.id,
+                func.coalesce(orders.c.order_count, 0),
+                func.coalesce(orders.c.units_purchased, 0),
+                func.round(func.coalesce(orders.c.spend, 0) * 100),
+                orders.c.last_purchase_at,
+                func.coalesce(reviews.c.review_count, 0)
+            )
+            .outerjoin(orders, orders.c.customer_id == Customer.id)
+            .outerjoin(reviews, reviews.c.customer_id == Customer.id)
+            .where(scope(Customer.id))
+        )
+        db_session.execute(delete(cls).where(scope(cls.customer_id)))
+        db_session.execute(insert(cls).from_select(
+            ['customer_id', 'order_count', 'units_purchased', 'lifetime_spend_cents', 'last_purchase_at', 'review_count'],
+            rows
+        ))
+
+    @classmethod
+    def refresh(cls, db_session, customer_ids, batch_size=1000):
+        """
+        Recompute the statistics of `customer_ids` in the caller's transaction, such as after
+        deleting some of their orders or reviews.
+        """
+        customer_ids = sorted(set(customer_ids))
+        for start in range(0, len(customer_ids), batch_size):
+            batch = customer_ids[start:start + batch_size]
+            cls._replace(db_session, lambda column: column.in_(batch))
+
+    @classmethod
+    def rebuild(cls, db_session, batch_size=1000):
+        """
+        Recompute the statistics of every customer from the order and review history.
+
+        Customers are processed in batches of `batch_size` consecutive IDs, each replaced with
+        one DELETE and one INSERT ... SELECT and committed on its own.
+
+        Returns:
+            int: The number of customers whose statistics were rebuilt.
+        """
+        rebuilt = 0
+        last_id = 0
+        while True:
+            ids = db_session.execute(
+                select(Customer.id).where(Customer.id > last_id).order_by(Customer.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return rebuilt
+            last_id = ids[-1]
+            cls._replace(db_session, lambda column: column.between(ids[0], last_id))
+            db_session.commit()
+            rebuilt += len(ids)
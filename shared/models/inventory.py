@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float , Text
+from sqlalchemy import Column, Integer, String, Float , Text, Index
 from shared.models.base import Base
 from sqlalchemy.orm import relationship
 
@@ -15,7 +15,10 @@ class InventoryItem(Base):
         category (str): The category of the inventory item. Required, valid values: "food", "clothes", "accessories", "electronics".
         price_per_item (float): The price of a single unit of the inventory item. Must be a positive number.
         description (str): A textual description of the item. Optional but must be at least 5 characters if provided.
-        stock_count (int): The number of units available in stock. Must be a non-negative integer.
+        stock_count (int): The number of units available in stock. Must be a non-negative integer. For items
+        with sharded stock, most units are kept in `StockShard` rows instead; see `shared.stock.stock_expression`.
+        sku (str): The supplier's stock keeping unit, used to match items on bulk imports. Optional and unique.
+        stock_slots (int): The number of `StockShard` counters the item's stock is split across, or 0 if it is not sharded.
 
     Relationships:
         reviews: A one-to-many relationship with the `Review` model.
@@ -34,6 +37,12 @@ class InventoryItem(Base):
     price_per_item = Column(Float, nullable=False)
     description = Column(Text(400), nullable=True)
     stock_count = Column(Integer, nullable=False)
+    sku = Column(String(64), nullable=True, unique=True)
+    stock_slots = Column(Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        Index('ix_inventory_item_category_id', 'category', 'id'),
+    )
 
     reviews = relationship("Review", back_populates="inventory_item")
     orders = relationship("Order", back_populates="inventory_item")
@@ -57,6 +66,7 @@ class InventoryItem(Base):
                 - `price_per_item`: Must be a positive number.
                 - `stock_count`: Must be a non-negative integer.
                 - `description`: Optional, but if provided, must be at least 5 characters.        
+                - `sku`: Optional, but if provided, must be a string of 1 to 64 characters.
         """
         required_fields = ["name", "category", "price_per_item", "stock_count"]
         valid_categories = ["food", "clothes", "accessories", "electronics"]
@@ -85,4 +95,8 @@ class InventoryItem(Base):
             if not isinstance(data["description"], str) or len(data["description"].strip()) < 5:
                 return False, "Invalid value for 'description'. It must be at least 5 characters."
 
+        if "sku" in data:
+            if not isinstance(data["sku"], str) or not (1 <= len(data["sku"].strip()) <= 64):
+                return False, "Invalid value for 'sku'. It must be between 1 and 64 characters."
+
         return True, "Validation successful."
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from shared.models.base import Base
 from sqlalchemy.sql import func
@@ -15,6 +15,7 @@ class Order(Base):
         customer_id (int): The ID of the customer who placed the order. Foreign key referencing the `customers` table.
         item_id (int): The ID of the inventory item ordered. Foreign key referencing the `inventory_item` table.
         quantity (int): The number of units ordered. Must be a positive integer.
+        unit_price (float): The price of a single unit when the order was placed. Null for orders recorded before prices were kept.
         created_at (datetime): The timestamp when the order was created. Defaults to the current timestamp.
 
     Relationships:
@@ -26,8 +27,15 @@ class Order(Base):
     customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)  
     item_id = Column(Integer, ForeignKey('inventory_item.id'), nullable=False) 
     quantity = Column(Integer, nullable=False)  
+    unit_price = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())  
 
     # Relationships
     customer = relationship("Customer", back_populates="previous_orders")  
     inventory_item = relationship("InventoryItem", back_populates="orders") 
+
+    __table_args__ = (
+        Index('ix_orders_customer_id_created_at', 'customer_id', 'created_at'),
+        Index('ix_orders_item_id_created_at', 'item_id', 'created_at'),
+        Index('ix_orders_created_at', 'created_at'),
+    )
@@ -0,0 +1,39 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Index
+from sqlalchemy.sql import func
+from shared.models.base import Base
+
+class StockReservation(Base):
+    """
+    StockReservation model definition.
+
+    Classes:
+        StockReservation(Base): Represents units of an inventory item set aside for a checkout until
+        they are committed (removed from stock), released or expired.
+
+    Attributes:
+        id (int): The unique identifier for the reservation. Auto-incremented primary key.
+        item_id (int): The ID of the reserved inventory item. Foreign key referencing the `inventory_item` table.
+        quantity (int): The number of units reserved.
+        owner (str): The username of the user who placed the reservation.
+        status (str): The state of the reservation. Valid values: "held", "committed", "released", "expired".
+        expires_at (datetime): The UTC time after which the reservation can no longer be committed.
+        drawn (bool): Whether the units were taken out of the item's stock shards when reserved, rather
+        than being set aside in `stock_count`.
+        created_at (datetime): The timestamp when the reservation was placed. Defaults to the current timestamp.
+        updated_at (datetime): The timestamp when the reservation last changed state.
+    """
+    __tablename__ = 'stock_reservations'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    item_id = Column(Integer, ForeignKey('inventory_item.id'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    owner = Column(String(100), nullable=False)
+    status = Column(String(20), nullable=False, default="held")
+    expires_at = Column(DateTime, nullable=False)
+    drawn = Column(Boolean, nullable=False, default=False, server_default='0')
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        Index('ix_stock_reservations_item_id_status', 'item_id', 'status'),
+        Index('ix_stock_reservations_status_expires_at', 'status', 'expires_at'),
+    )
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, ForeignKey
+from shared.models.base import Base
+
+class StockShard(Base):
+    """
+    StockShard model definition.
+
+    Classes:
+        StockShard(Base): Represents one of the counters an inventory item's stock is split across,
+        so that concurrent purchases of a hot item update different rows instead of queueing on one.
+
+    Attributes:
+        item_id (int): The ID of the inventory item. Part of the primary key and foreign key referencing the `inventory_item` table.
+        slot (int): The number of the counter, from 0 to the item's `stock_slots` - 1. Part of the primary key.
+        count (int): The number of units held by the counter. Never negative.
+    """
+    __tablename__ = 'stock_shards'
+    item_id = Column(Integer, ForeignKey('inventory_item.id'), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,111 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from shared.models.base import Base
+
+class WalletEntry(Base):
+    """
+    WalletEntry model definition.
+
+    Classes:
+        WalletEntry(Base): Represents one append-only credit or debit on a customer's wallet.
+
+    Attributes:
+        id (int): The unique identifier for the entry. Auto-incremented primary key, also used to order entries.
+        customer_id (int): The ID of the customer whose wallet changed. Foreign key referencing the `customers` table.
+        amount_cents (int): The signed amount in cents. Positive for credits, negative for debits.
+        reference (str): Optional free-form reference, such as the endpoint or batch that wrote the entry.
+        created_at (datetime): The timestamp when the entry was written. Defaults to the current timestamp.
+    """
+    __tablename__ = 'wallet_entries'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    reference = Column(String(100), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_wallet_entries_customer_id_id', 'customer_id', 'id'),
+    )
+
+class WalletSnapshot(Base):
+    """
+    WalletSnapshot model definition.
+
+    Classes:
+        WalletSnapshot(Base): Represents a customer's wallet balance rolled up to a given ledger entry.
+
+    Attributes:
+        id (int): The unique identifier for the snapshot. Auto-incremented primary key.
+        customer_id (int): The ID of the customer. Foreign key referencing the `customers` table.
+        balance_cents (int): The wallet balance in cents, including every entry up to `last_entry_id`.
+        last_entry_id (int): The ID of the last wallet entry included in the balance.
+        created_at (datetime): The timestamp when the snapshot was taken. Defaults to the current timestamp.
+    """
+    __tablename__ = 'wallet_snapshots'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)
+    balance_cents = Column(BigInteger, nullable=False)
+    last_entry_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_wallet_snapshots_customer_id_id', 'customer_id', 'id'),
+    )
+
+class WalletHold(Base):
+    """
+    WalletHold model definition.
+
+    Classes:
+        WalletHold(Base): Represents funds reserved on a customer's wallet until they are captured or released.
+
+    Attributes:
+        id (int): The unique identifier for the hold. Auto-incremented primary key.
+        customer_id (int): The ID of the customer whose funds are reserved. Foreign key referencing the `customers` table.
+        amount_cents (int): The reserved amount in cents.
+        status (str): The state of the hold. Valid values: "held", "captured", "voided", "expired".
+        expires_at (datetime): The UTC time after which the hold can no longer be captured.
+        created_at (datetime): The timestamp when the hold was placed. Defaults to the current timestamp.
+        updated_at (datetime): The timestamp when the hold last changed state.
+    """
+    __tablename__ = 'wallet_holds'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    customer_id = Column(Integer, ForeignKey('customers.id'), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    status = Column(String(20), nullable=False, default="held")
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        Index('ix_wallet_holds_customer_id_status', 'customer_id', 'status'),
+        Index('ix_wallet_holds_status_expires_at', 'status', 'expires_at'),
+    )
+
+class WalletCreditChunk(Base):
+    """
+    WalletCreditChunk model definition.
+
+    Classes:
+        WalletCreditChunk(Base): Records that one chunk of a bulk wallet credit batch has been applied,
+        written in the same transaction as the chunk's ledger entries so that replays skip it.
+
+    Attributes:
+        id (int): The unique identifier for the record. Auto-incremented primary key.
+        batch_id (str): The client-supplied identifier of the bulk credit batch.
+        chunk (int): The zero-based position of the chunk within the batch.
+        checksum (str): A SHA-256 digest of the chunk's credits, used to reject a batch ID reused with different credits.
+        applied (int): The number of wallets credited by the chunk.
+        created_at (datetime): The timestamp when the chunk was applied. Defaults to the current timestamp.
+    """
+    __tablename__ = 'wallet_credit_chunks'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    batch_id = Column(String(64), nullable=False)
+    chunk = Column(Integer, nullable=False)
+    checksum = Column(String(64), nullable=False)
+    applied = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('batch_id', 'chunk', name='uq_wallet_credit_chunks_batch_id_chunk'),
+    )
@@ -0,0 +1,149 @@
+"""
+Keyset (cursor) pagination shared by the list endpoints.
+
+Pages are selected with `WHERE (sort keys) > (last keys seen) ORDER BY sort keys LIMIT n`
+instead of OFFSET, so every page costs the same index range scan no matter how deep a
+client pages. The position is handed to clients as an opaque, URL-safe cursor.
+
+Every list is paged: page sizes default to `PAGE_SIZE_DEFAULT` and are capped at
+`PAGE_SIZE_MAX`; both can be overridden in the Flask app config. Every page reports the
+cursor of the next one as `next_cursor` in the JSON body, and also in the `X-Next-Cursor`
+header.
+
+Clients written before pagination can be kept working by setting `UNPAGINATED_LISTS`
+(in the app config, or as an environment variable set to "1"). Requests with neither
+`limit` nor `cursor` then get every row, in the same shape as before.
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from flask import current_app, jsonify, request
+from sqlalchemy import tuple_
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+
+def encode_cursor(values):
+    """
+    Encode the sort key values of the last row of a page into an opaque cursor.
+    """
+    encoded = [{"$dt": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(encoded, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, size):
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed or does not match the number of sort keys.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    try:
+        return [datetime.fromisoformat(value["$dt"]) if isinstance(value, dict) else value for value in values]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def page_requested():
+    """
+    Return whether the current request asked for a page, with `limit` or `cursor`.
+    """
+    return "limit" in request.args or "cursor" in request.args
+
+def unpaginated_list_requested():
+    """
+    Return whether the current request gets every row, which only happens when the
+    `UNPAGINATED_LISTS` compatibility setting is on and the request asked for no page.
+    """
+    enabled = current_app.config.get("UNPAGINATED_LISTS", os.getenv("UNPAGINATED_LISTS", "0") == "1")
+    return bool(enabled) and not page_requested()
+
+def get_page_args(always=False):
+    """
+    Read the `limit` and `cursor` query parameters of the current request.
+
+    Parameters:
+        always (bool): Page even when `UNPAGINATED_LISTS` is on, for endpoints that have been
+                       paginated from the start.
+
+    Returns:
+        tuple: The page size (None for every row, see `unpaginated_list_requested`) and the raw
+        cursor (or None for the first page).
+
+    Raises:
+        ValueError: If `limit` is not a positive integer.
+    """
+    if not always and unpaginated_list_requested():
+        return None, None
+    default = current_app.config.get("PAGE_SIZE_DEFAULT", PAGE_SIZE_DEFAULT)
+    maximum = current_app.config.get("PAGE_SIZE_MAX", PAGE_SIZE_MAX)
+    limit = request.args.get("limit", default)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid limit. Must be a positive integer.")
+    if limit <= 0:
+        raise ValueError("Invalid limit. Must be a positive integer.")
+    return min(limit, maximum), request.args.get("cursor") or None
+
+def paginate(query, sort_columns, limit, cursor=None, descending=False):
+    """
+    Fetch one page of a query ordered by indexed sort columns.
+
+    The last sort column must be unique (usually the primary key) so pages never
+    overlap or skip rows. Every selected row must expose the sort columns as attributes,
+    which holds for ORM entities and for column selections that include them.
+
+    Parameters:
+        query (Query): The filtered query to page through.
+        sort_columns (list): The columns to order by, most significant first.
+        limit (int): The page size, or None to fetch every row.
+        cursor (str): The cursor returned with the previous page, or None for the first page.
+        descending (bool): Whether to page from the highest keys down.
+
+    Returns:
+        tuple: The rows of the page and the cursor of the next page (None on the last page).
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    keys = tuple_(*sort_columns) if len(sort_columns) > 1 else sort_columns[0]
+    if cursor:
+        values = decode_cursor(cursor, len(sort_columns))
+        position = tuple_(*values) if len(values) > 1 else values[0]
+        query = query.filter(keys < position if descending else keys > position)
+
+    order = [column.desc() if descending else column.asc() for column in sort_columns]
+    if limit is None:
+        return query.order_by(*order).all(), None
+    rows = query.order_by(*order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, column.key) for column in sort_columns])
+
+def paginated_response(payload, next_cursor, key=None, status=200):
+    """
+    Build a JSON response for one page.
+
+    The next cursor is added as `next_cursor` to JSON object payloads, and sent in the
+    `X-Next-Cursor` header. A list payload is wrapped in an object under `key`, so that it
+    carries `next_cursor` too, unless the request gets every row (see
+    `unpaginated_list_requested`). That list is sent as a bare array, as before pagination.
+    """
+    if isinstance(payload, list) and key is not None and not unpaginated_list_requested():
+        payload = {key: payload}
+    if isinstance(payload, dict):
+        payload["next_cursor"] = next_cursor
+    response = jsonify(payload)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response, status
@@ -0,0 +1,66 @@
+"""
+Startup upgrades for databases created by an earlier release.
+
+`Base.metadata.create_all()` creates missing tables but leaves existing ones as they are, so
+columns and indexes added to a model since a table was created would be missing from it.
+`upgrade_schema()` adds them. Every step checks the live schema first, so it is safe to run
+on every start, and from several services starting at once.
+"""
+from sqlalchemy import inspect, text
+from shared.models.base import Base
+
+# Columns added to existing tables, oldest first, with the statements that add them
+ADDED_COLUMNS = [
+    ("orders", "unit_price", [
+        "ALTER TABLE orders ADD COLUMN unit_price FLOAT NULL",
+    ]),
+    ("inventory_item", "sku", [
+        "ALTER TABLE inventory_item ADD COLUMN sku VARCHAR(64) NULL",
+        "CREATE UNIQUE INDEX uq_inventory_item_sku ON inventory_item (sku)",
+    ]),
+    ("inventory_item", "stock_slots", [
+        "ALTER TABLE inventory_item ADD COLUMN stock_slots INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+def _column_names(engine, table):
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+def _index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+def upgrade_schema(engine):
+    """
+    Add the columns in `ADDED_COLUMNS` and the model indexes that existing tables are missing.
+    Call it after `Base.metadata.create_all()`.
+
+    Parameters:
+        engine (Engine): The engine of the database to upgrade.
+
+    Raises:
+        SQLAlchemyError: If a step fails for another reason than another service having done it first.
+    """
+    tables = set(inspect(engine).get_table_names())
+    for table, column, statements in ADDED_COLUMNS:
+        if table not in tables or column in _column_names(engine, table):
+            continue
+        try:
+            with engine.begin() as connection:
+                for statement in statements:
+                    connection.execute(text(statement))
+        except Exception:
+            if column not in _column_names(engine, table):
+                raise
+
+    for table in Base.metadata.tables.values():
+        if table.name not in tables:
+            continue
+        existing = _index_names(engine, table.name)
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=engine)
+            except Exception:
+                if index.name not in _index_names(engine, table.name):
+                    raise
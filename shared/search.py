@@ -0,0 +1,243 @@
+"""
+In-memory trigram inverted index for fuzzy substring search.
+
+Every indexed text is lower-cased and split into words, and each word into overlapping
+three-character grams. A document matches a query when it contains at least `min_score`
+of the query's grams.
+
+Posting lists are packed into NumPy arrays of document IDs, four bytes per entry, so a
+million documents of a few dozen grams take on the order of a hundred megabytes. A search
+counts the matched grams of every document in one vectorized pass over the query's posting
+lists, then only selects and sorts the requested page, starting right after the cursor,
+so neither common terms nor deep pages sort the whole result set.
+
+Packed lists are never modified. Writes go to a small delta of per-gram sets and mark the
+document's packed entries as stale, and `compact()` folds the delta back into new packed
+lists. The initial `build()` is a compaction that also reads a full scan. Documents written
+while either runs stay in the delta, so they are never lost to a scan that read older rows.
+"""
+import math
+import re
+import threading
+from array import array
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Bit layout of the ranking keys: the grams missed, the document size, then the document ID
+SIZE_SHIFT = 32
+MISSED_SHIFT = 48
+MAX_SIZE = (1 << (MISSED_SHIFT - SIZE_SHIFT)) - 1
+
+def trigrams(*texts):
+    """
+    Return the set of trigrams of the words in `texts`. Words shorter than three characters are kept whole.
+    """
+    grams = set()
+    for text in texts:
+        for word in WORD_PATTERN.findall((text or "").lower()):
+            if len(word) < 3:
+                grams.add(word)
+            else:
+                grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+def _resized(values, length):
+    resized = np.zeros(length, dtype=values.dtype)
+    resized[:min(length, len(values))] = values[:length]
+    return resized
+
+class NGramIndex:
+    """
+    Thread-safe trigram index of documents with non-negative 32-bit integer IDs.
+
+    Attributes:
+        ready (bool): Whether the index has been fully built.
+        compact_threshold (int): The number of documents in the delta that starts a compaction
+                                 on a background thread.
+    """
+    def __init__(self, compact_threshold=10000):
+        self.ready = False
+        self.compact_threshold = compact_threshold
+        self._packed = {}
+        self._delta = {}
+        self._delta_documents = {}
+        self._stale = np.zeros(0, dtype=bool)
+        self._sizes = np.zeros(0, dtype=np.uint16)
+        self._touched = None
+        self._compacting = False
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+
+    def __len__(self):
+        return int(np.count_nonzero(self._sizes))
+
+    def add(self, doc_id, *texts):
+        """
+        Index (or re-index) a document from its texts.
+        """
+        self._write(doc_id, frozenset(trigrams(*texts)))
+
+    def remove(self, doc_id):
+        """
+        Drop a document from the index, if present.
+        """
+        self._write(doc_id, None)
+
+    def _write(self, doc_id, grams):
+        with self._lock:
+            if doc_id >= len(self._stale):
+                length = max(doc_id + 1, 2 * len(self._stale), 1024)
+                self._stale, self._sizes = _resized(self._stale, length), _resized(self._sizes, length)
+            for gram in self._delta_documents.pop(doc_id, ()):
+                posting = self._delta[gram]
+                posting.discard(doc_id)
+                if not posting:
+                    del self._delta[gram]
+            self._stale[doc_id] = True
+            self._sizes[doc_id] = min(len(grams), MAX_SIZE) if grams else 0
+            if grams:
+                self._delta_documents[doc_id] = grams
+                for gram in grams:
+                    self._delta.setdefault(gram, set()).add(doc_id)
+            if self._touched is not None:
+                self._touched.add(doc_id)
+            compact = self.ready and not self._compacting and len(self._delta_documents) >= self.compact_threshold
+            if compact:
+                self._compacting = True
+        if compact:
+            threading.Thread(target=self.compact, name="compacting the search index", daemon=True).start()
+
+    def build(self, documents):
+        """
+        Build the index from `(doc_id, texts)` pairs, unless another thread already has.
+
+        Parameters:
+            documents (iterable): The documents to index. It is consumed without holding
+                                  the index lock, so it may stream from the database.
+        """
+        with self._compact_lock:
+            if not self.ready:
+                self._fold(documents)
+                self.ready = True
+
+    def compact(self):
+        """
+        Fold the delta into the packed posting lists. Searches and writes carry on meanwhile.
+        """
+        try:
+            with self._compact_lock:
+                self._fold(())
+        finally:
+            self._compacting = False
+
+    def _fold(self, documents):
+        with self._lock:
+            self._touched = set()
+            packed, stale = self._packed, self._stale.copy()
+            delta_documents = dict(self._delta_documents)
+        try:
+            postings = {}
+            ids, sizes = array("i"), array("H")
+            for doc_id, texts in documents:
+                if doc_id in delta_documents:
+                    continue
+                grams = trigrams(*texts)
+                ids.append(doc_id)
+                sizes.append(min(len(grams), MAX_SIZE))
+                for gram in grams:
+                    postings.setdefault(gram, array("i")).append(doc_id)
+            for doc_id, grams in delta_documents.items():
+                for gram in grams:
+                    postings.setdefault(gram, array("i")).append(doc_id)
+
+            merged = {}
+            for gram in set(packed) | set(postings):
+                parts = []
+                if gram in packed:
+                    live = packed[gram][~stale[packed[gram]]]
+                    if len(live):
+                        parts.append(live)
+                if gram in postings:
+                    parts.append(np.frombuffer(postings[gram], dtype=np.int32))
+                if parts:
+                    merged[gram] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        except BaseException:
+            with self._lock:
+                self._touched = None
+            raise
+
+        scanned = np.frombuffer(ids, dtype=np.int32)
+        with self._lock:
+            touched, self._touched = self._touched, None
+            touched_ids = np.fromiter(touched, dtype=np.int64, count=len(touched))
+            length = max(len(self._stale), int(scanned.max()) + 1 if len(scanned) else 0)
+            self._stale = np.zeros(length, dtype=bool)
+            self._stale[touched_ids] = True
+            self._sizes = _resized(self._sizes, length)
+            # Sizes of scanned documents are only current if nobody wrote them since
+            current = ~self._stale[scanned]
+            self._sizes[scanned[current]] = np.frombuffer(sizes, dtype=np.uint16)[current]
+            self._packed = merged
+            for doc_id in delta_documents:
+                if doc_id not in touched:
+                    for gram in self._delta_documents.pop(doc_id):
+                        posting = self._delta[gram]
+                        posting.discard(doc_id)
+                        if not posting:
+                            del self._delta[gram]
+
+    def search(self, query, min_score=0.7, limit=None, after=None):
+        """
+        Rank the documents matching `query`.
+
+        Parameters:
+            query (str): The text to look for.
+            min_score (float): The fraction of the query's grams a document must contain.
+            limit (int): Return at most this many results, or all of them if None.
+            after (tuple): Only return results ranked after this `(matched, size, doc_id)` result.
+
+        Returns:
+            list: `(matched, size, doc_id)` tuples sorted best first, where `matched` is the number
+            of query grams found in the document and `size` its number of grams. Documents that
+            match more grams, then shorter documents, rank first.
+
+        Raises:
+            ValueError: If `after` is not a possible result.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        required = max(1, math.ceil(min_score * len(query_grams)))
+        if after is not None:
+            matched, size, doc_id = after
+            if not all(isinstance(value, int) and not isinstance(value, bool) for value in after) or not (0 <= matched <= len(query_grams) and 0 <= size <= MAX_SIZE and 0 <= doc_id < 1 << SIZE_SHIFT):
+                raise ValueError("Invalid cursor")
+
+        with self._lock:
+            packed = [self._packed[gram] for gram in query_grams if gram in self._packed]
+            if packed:
+                counts = np.bincount(np.concatenate(packed), minlength=len(self._stale))
+                counts[self._stale[:len(counts)]] = 0
+            else:
+                counts = np.zeros(len(self._stale), dtype=np.int64)
+            for gram in query_grams:
+                posting = self._delta.get(gram)
+                if posting:
+                    counts[np.fromiter(posting, dtype=np.int64, count=len(posting))] += 1
+            candidates = np.flatnonzero(counts >= required)
+            keys = (
+                ((len(query_grams) - counts[candidates]) << MISSED_SHIFT)
+                | (self._sizes[candidates].astype(np.int64) << SIZE_SHIFT)
+                | candidates
+            )
+
+        if after is not None:
+            keys = keys[keys > ((len(query_grams) - matched) << MISSED_SHIFT | size << SIZE_SHIFT | doc_id)]
+        if limit is not None and len(keys) > limit:
+            keys = keys[np.argpartition(keys, limit - 1)[:limit]] if limit else keys[:0]
+        keys.sort()
+        return [
+            (len(query_grams) - (key >> MISSED_SHIFT), (key >> SIZE_SHIFT) & MAX_SIZE, key & ((1 << SIZE_SHIFT) - 1))
+            for key in keys.tolist()
+        ]
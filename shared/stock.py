@@ -0,0 +1,423 @@
+"""
+Inventory stock helpers.
+
+Stock changes are single conditional UPDATEs (`stock_count = stock_count - :q WHERE
+stock_count >= :q`), so the availability check and the write happen atomically in the
+database and concurrent buyers can never drive stock below zero.
+
+Units set aside by active `StockReservation` rows are not available for removal or new
+reservations until the reservation is committed (removed from stock), released or expired.
+
+An item's stock can be sharded across `StockShard` counters, so that during a flash sale
+concurrent purchases each lock one random counter instead of all queueing on the item row.
+For a sharded item, removals and reservations take units from one counter that holds enough,
+and only lock the item row and every counter when none does. Added or returned units go to
+the item row and are spread back across the counters by `rebalance_shards`. Reservations on
+a sharded item take their units out of a counter up front (they are "drawn") and return them
+to the item row if released, so `stock_count` only ever backs undrawn reservations.
+
+Every change to an item's stock count is recorded in the catalog change log in the same
+transaction.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import case, delete, func, insert, literal, select, update
+from shared.models.catalog_change import CatalogChange
+from shared.models.inventory import InventoryItem
+from shared.models.stock_reservation import StockReservation
+from shared.models.stock_shard import StockShard
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _held_expression(item_id, *conditions):
+    return (
+        select(func.coalesce(func.sum(StockReservation.quantity), 0))
+        .where(StockReservation.item_id == item_id, StockReservation.status == "held", *conditions)
+        .scalar_subquery()
+    )
+
+def reserved_expression(item_id=InventoryItem.id):
+    """
+    SQL expression for the number of units held by an item's active reservations, correlated to `InventoryItem`.
+    """
+    return _held_expression(item_id)
+
+def undrawn_expression(item_id=InventoryItem.id):
+    """
+    SQL expression for the number of units held by an item's active reservations that are still part of `stock_count`.
+    """
+    return _held_expression(item_id, StockReservation.drawn.is_(False))
+
+def shard_expression(item_id=InventoryItem.id):
+    """
+    SQL expression for the number of units held by an item's stock shards.
+    """
+    return (
+        select(func.coalesce(func.sum(StockShard.count), 0))
+        .where(StockShard.item_id == item_id)
+        .scalar_subquery()
+    )
+
+def stock_expression(item_id=InventoryItem.id):
+    """
+    SQL expression for the number of units of an item in stock, wherever they are kept.
+
+    For an item that is not sharded this is simply its `stock_count`.
+    """
+    return InventoryItem.stock_count + shard_expression(item_id) + _held_expression(item_id, StockReservation.drawn.is_(True))
+
+def available_expression(item_id=InventoryItem.id):
+    """
+    SQL expression for the number of units of an item that can still be removed or reserved.
+    """
+    return stock_expression(item_id) - reserved_expression(item_id)
+
+def get_stock(db_session, item_id):
+    """
+    Return the number of units of an item in stock, or None if the item does not exist.
+    """
+    return db_session.execute(select(stock_expression()).where(InventoryItem.id == item_id)).scalar()
+
+def _lock_sharded_item(db_session, item_id):
+    """
+    Lock a sharded item's row and counters, in that order, and return the units in its row that
+    no reservation needs and the `(slot, count)` of each counter.
+    """
+    free = db_session.execute(
+        select(InventoryItem.stock_count - undrawn_expression()).where(InventoryItem.id == item_id).with_for_update()
+    ).scalar()
+    shards = db_session.execute(
+        select(StockShard.slot, StockShard.count).where(StockShard.item_id == item_id).order_by(StockShard.slot).with_for_update()
+    ).all()
+    return max(free or 0, 0), shards
+
+def _take_from_shards(db_session, item_id, quantity):
+    """
+    Remove `quantity` units from a sharded item and return whether it had enough.
+
+    A random counter holding enough units is decremented with one conditional UPDATE. If the
+    units are spread too thinly for that, the item row and all its counters are locked and
+    drained in order instead.
+    """
+    slots = db_session.execute(
+        select(StockShard.slot).where(StockShard.item_id == item_id, StockShard.count >= quantity)
+    ).scalars().all()
+    random.shuffle(slots)
+    for slot in slots:
+        result = db_session.execute(
+            update(StockShard)
+            .where(StockShard.item_id == item_id, StockShard.slot == slot, StockShard.count >= quantity)
+            .values(count=StockShard.count - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            return True
+
+    free, shards = _lock_sharded_item(db_session, item_id)
+    if free + sum(count for _, count in shards) < quantity:
+        return False
+    taken = min(free, quantity)
+    if taken:
+        db_session.execute(
+            update(InventoryItem).where(InventoryItem.id == item_id)
+            .values(stock_count=InventoryItem.stock_count - taken)
+            .execution_options(synchronize_session=False)
+        )
+    for slot, count in shards:
+        amount = min(count, quantity - taken)
+        if amount <= 0:
+            continue
+        db_session.execute(
+            update(StockShard).where(StockShard.item_id == item_id, StockShard.slot == slot)
+            .values(count=StockShard.count - amount)
+            .execution_options(synchronize_session=False)
+        )
+        taken += amount
+    return True
+
+def _apply_delta(db_session, item_id, delta):
+    """
+    Run the conditional UPDATE for one item and return whether it matched.
+    """
+    slots = db_session.execute(select(InventoryItem.stock_slots).where(InventoryItem.id == item_id)).scalar()
+    if slots is None:
+        return False
+    if delta < 0 and slots:
+        return _take_from_shards(db_session, item_id, -delta)
+
+    conditions = [InventoryItem.id == item_id]
+    if delta < 0:
+        conditions.append(InventoryItem.stock_count - undrawn_expression() >= -delta)
+    result = db_session.execute(
+        update(InventoryItem)
+        .where(*conditions)
+        .values(stock_count=InventoryItem.stock_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+def _failure(db_session, item_id):
+    exists = db_session.execute(select(InventoryItem.id).where(InventoryItem.id == item_id)).first()
+    return 'Not enough stock available' if exists else 'Item not found'
+
+def change_stock(db_session, item_id, delta):
+    """
+    Add `delta` units to an item's stock (or remove them, if negative) in one conditional UPDATE.
+
+    The caller commits.
+
+    Returns:
+        tuple: The new stock count (or None on failure) and an error message (or None on success).
+    """
+    if not _apply_delta(db_session, item_id, delta):
+        return None, _failure(db_session, item_id)
+    CatalogChange.record(db_session, [item_id])
+    return get_stock(db_session, item_id), None
+
+def adjust_stock(db_session, deltas):
+    """
+    Apply stock changes to several items, all or nothing.
+
+    Items are updated in ID order so that concurrent batches lock rows in the same order and
+    cannot deadlock. The first change that fails stops the batch; the caller must then roll back.
+    On success the caller commits.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        deltas (dict): A map from item ID to the signed number of units to add.
+
+    Returns:
+        tuple: A map from item ID to new stock count (or None on failure), an error message
+        (or None on success), and the ID of the item that failed (or None).
+    """
+    for item_id in sorted(deltas):
+        if not _apply_delta(db_session, item_id, deltas[item_id]):
+            return None, _failure(db_session, item_id), item_id
+    CatalogChange.record(db_session, sorted(deltas))
+
+    stock = dict(db_session.execute(
+        select(InventoryItem.id, stock_expression()).where(InventoryItem.id.in_(list(deltas)))
+    ).all())
+    return stock, None, None
+
+def reserve_stock(db_session, item_id, quantity, ttl, owner):
+    """
+    Set aside units of an item in a single conditional INSERT ... SELECT.
+
+    The item row is locked first so that concurrent reservations for the same item are
+    serialized and cannot both claim the last units. Sharded items are not locked; the units
+    are drawn from one of their counters instead. The caller commits.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        item_id (int): The ID of the item to reserve.
+        quantity (int): The number of units to reserve.
+        ttl (int): The number of seconds before the reservation expires.
+        owner (str): The username of the user placing the reservation.
+
+    Returns:
+        tuple: The new `StockReservation` (or None on failure) and an error message (or None on success).
+    """
+    slots = db_session.execute(select(InventoryItem.stock_slots).where(InventoryItem.id == item_id)).scalar()
+    if slots is None:
+        return None, 'Item not found'
+    expires_at = utcnow() + timedelta(seconds=ttl)
+
+    if slots:
+        if not _take_from_shards(db_session, item_id, quantity):
+            return None, 'Not enough stock available'
+        reservation = StockReservation(item_id=item_id, quantity=quantity, owner=owner, status="held",
+                                       expires_at=expires_at, drawn=True)
+        db_session.add(reservation)
+        db_session.flush()
+        CatalogChange.record(db_session, [item_id])
+        return reservation, None
+
+    if db_session.execute(select(InventoryItem.id).where(InventoryItem.id == item_id).with_for_update()).first() is None:
+        return None, 'Item not found'
+    source = (
+        select(InventoryItem.id, literal(quantity), literal(owner), literal("held"), literal(expires_at))
+        .where(InventoryItem.id == item_id, available_expression() >= quantity)
+    )
+    result = db_session.execute(
+        insert(StockReservation).from_select(['item_id', 'quantity', 'owner', 'status', 'expires_at'], source)
+    )
+    if result.rowcount == 0:
+        return None, 'Not enough stock available'
+    CatalogChange.record(db_session, [item_id])
+    return db_session.get(StockReservation, result.lastrowid), None
+
+def settle_reservation(db_session, reservation, status):
+    """
+    Move an active reservation to its final state.
+
+    The transition is a conditional UPDATE on the reservation's status and expiry, so a
+    reservation can only be committed or released once and never committed after it expires.
+    Committing also removes the reserved units from the item's stock. Releasing a drawn
+    reservation returns its units to the item row. The caller commits.
+
+    Parameters:
+        db_session (Session): The database session to write with.
+        reservation (StockReservation): The reservation to settle.
+        status (str): Either "committed" or "released".
+
+    Returns:
+        bool: True if the reservation was active and has been settled. The caller must roll back otherwise.
+    """
+    conditions = [StockReservation.id == reservation.id, StockReservation.status == "held"]
+    if status == "committed":
+        conditions.append(StockReservation.expires_at > utcnow())
+    result = db_session.execute(
+        update(StockReservation).where(*conditions).values(status=status).execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        return False
+    if status == "committed":
+        if not reservation.drawn:
+            # Stock edited below the reserved units in the meantime; the caller rolls back
+            result = db_session.execute(
+                update(InventoryItem)
+                .where(InventoryItem.id == reservation.item_id, InventoryItem.stock_count >= reservation.quantity)
+                .values(stock_count=InventoryItem.stock_count - reservation.quantity)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                return False
+    elif reservation.drawn:
+        _restock(db_session, {reservation.item_id: reservation.quantity})
+    CatalogChange.record(db_session, [reservation.item_id])
+    return True
+
+def _restock(db_session, quantities):
+    for item_id in sorted(quantities):
+        db_session.execute(
+            update(InventoryItem).where(InventoryItem.id == item_id)
+            .values(stock_count=InventoryItem.stock_count + quantities[item_id])
+            .execution_options(synchronize_session=False)
+        )
+
+def expire_reservations(db_session, batch_size=500):
+    """
+    Release reservations whose TTL has passed, one batch per transaction.
+
+    Returns:
+        list: The IDs of the items whose reservations were released.
+    """
+    item_ids = set()
+    while True:
+        rows = db_session.execute(
+            select(StockReservation.id, StockReservation.item_id, StockReservation.quantity, StockReservation.drawn)
+            .where(StockReservation.status == "held", StockReservation.expires_at <= utcnow())
+            .limit(batch_size)
+            .with_for_update()
+        ).all()
+        if not rows:
+            return list(item_ids)
+        db_session.execute(
+            update(StockReservation)
+            .where(StockReservation.id.in_([row.id for row in rows]))
+            .values(status="expired")
+            .execution_options(synchronize_session=False)
+        )
+        drawn = {}
+        for row in rows:
+            if row.drawn:
+                drawn[row.item_id] = drawn.get(row.item_id, 0) + row.quantity
+        _restock(db_session, drawn)
+        CatalogChange.record(db_session, sorted({row.item_id for row in rows}))
+        db_session.commit()
+        item_ids.update(row.item_id for row in rows)
+
+def _spread(total, slots):
+    return [total // slots + (1 if slot < total % slots else 0) for slot in range(slots)]
+
+def shard_stock(db_session, item_id, slots):
+    """
+    Split an item's stock across `slots` counters, or gather it back into the item row if `slots` is 0.
+
+    The item row and its counters are locked while the units move. The caller commits.
+
+    Returns:
+        bool: False if the item does not exist.
+    """
+    if db_session.execute(select(InventoryItem.id).where(InventoryItem.id == item_id)).first() is None:
+        return False
+    free, shards = _lock_sharded_item(db_session, item_id)
+    total = free + sum(count for _, count in shards)
+    db_session.execute(delete(StockShard).where(StockShard.item_id == item_id))
+    if slots:
+        db_session.execute(insert(StockShard), [
+            {'item_id': item_id, 'slot': slot, 'count': count} for slot, count in enumerate(_spread(total, slots))
+        ])
+    db_session.execute(
+        update(InventoryItem).where(InventoryItem.id == item_id)
+        .values(stock_slots=slots, stock_count=InventoryItem.stock_count - free + (0 if slots else total))
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+def clear_shards(db_session, item_ids):
+    """
+    Make the `stock_count` just written for sharded items their whole stock again, by emptying
+    their counters and discounting their drawn reservations. Used when stock is set outright
+    rather than adjusted. The caller commits.
+    """
+    sharded = db_session.execute(
+        select(InventoryItem.id).where(InventoryItem.id.in_(list(item_ids)), InventoryItem.stock_slots > 0)
+    ).scalars().all()
+    if not sharded:
+        return
+    db_session.execute(
+        update(StockShard).where(StockShard.item_id.in_(sharded)).values(count=0)
+        .execution_options(synchronize_session=False)
+    )
+    remaining = InventoryItem.stock_count - _held_expression(InventoryItem.id, StockReservation.drawn.is_(True))
+    db_session.execute(
+        update(InventoryItem).where(InventoryItem.id.in_(sharded))
+        .values(stock_count=case((remaining > 0, remaining), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+def rebalance_shards(db_session):
+    """
+    Even out the counters of every sharded item, and spread the units added or returned to
+    its row across them. Each item is rebalanced in its own transaction, and items that are
+    already balanced are not locked at all.
+
+    Returns:
+        list: The IDs of the items that were rebalanced.
+    """
+    counts = db_session.execute(
+        select(InventoryItem.id, InventoryItem.stock_count - undrawn_expression(),
+               func.min(StockShard.count), func.max(StockShard.count))
+        .join(StockShard, StockShard.item_id == InventoryItem.id)
+        .where(InventoryItem.stock_slots > 0)
+        .group_by(InventoryItem.id, InventoryItem.stock_count)
+    ).all()
+
+    rebalanced = []
+    for item_id, free, lowest, highest in counts:
+        if free <= 0 and highest - lowest <= 1:
+            continue
+        free, shards = _lock_sharded_item(db_session, item_id)
+        if not shards:
+            db_session.rollback()
+            continue
+        spread = _spread(free + sum(count for _, count in shards), len(shards))
+        for (slot, count), target in zip(shards, spread):
+            if count != target:
+                db_session.execute(
+                    update(StockShard).where(StockShard.item_id == item_id, StockShard.slot == slot)
+                    .values(count=target)
+                    .execution_options(synchronize_session=False)
+                )
+        db_session.execute(
+            update(InventoryItem).where(InventoryItem.id == item_id)
+            .values(stock_count=InventoryItem.stock_count - free)
+            .execution_options(synchronize_session=False)
+        )
+        db_session.commit()
+        rebalanced.append(item_id)
+    db_session.commit()
+    return rebalanced
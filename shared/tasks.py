@@ -0,0 +1,43 @@
+"""
+Periodic background jobs run by the services.
+
+Each job runs on its own daemon thread, with a fresh database session per pass. A failing
+pass is rolled back and logged, and the next pass runs as usual.
+"""
+import threading
+import time
+from shared.database import SessionLocal
+
+def run_periodically(job, interval, logger, description):
+    """
+    Call `job(db_session)` every `interval` seconds, forever.
+
+    Parameters:
+        job (callable): The pass to run. It receives a new session and commits its own work.
+        interval (float): The number of seconds between passes.
+        logger (Logger): Where failed passes are logged, with their traceback.
+        description (str): What the job does, as in "Error <description>".
+    """
+    while True:
+        db_session = SessionLocal()
+        try:
+            job(db_session)
+        except Exception:
+            db_session.rollback()
+            logger.exception(f"Error {description}")
+        finally:
+            db_session.close()
+        time.sleep(interval)
+
+def start_periodic_job(job, interval, logger, description):
+    """
+    Run `job` periodically on a daemon thread, as described in `run_periodically`.
+
+    Returns:
+        Thread: The started thread.
+    """
+    thread = threading.Thread(
+        target=run_periodically, args=(job, interval, logger, description), name=description, daemon=True
+    )
+    thread.start()
+    return thread
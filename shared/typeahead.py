@@ -0,0 +1,379 @@
+"""
+In-memory prefix index for search-as-you-type over item names.
+
+Every item name is normalized (lower-cased, whitespace collapsed) and indexed under the whole
+name and under each of its later words, so "wireless mouse" is found by both "wir" and "mou".
+The matches of a prefix are the contiguous range of the sorted keys found with two binary
+searches, and are ranked by a popularity score per item.
+
+The sorted keys are packed into one UTF-8 buffer with NumPy arrays of offsets and item IDs,
+so a million items take on the order of a hundred megabytes. Packed keys are never modified.
+Writes go to a small sorted delta and mark the item's packed keys as stale, and `compact()`
+rebuilds the packed keys on a background thread once the delta grows. Items written while a
+build or compaction runs stay in the delta, so they are never lost to a scan of older names.
+
+Short prefixes match too many items to rank on every keystroke, so the best `depth` items of
+every prefix of up to `short_prefix` bytes are ranked when the keys are packed or the
+scores replaced. Scores only grow in between, and the items they grew for are ranked along
+with those lists, so the precomputed lists stay exact until a rename or removal empties them.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+import numpy as np
+from shared.cache import TTLCache
+
+# Bit layout of the ranking keys: the score, inverted so that higher scores sort first, then the item ID
+SCORE_SHIFT = 32
+MAX_SCORE = (1 << 30) - 1
+
+def normalize(text):
+    return " ".join((text or "").lower().split())
+
+def prefix_keys(name):
+    """
+    Return the keys an item name is indexed under: the normalized name and each suffix starting at a word.
+    """
+    words = normalize(name).split(" ")
+    return [" ".join(words[i:]) for i in range(len(words)) if words[i]]
+
+def upper_bound(prefix):
+    """
+    Return the smallest string that sorts after every string starting with `prefix`.
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _encode(text):
+    # UTF-8 bytes sort in code point order, as strings do, and lone surrogates are kept
+    return text.encode("utf-8", "surrogatepass")
+
+def _encoded_keys(name):
+    """
+    Return `prefix_keys(name)` encoded, slicing one encoding of the name at each space.
+    """
+    text = _encode(normalize(name))
+    if not text:
+        return []
+    keys, position = [text], text.find(b" ")
+    while position >= 0:
+        keys.append(text[position + 1:])
+        position = text.find(b" ", position + 1)
+    return keys
+
+def _resized(values, length):
+    resized = np.zeros(length, dtype=values.dtype)
+    resized[:min(length, len(values))] = values[:length]
+    return resized
+
+class PackedKeys:
+    """
+    Read-only sorted sequence of encoded keys stored in one buffer, searchable with `bisect`.
+    """
+    def __init__(self, keys=()):
+        self.buffer = b"".join(keys)
+        self.offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, keys), dtype=np.int64, count=len(keys)), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.buffer[self.offsets[position]:self.offsets[position + 1]]
+
+    def prefix_codes(self, length):
+        """
+        Return the first `length` bytes of every key as an integer, or -1 for shorter keys.
+        """
+        buffer = np.frombuffer(self.buffer, dtype=np.uint8)
+        starts, lengths = self.offsets[:-1], np.diff(self.offsets)
+        codes = np.zeros(len(self), dtype=np.int64)
+        for index in range(length):
+            present = lengths > index
+            codes = codes * 256 + buffer[np.where(present, starts + index, 0)] * present
+        codes[lengths < length] = -1
+        return codes
+
+class PrefixIndex:
+    """
+    Thread-safe packed prefix index of item names, ranked by popularity.
+
+    Attributes:
+        ready (bool): Whether the index has been built.
+        scored_at (float): The `time.monotonic()` at which the scores were last replaced.
+        depth (int): The number of items ranked in advance for each short prefix. Suggestions
+                     up to this limit are answered from those lists.
+        short_prefix (int): The length in UTF-8 bytes up to which prefixes are ranked in advance.
+        compact_threshold (int): The number of items in the delta that starts a compaction
+                                 on a background thread.
+    """
+    def __init__(self, cache_size=10000, cache_ttl=30, depth=100, short_prefix=2, compact_threshold=10000):
+        self.ready = False
+        self.scored_at = None
+        self.depth = depth
+        self.short_prefix = short_prefix
+        self.compact_threshold = compact_threshold
+        self._keys = PackedKeys()
+        self._ids = np.zeros(0, dtype=np.int32)
+        self._groups = {}
+        self._top = {}
+        self._stale = np.zeros(0, dtype=bool)
+        self._scores = np.zeros(0, dtype=np.int64)
+        self._names = []
+        self._delta = []
+        self._delta_keys = {}
+        self._bumped = set()
+        self._touched = None
+        self._rescored = None
+        self._compacting = False
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._results = TTLCache(cache_size, cache_ttl)
+
+    def __len__(self):
+        return sum(name is not None for name in self._names)
+
+    def _grow(self, item_id):
+        if item_id >= len(self._stale):
+            length = max(item_id + 1, 2 * len(self._stale), 1024)
+            self._stale, self._scores = _resized(self._stale, length), _resized(self._scores, length)
+            self._names.extend([None] * (length - len(self._names)))
+
+    def build(self, items):
+        """
+        Replace the index with the `(item_id, name)` pairs of `items`.
+        """
+        with self._compact_lock:
+            self._fold(items)
+            self.ready = True
+        self._results.clear()
+
+    def compact(self):
+        """
+        Fold the delta into the packed keys. Suggestions and writes carry on meanwhile.
+        """
+        try:
+            with self._compact_lock:
+                self._fold(None)
+        finally:
+            self._compacting = False
+
+    def update(self, items, removed=()):
+        """
+        Index (or re-index) the `(item_id, name)` pairs of `items` and drop the `removed` item IDs.
+        """
+        with self._lock:
+            for item_id, name in items:
+                if item_id < len(self._names) and self._names[item_id] == name:
+                    continue
+                self._write(item_id, name)
+            for item_id in removed:
+                self._write(item_id, None)
+                self._scores[item_id] = 0
+            compact = self.ready and not self._compacting and len(self._delta_keys) >= self.compact_threshold
+            if compact:
+                self._compacting = True
+        self._results.clear()
+        if compact:
+            threading.Thread(target=self.compact, name="compacting the suggestion index", daemon=True).start()
+
+    def follow(self, items, removed, full):
+        """
+        Apply a load (`full` True) or refresh of the catalog. Register as a `ColumnarCatalog` listener.
+        """
+        if full:
+            self.build(items)
+        else:
+            self.update(items, removed)
+
+    def _write(self, item_id, name):
+        # A removed item keeps an empty delta entry, so a build reading older rows skips it
+        self._grow(item_id)
+        for key in self._delta_keys.pop(item_id, ()):
+            position = bisect_left(self._delta, (key, item_id))
+            if position < len(self._delta) and self._delta[position] == (key, item_id):
+                del self._delta[position]
+        keys = prefix_keys(name) if name is not None else []
+        for key in keys:
+            insort(self._delta, (key, item_id))
+        self._delta_keys[item_id] = keys
+        self._names[item_id] = name
+        self._stale[item_id] = True
+        if self._touched is not None:
+            self._touched.add(item_id)
+
+    def _fold(self, items):
+        with self._lock:
+            self._touched = set()
+            self._rescored = set()
+            current, scores = list(self._names), self._scores.copy()
+            delta_keys = dict(self._delta_keys)
+        try:
+            if items is None:
+                items = ((item_id, name) for item_id, name in enumerate(current) if name is not None)
+            names = [None] * len(current)
+            for item_id in delta_keys:
+                names[item_id] = current[item_id]
+            encoded, key_ids = [], array("i")
+            for item_id, name in items:
+                if item_id in delta_keys:
+                    continue
+                if item_id >= len(names):
+                    names.extend([None] * (item_id + 1 - len(names)))
+                names[item_id] = name
+                item_keys = _encoded_keys(name)
+                encoded.extend(item_keys)
+                key_ids.extend([item_id] * len(item_keys))
+            for item_id, item_keys in delta_keys.items():
+                encoded.extend(map(_encode, item_keys))
+                key_ids.extend([item_id] * len(item_keys))
+            order = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64)
+            keys = PackedKeys([encoded[position] for position in order.tolist()])
+            ids = np.frombuffer(key_ids, dtype=np.int32)[order]
+            del encoded, key_ids, order
+            groups = self._group(keys)
+            scores = _resized(scores, max(len(scores), len(names)))
+            top = self._rank(ids, groups, scores)
+        except BaseException:
+            with self._lock:
+                self._touched = self._rescored = None
+            raise
+
+        with self._lock:
+            touched, self._touched = self._touched, None
+            self._bumped, self._rescored = self._rescored, None
+            length = max(len(self._names), len(names))
+            names.extend([None] * (length - len(names)))
+            for item_id in touched:
+                names[item_id] = self._names[item_id]
+            self._names = names
+            self._stale = np.zeros(length, dtype=bool)
+            self._stale[np.fromiter(touched, dtype=np.int64, count=len(touched))] = True
+            self._scores = _resized(self._scores, length)
+            self._keys, self._ids, self._groups, self._top = keys, ids, groups, top
+            self._delta_keys = {item_id: keys for item_id, keys in self._delta_keys.items() if item_id in touched}
+            self._delta = [entry for entry in self._delta if entry[1] in self._delta_keys]
+
+    def _group(self, keys):
+        """
+        Return the short prefixes of the packed keys, with the range of positions of each one.
+        Keys shorter than a prefix length sort between the ranges of that length.
+        """
+        groups = {}
+        for length in range(1, self.short_prefix + 1):
+            codes = keys.prefix_codes(length)
+            bounds = np.flatnonzero(np.diff(codes)) + 1
+            starts = np.concatenate([[0], bounds]) if len(codes) else bounds
+            ends = np.append(bounds, len(codes))
+            kept = codes[starts] >= 0
+            starts, ends = starts[kept], ends[kept]
+            groups[length] = ([keys[start][:length] for start in starts.tolist()], starts, ends)
+        return groups
+
+    def _rank(self, ids, groups, scores):
+        """
+        Return the `depth` best distinct items of every short prefix, keyed by the encoded prefix.
+        """
+        # Items in popularity order, and the position of each item in it
+        ordered = np.lexsort((np.arange(len(scores)), -scores))
+        positions = np.empty(len(scores), dtype=np.int64)
+        positions[ordered] = np.arange(len(scores))
+        top = {}
+        for prefixes, starts, ends in groups.values():
+            sizes = ends - starts
+            group = np.repeat(np.arange(len(starts)), sizes)
+            members = ids[np.arange(len(group)) + np.repeat(starts - (np.cumsum(sizes) - sizes), sizes)]
+            # Sorting (prefix, popularity position) pairs ranks each prefix, and the same item
+            # under two keys of a prefix is ranked once
+            ranked = np.sort((group << SCORE_SHIFT) | positions[members])
+            ranked = ranked[np.append(True, ranked[1:] != ranked[:-1])] if len(ranked) else ranked
+            group = ranked >> SCORE_SHIFT
+            kept = np.arange(len(ranked)) - np.searchsorted(group, group) < self.depth
+            group, ranked = group[kept], ordered[ranked[kept] & ((1 << SCORE_SHIFT) - 1)].astype(np.int32)
+            bounds = np.searchsorted(group, np.arange(len(starts) + 1))
+            for index, prefix in enumerate(prefixes):
+                top[prefix] = ranked[bounds[index]:bounds[index + 1]]
+        return top
+
+    def set_scores(self, scores):
+        """
+        Replace the popularity score of every item and rank the short prefixes again. The
+        ranking runs without holding the index lock, so suggestions carry on meanwhile.
+
+        Parameters:
+            scores (iterable): `(item_id, score)` pairs. Items left out score 0.
+        """
+        scores = dict(scores)
+        with self._compact_lock:
+            with self._lock:
+                ids, groups = self._ids, self._groups
+                length = len(self._scores)
+                self._rescored = set()
+            try:
+                values = np.zeros(max([length] + [item_id + 1 for item_id in scores]), dtype=np.int64)
+                if scores:
+                    values[np.fromiter(scores, dtype=np.int64, count=len(scores))] = np.minimum(list(scores.values()), MAX_SCORE)
+                top = self._rank(ids, groups, values)
+            except BaseException:
+                with self._lock:
+                    self._rescored = None
+                raise
+            with self._lock:
+                if len(values) > len(self._scores):
+                    self._grow(len(values) - 1)
+                self._scores = _resized(values, len(self._scores))
+                self._top = top
+                self._bumped, self._rescored = self._rescored, None
+                self.scored_at = time.monotonic()
+        self._results.clear()
+
+    def add_score(self, item_id, delta=1):
+        with self._lock:
+            self._grow(item_id)
+            self._scores[item_id] = min(self._scores[item_id] + delta, MAX_SCORE)
+            self._bumped.add(item_id)
+            if self._rescored is not None:
+                self._rescored.add(item_id)
+
+    def suggest(self, prefix, limit=10):
+        """
+        Return the most popular items with a name or name word starting with `prefix`.
+
+        Returns:
+            list: `(item_id, name, score)` tuples, most popular first, then by ID.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        cached = self._results.get((prefix, limit))
+        if cached is not None:
+            return cached
+        low, high = _encode(prefix), _encode(upper_bound(prefix))
+        with self._lock:
+            packed = None
+            if len(low) <= self.short_prefix and limit <= self.depth:
+                top = self._top.get(low, self._ids[:0])
+                live = top[~self._stale[top]]
+                # A full list only holds the best items, so it answers while enough of them are live
+                if len(top) < self.depth or len(live) >= limit:
+                    packed = np.concatenate([live, np.array([
+                        item_id for item_id in self._bumped
+                        if any(key.startswith(prefix) for key in prefix_keys(self._names[item_id] or ""))
+                    ], dtype=np.int32)])
+            if packed is None:
+                start = bisect_left(self._keys, low)
+                end = bisect_left(self._keys, high, start)
+                packed = self._ids[start:end]
+                packed = packed[~self._stale[packed]]
+            start = bisect_left(self._delta, (prefix,))
+            end = bisect_left(self._delta, (upper_bound(prefix),), start)
+            delta = np.array([item_id for _, item_id in self._delta[start:end]], dtype=np.int32)
+            candidates = np.unique(np.concatenate([packed, delta])).astype(np.int64)
+            keys = ((MAX_SCORE - self._scores[candidates]) << SCORE_SHIFT) | candidates
+            if len(keys) > limit:
+                keys = keys[np.argpartition(keys, limit - 1)[:limit]]
+            keys.sort()
+            best = (keys & ((1 << SCORE_SHIFT) - 1)).tolist()
+            results = [(item_id, self._names[item_id], int(self._scores[item_id])) for item_id in best]
+        self._results.set((prefix, limit), results)
+        return results